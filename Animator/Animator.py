@@ -1,473 +1,383 @@
-import json
 import math
+import numpy
 import os
+import shutil
+import tempfile
+import time
 import unittest
-import uuid
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
 
-#
-# action classes
-#
-class AnimatorAction(object):
-  """Superclass for actions to be animated."""
-  def __init__(self):
-    self.name = "Action"
-    self.startTime = 0 # in seconds from start of script
-    self.endTime = 0
-    self.uuid = uuid.uuid4()
+from AnimatorLib.AnimatorAction import AnimatorAction
+from AnimatorLib import Bake
+from AnimatorLib import Easing
+from AnimatorLib import KeyframeTrack
+from AnimatorLib import ParallelExport
+from AnimatorLib import Playback
+from AnimatorLib import Plugins
+from AnimatorLib import Profiler
+from AnimatorLib import ScriptModel
+from AnimatorLib import Timeline
+from AnimatorLib import VideoExport
 
-  def act(self, action, scriptTime):
-    pass
-
-  def gui(self, action, layout):
-    pass
-
-class TranslationAction(AnimatorAction):
-  """Defines an animation of a transform"""
-  def __init__(self):
-    super(TranslationAction,self).__init__()
-    self.name = "Translation"
-
-  def defaultAction(self):
-    startTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
-    startTransform.SetName('Start Transform')
-    endTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
-    endTransform.SetName('End Transform')
-    animatedTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
-    animatedTransform.SetName('Animated Transform')
-
-    matrix = vtk.vtkMatrix4x4()
-    matrix.SetElement(0,3, 10)
-    matrix.SetElement(1,3, 5)
-    matrix.SetElement(2,3, 15)
-    endTransform.SetMatrixTransformFromParent(matrix)
-
-    translationAction = {
-      'name': 'Translation',
-      'class': 'TranslationAction',
-      'id': 'translation-'+str(self.uuid),
-      'startTime': 4,
-      'endTime': 5,
-      'interpolation': 'linear',
-      'startTransformID': startTransform.GetID(),
-      'endTransformID': endTransform.GetID(),
-      'animatedTransformID': animatedTransform.GetID(),
-    }
-    return(translationAction)
-
-  def act(self, action, scriptTime):
-    startTransform = slicer.mrmlScene.GetNodeByID(action['startTransformID'])
-    endTransform = slicer.mrmlScene.GetNodeByID(action['endTransformID'])
-    animatedTransform = slicer.mrmlScene.GetNodeByID(action['animatedTransformID'])
-    if scriptTime <= action['startTime']:
-      matrix = vtk.vtkMatrix4x4()
-      startTransform.GetMatrixTransformFromParent(matrix)
-      animatedTransform.SetMatrixTransformFromParent(matrix)
-    elif scriptTime >= action['endTime']:
-      matrix = vtk.vtkMatrix4x4()
-      endTransform.GetMatrixTransformFromParent(matrix)
-      animatedTransform.SetMatrixTransformFromParent(matrix)
-    else:
-      actionTime = scriptTime - action['startTime']
-      duration = action['endTime'] - action['startTime']
-      fraction = actionTime / duration
-      startMatrix = vtk.vtkMatrix4x4()
-      startTransform.GetMatrixTransformFromParent(startMatrix)
-      endMatrix = vtk.vtkMatrix4x4()
-      endTransform.GetMatrixTransformFromParent(endMatrix)
-      animatedMatrix = vtk.vtkMatrix4x4()
-      animatedMatrix.DeepCopy(startMatrix)
-      for i in range(3):
-        start = startMatrix.GetElement(i,3)
-        end = endMatrix.GetElement(i,3)
-        delta = fraction * (end-start)
-        # TODO: add interpolation and ease in/out options
-        animatedMatrix.SetElement(i,3, start + delta)
-      animatedTransform.SetMatrixTransformFromParent(animatedMatrix)
-
-class CameraRotationAction(AnimatorAction):
-  """Defines an animation of a transform"""
-  def __init__(self):
-    super(CameraRotationAction,self).__init__()
-    self.name = "Camera Rotation"
-    self.animationMethods = ['azimuth', 'elevation', 'roll']
-
-  def defaultAction(self):
-    layoutManager = slicer.app.layoutManager()
-    threeDView = layoutManager.threeDWidget(0).threeDView()
-    animatedCamera = threeDView.interactorStyle().GetCameraNode()
-    referenceCamera = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLCameraNode')
-    referenceCamera.SetName('referenceCamera')
-    referenceCamera.GetCamera().DeepCopy(animatedCamera.GetCamera())
-    cameraRotationAction = {
-      'name': 'CameraRotation',
-      'class': 'CameraRotationAction',
-      'id': 'cameraRotation-'+str(self.uuid),
-      'startTime': .1,
-      'endTime': 4,
-      'interpolation': 'linear',
-      'referenceCameraID': referenceCamera.GetID(),
-      'animatedCameraID': animatedCamera.GetID(),
-      'degreesPerSecond': 90,
-      'animationMethod': 'azimuth',
-    }
-    return(cameraRotationAction)
-
-  def act(self, action, scriptTime):
-    referenceCamera = slicer.mrmlScene.GetNodeByID(action['referenceCameraID'])
-    animatedCamera = slicer.mrmlScene.GetNodeByID(action['animatedCameraID'])
-
-    animatedCamera.GetCamera().DeepCopy(referenceCamera.GetCamera())
-    if scriptTime <= action['startTime']:
-      return
-    else:
-      actionTime = scriptTime - action['startTime']
-      if actionTime > action['endTime']:
-        actionTime = action['endTime'] # clamp to rotation at end
-      angle = actionTime * action['degreesPerSecond']
-      cameraObject = animatedCamera.GetCamera()
-      methodMapping = {'azimuth': cameraObject.Azimuth,
-                       'elevation': cameraObject.Elevation,
-                       'roll': cameraObject.Roll,}
-      methodMapping[action['animationMethod']](angle)
-      animatedCamera.GetCamera().OrthogonalizeViewUp()
-      # TODO: this->Renderer->UpdateLightsGeometryToFollowCamera()
-
-  def gui(self, action, layout):
-    super(CameraRotationAction,self).gui(action, layout)
-
-    self.referenceSelector = slicer.qMRMLNodeComboBox()
-    self.referenceSelector.nodeTypes = ["vtkMRMLCameraNode"]
-    self.referenceSelector.addEnabled = True
-    self.referenceSelector.renameEnabled = True
-    self.referenceSelector.removeEnabled = False
-    self.referenceSelector.noneEnabled = False
-    self.referenceSelector.selectNodeUponCreation = True
-    self.referenceSelector.showHidden = True
-    self.referenceSelector.showChildNodeTypes = True
-    self.referenceSelector.setMRMLScene( slicer.mrmlScene )
-    self.referenceSelector.setToolTip( "Pick the reference camera" )
-    self.referenceSelector.currentNodeID = action['referenceCameraID']
-    layout.addRow("Reference camera", self.referenceSelector)
-
-    self.animatedSelector = slicer.qMRMLNodeComboBox()
-    self.animatedSelector.nodeTypes = ["vtkMRMLCameraNode"]
-    self.animatedSelector.addEnabled = True
-    self.animatedSelector.renameEnabled = True
-    self.animatedSelector.removeEnabled = False
-    self.animatedSelector.noneEnabled = False
-    self.animatedSelector.selectNodeUponCreation = True
-    self.animatedSelector.showHidden = True
-    self.animatedSelector.showChildNodeTypes = True
-    self.animatedSelector.setMRMLScene( slicer.mrmlScene )
-    self.animatedSelector.setToolTip( "Pick the animated camera" )
-    self.animatedSelector.currentNodeID = action['animatedCameraID']
-    layout.addRow("Animated camera", self.animatedSelector)
-
-    self.rate = ctk.ctkDoubleSpinBox()
-    self.rate.suffix = " degreesPerSecond"
-    self.rate.decimals = 2
-    self.rate.minimum = 0
-    self.rate.value = action['degreesPerSecond']
-    layout.addRow("Rotation rate", self.rate)
-
-    self.method = qt.QComboBox()
-    for method in self.animationMethods:
-      self.method.addItem(method)
-    self.method.currentText = action['animationMethod']
-    layout.addRow("Animation method", self.method)
-
-  def updateFromGUI(self, action):
-    action['referenceCameraID'] = self.referenceSelector.currentNodeID
-    action['animatedCameraID'] = self.animatedSelector.currentNodeID
-    action['degreesPerSecond'] = self.rate.value
-    action['animationMethod'] = self.method.currentText
-
-class ROIAction(AnimatorAction):
-  """Defines an animation of an roi (e.g. for volume cropping)"""
+# add an module-specific dict for any module other to add animator plugins.
+# these must be subclasses (or duck types) of the AnimatorAction class.
+# Dict keys are action types and values are classes, or descriptors
+# added with register(className, displayName, modulePath) so that the
+# class is only imported when it is first used (see AnimatorLib.Plugins)
+slicer.modules.animatorActionPlugins = Plugins.registry(getattr(slicer.modules, 'animatorActionPlugins', {}))
+for className, displayName, modulePath in (
+    ('TranslationAction', 'Translation', 'AnimatorLib.TransformAction'),
+    ('CameraRotationAction', 'Camera Rotation', 'AnimatorLib.CameraAction'),
+    ('CameraPathAction', 'Camera Path', 'AnimatorLib.CameraAction'),
+    ('ROIAction', 'ROI', 'AnimatorLib.VolumeRenderingAction'),
+    ('VolumePropertyAction', 'Volume Property', 'AnimatorLib.VolumeRenderingAction'),
+    ('ThinPlateSplineAction', 'Thin Plate Spline', 'AnimatorLib.TransformAction'),
+    ('DisplacementFieldAction', 'Displacement Field', 'AnimatorLib.TransformAction'),
+    ('PropertyTrackAction', 'Property Track', 'AnimatorLib.PropertyTrack')):
+  slicer.modules.animatorActionPlugins.register(className, displayName, modulePath)
+
+
+class AnimatorFrameTransaction(object):
+  """Collects the modifications of one animation frame.
+     Every node touched during the frame has its modified events
+     deferred until the frame is done, when they are flushed together,
+     and rendering is paused so the views render once per frame
+     rather than once per modified event.
+  """
   def __init__(self):
-    super(ROIAction,self).__init__()
-    self.name = "ROI"
-
-  def defaultAction(self):
-    startROI = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLAnnotationROINode')
-    startROI.SetName('Start ROI')
-    endROI = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLAnnotationROINode')
-    endROI.SetName('End ROI')
-    for roi in [startROI, endROI]:
-      for index in range(roi.GetNumberOfDisplayNodes()):
-        roi.GetNthDisplayNode(index).SetVisibility(False)
-    #
-    # TODO: what to do if volume rendering not yet set up
-    #
-    volumeRenderingNode = slicer.mrmlScene.GetFirstNodeByName('VolumeRendering')
-    animatedROI = volumeRenderingNode.GetROINode()
-    volumeRenderingNode.SetCroppingEnabled(True)
-
-    start = [0.,]*3
-    animatedROI.GetXYZ(start)
-    startROI.SetXYZ(start)
-    endROI.SetXYZ(start)
-    animatedROI.GetRadiusXYZ(start)
-    startROI.SetRadiusXYZ(start)
-    end = [0.,]*3
-    for i in range(3):
-      end[i] = start[i] / 2.
-    endROI.SetRadiusXYZ(end)
-
-    roiAction = {
-      'name': 'ROI',
-      'class': 'ROIAction',
-      'id': 'roi-'+str(self.uuid),
-      'startTime': 1,
-      'endTime': 4,
-      'interpolation': 'linear',
-      'startROIID': startROI.GetID(),
-      'endROIID': endROI.GetID(),
-      'animatedROIID': animatedROI.GetID(),
-    }
-    return(roiAction)
-
-  def act(self, action, scriptTime):
-    startROI = slicer.mrmlScene.GetNodeByID(action['startROIID'])
-    endROI = slicer.mrmlScene.GetNodeByID(action['endROIID'])
-    animatedROI = slicer.mrmlScene.GetNodeByID(action['animatedROIID'])
-    start = [0.,]*3
-    end = [0.,]*3
-    animated = [0,]*3
-    if scriptTime <= action['startTime']:
-      startROI.GetXYZ(start)
-      animatedROI.SetXYZ(start)
-      startROI.GetRadiusXYZ(start)
-      animatedROI.SetRadiusXYZ(start)
-    elif scriptTime >= action['endTime']:
-      endROI.GetXYZ(end)
-      animatedROI.SetXYZ(end)
-      endROI.GetRadiusXYZ(end)
-      animatedROI.SetRadiusXYZ(end)
+    self.touched = set()
+    self.modifyStates = []
+
+  def touch(self, node):
+    if node not in self.touched:
+      self.touched.add(node)
+      self.modifyStates.append((node, node.StartModify()))
+
+  def __enter__(self):
+    if hasattr(slicer.app, 'pauseRender'):
+      slicer.app.pauseRender()
+    return self
+
+  def __exit__(self, exceptionType, exceptionValue, traceback):
+    try:
+      for node, modifyState in reversed(self.modifyStates):
+        node.EndModify(modifyState)
+    finally:
+      if hasattr(slicer.app, 'resumeRender'):
+        slicer.app.resumeRender()
+    return False
+
+
+class AnimationPlan(object):
+  """The compiled form of an animation script.
+     Holds the parsed actions and one plugin instance per action id.
+     Binding resolves each action's node ID references to live nodes
+     and then lets the plugin compile the action, so playing a frame
+     is only a walk over prebound act methods.
+     A timeline index over the action windows, together with the phase
+     each action was last applied in, limits a frame to the actions
+     that are interpolating or have just crossed one of their bounds.
+     A plan can also be baked, after which the interpolating actions
+     are played from samples precomputed at every frame time.
+     Actions of plugins with a batch class are played together by one
+     batch per plugin class instead of one act call each.
+  """
+  def __init__(self, script):
+    self.script = script
+    self.actions = script['actions'] if "actions" in script else {}
+    self.actionInstances = {}
+    for actionID, action in self.actions.items():
+      actionInstance = slicer.modules.animatorActionPlugins[action['class']]()
+      self.actionInstances[actionID] = actionInstance
+    self.bound = False
+    self.boundIDs = set()
+    self.danglingIDs = set()
+    self.steps = []
+    self.batches = []
+    self.batchMembers = {}
+    self.timeline = Timeline.TimelineIndex([])
+    self.baked = None
+    self.resetAppliedState()
+
+  def bind(self):
+    """Resolve the node references of every action.
+       Actions referring to nodes that are not in the scene are
+       reported and left out of playback until the nodes appear.
+    """
+    self.releaseBake()
+    self.boundIDs = set()
+    self.danglingIDs = set()
+    self.steps = []
+    self.stepInstances = []
+    self.stateKeys = []
+    self.outputNodes = []
+    for actionID, action in self.actions.items():
+      actionInstance = self.actionInstances[actionID]
+      # nodes stay empty for actions that are not bound, rather than
+      # holding on to the nodes of an earlier bind
+      actionInstance.nodes = {}
+      if hasattr(actionInstance, 'referenceKeys'):
+        referenceKeys = actionInstance.referenceKeys(action)
+      else:
+        referenceKeys = [key for key in action.keys() if key.endswith('ID')]
+      nodes = {}
+      dangling = []
+      for key in referenceKeys:
+        node = slicer.mrmlScene.GetNodeByID(action[key]) if action[key] else None
+        if node is None:
+          dangling.append(action[key])
+        else:
+          nodes[key] = node
+      if dangling:
+        logging.error("Animator action '%s' refers to missing nodes %s, skipping it" % (action['name'], dangling))
+        self.danglingIDs.update([nodeID for nodeID in dangling if nodeID])
+        continue
+      actionInstance.nodes = nodes
+      try:
+        actionInstance.easing = Easing.curve(action.get('interpolation'))
+      except ValueError as error:
+        logging.error("Animator action '%s': %s, using linear" % (action['name'], error))
+        actionInstance.easing = Easing.curve('linear')
+      try:
+        actionInstance.track = KeyframeTrack.KeyframeTrack.fromAction(action) if 'keyframes' in action else None
+      except (KeyError, ValueError) as error:
+        logging.error("Animator action '%s' has invalid keyframes (%s), skipping it" % (action['name'], error))
+        continue
+      if hasattr(actionInstance, 'compile'):
+        try:
+          actionInstance.compile(action)
+        except ValueError as error:
+          logging.error("Animator action '%s' cannot be played: %s" % (action['name'], error))
+          continue
+      self.boundIDs.update([node.GetID() for node in nodes.values()])
+      self.steps.append((actionInstance.act, action))
+      self.stepInstances.append(actionInstance)
+      self.stateKeys.append(getattr(actionInstance, 'stateKey', None))
+      if hasattr(actionInstance, 'outputKeys'):
+        outputKeys = actionInstance.outputKeys(action)
+      else:
+        outputKeys = referenceKeys
+      self.outputNodes.append([nodes[key] for key in outputKeys])
+    # steps of batched plugins, as (batch index, position in the batch)
+    self.batches = []
+    self.batchMembers = {}
+    batchSteps = {}
+    for index, actionInstance in enumerate(self.stepInstances):
+      if getattr(actionInstance, 'batch', None) is not None:
+        batchSteps.setdefault(actionInstance.batch, []).append(index)
+    for batchClass, indices in batchSteps.items():
+      for position, index in enumerate(indices):
+        self.batchMembers[index] = (len(self.batches), position)
+      self.batches.append(batchClass([self.stepInstances[index] for index in indices]))
+    outputIDs = set([node.GetID() for nodes in self.outputNodes for node in nodes])
+    self.inputNodes = [slicer.mrmlScene.GetNodeByID(nodeID) for nodeID in self.boundIDs - outputIDs]
+    self.timeline = Timeline.TimelineIndex([(action['startTime'], action['endTime']) for act, action in self.steps])
+    self.resetAppliedState()
+    self.bound = True
+
+  def unbind(self):
+    """Rebind before the next frame"""
+    self.bound = False
+
+  def resetAppliedState(self):
+    """Forget what was applied so the next frame applies every action,
+       e.g. after the animated nodes were changed outside the animation.
+    """
+    self.lastTime = None
+    self.lastActive = []
+    self.lastPhases = [None] * len(self.steps)
+
+  def act(self, scriptTime, profiler=None):
+    """Apply the actions at scriptTime.  A Profiler.FrameProfiler
+       given as profiler records the time spent in each action."""
+    if not self.bound:
+      self.bind()
+    if profiler is not None:
+      profiledFrame = profiler.beginFrame(scriptTime)
+    baked = self.baked
+    bakedFrame = None
+    if baked is not None:
+      if self.sourceMTime() != baked.sourceMTime:
+        logging.info("Animator inputs changed since the animation was baked, evaluating actions again")
+        self.releaseBake()
+        baked = None
+      else:
+        bakedFrame = baked.frame(scriptTime)
+    timeline = self.timeline
+    active = timeline.active(scriptTime)
+    if self.lastTime is None:
+      candidates = range(len(self.steps))
     else:
-      actionTime = scriptTime - action['startTime']
-      duration = action['endTime'] - action['startTime']
-      fraction = actionTime / duration
-      startROI.GetXYZ(start)
-      endROI.GetXYZ(end)
-      for i in range(3):
-        animated[i] = start[i] + fraction * (end[i]-start[i])
-      animatedROI.SetXYZ(animated)
-      startROI.GetRadiusXYZ(start)
-      endROI.GetRadiusXYZ(end)
-      for i in range(3):
-        animated[i] = start[i] + fraction * (end[i]-start[i])
-      animatedROI.SetRadiusXYZ(animated)
-
-  def gui(self, action, layout):
-    super(ROIAction,self).gui(action, layout)
-
-    self.startSelector = slicer.qMRMLNodeComboBox()
-    self.startSelector.nodeTypes = ["vtkMRMLAnnotationROINode"]
-    self.startSelector.addEnabled = True
-    self.startSelector.renameEnabled = True
-    self.startSelector.removeEnabled = False
-    self.startSelector.noneEnabled = False
-    self.startSelector.selectNodeUponCreation = True
-    self.startSelector.showHidden = True
-    self.startSelector.showChildNodeTypes = True
-    self.startSelector.setMRMLScene( slicer.mrmlScene )
-    self.startSelector.setToolTip( "Pick the start ROI" )
-    self.startSelector.currentNodeID = action['startROIID']
-    layout.addRow("Start ROI", self.startSelector)
-
-    self.endSelector = slicer.qMRMLNodeComboBox()
-    self.endSelector.nodeTypes = ["vtkMRMLAnnotationROINode"]
-    self.endSelector.addEnabled = True
-    self.endSelector.renameEnabled = True
-    self.endSelector.removeEnabled = False
-    self.endSelector.noneEnabled = False
-    self.endSelector.selectNodeUponCreation = True
-    self.endSelector.showHidden = True
-    self.endSelector.showChildNodeTypes = True
-    self.endSelector.setMRMLScene( slicer.mrmlScene )
-    self.endSelector.setToolTip( "Pick the end ROI" )
-    self.endSelector.currentNodeID = action['endROIID']
-    layout.addRow("End ROI", self.endSelector)
-
-    self.animatedSelector = slicer.qMRMLNodeComboBox()
-    self.animatedSelector.nodeTypes = ["vtkMRMLAnnotationROINode"]
-    self.animatedSelector.addEnabled = True
-    self.animatedSelector.renameEnabled = True
-    self.animatedSelector.removeEnabled = False
-    self.animatedSelector.noneEnabled = False
-    self.animatedSelector.selectNodeUponCreation = True
-    self.animatedSelector.showHidden = True
-    self.animatedSelector.showChildNodeTypes = True
-    self.animatedSelector.setMRMLScene( slicer.mrmlScene )
-    self.animatedSelector.setToolTip( "Pick the animated ROI" )
-    self.animatedSelector.currentNodeID = action['animatedROIID']
-    layout.addRow("Animated ROI", self.animatedSelector)
-
-  def updateFromGUI(self, action):
-    action['startROIID'] = self.startSelector.currentNodeID
-    action['endROIID'] = self.endSelector.currentNodeID
-    action['animatedROIID'] = self.animatedSelector.currentNodeID
-
-class VolumePropertyAction(AnimatorAction):
-  """Defines an animation of an roi (e.g. for volume cropping)"""
+      candidates = set(active)
+      candidates.update(self.lastActive)
+      candidates.update(timeline.crossed(self.lastTime, scriptTime))
+      candidates = sorted(candidates)
+    lastPhases = self.lastPhases
+    batchMembers = self.batchMembers
+    batchedMembers = {}
+    with AnimatorFrameTransaction() as transaction:
+      for index in candidates:
+        phase = timeline.phase(index, scriptTime)
+        if phase == Timeline.ACTIVE or phase != lastPhases[index]:
+          for node in self.outputNodes[index]:
+            transaction.touch(node)
+          lastPhases[index] = phase
+          act, action = self.steps[index]
+          sample = None
+          if bakedFrame is not None and phase == Timeline.ACTIVE:
+            sample = baked.sample(index, bakedFrame)
+          if sample is None and index in batchMembers:
+            batchIndex, position = batchMembers[index]
+            batchedMembers.setdefault(batchIndex, []).append(position)
+            continue
+          if profiler is not None:
+            actionStart = time.perf_counter()
+          if sample is None:
+            act(action, scriptTime)
+          else:
+            self.stepInstances[index].applyBaked(action, sample)
+          if profiler is not None:
+            profiler.record(profiledFrame, "%s %s" % (action['class'], action['id']),
+                            actionStart, time.perf_counter() - actionStart)
+      for batchIndex, positions in batchedMembers.items():
+        if profiler is not None:
+          batchStart = time.perf_counter()
+        batch = self.batches[batchIndex]
+        batch.act(positions, scriptTime)
+        if profiler is not None:
+          profiler.record(profiledFrame, "%s (%d actions)" % (type(batch).__name__, len(positions)),
+                          batchStart, time.perf_counter() - batchStart)
+      if profiler is not None:
+        updateStart = time.perf_counter()
+    if profiler is not None:
+      # ending the modifications is when observers of the nodes run
+      profiler.record(profiledFrame, Profiler.UPDATE, updateStart, time.perf_counter() - updateStart)
+      profiler.endFrame(profiledFrame)
+    self.lastTime = scriptTime
+    self.lastActive = active
+
+  def sourceMTime(self):
+    """Changes when a node the actions read from, but do not write, is modified"""
+    return max([node.GetMTime() for node in self.inputNodes] + [0])
+
+  def bake(self, memoryBudget, spillDirectory, chunkSize=1024):
+    """Sample every bakeable action at each frame time it is interpolating.
+       Returns the BakedTimeline, which is dropped when the plan is
+       rebound or an input node changes.
+    """
+    if not self.bound:
+      self.bind()
+    self.releaseBake()
+    framesPerSecond = self.script['framesPerSecond']
+    frameCount = int(math.ceil(framesPerSecond * self.script['duration']))
+    baked = Bake.BakedTimeline(framesPerSecond, frameCount, memoryBudget, spillDirectory)
+    frameTimes = baked.frameTimes()
+    for index, (act, action) in enumerate(self.steps):
+      actionInstance = self.stepInstances[index]
+      if not hasattr(actionInstance, 'bake'):
+        continue
+      frames = numpy.nonzero((frameTimes > action['startTime']) & (frameTimes < action['endTime']))[0]
+      samples = None
+      for chunkStart in range(0, len(frames), chunkSize):
+        chunk = actionInstance.bake(action, frameTimes[frames[chunkStart:chunkStart + chunkSize]])
+        if chunk is None:
+          break
+        if samples is None:
+          samples = baked.allocate(index, frames[0], len(frames), chunk.shape[1:])
+        samples[chunkStart:chunkStart + len(chunk)] = chunk
+    baked.sourceMTime = self.sourceMTime()
+    self.baked = baked
+    return baked
+
+  def releaseBake(self):
+    if self.baked is not None:
+      self.baked.release()
+      self.baked = None
+
+  def frameStateKey(self, scriptTime):
+    """A value that is equal for two script times when playing the plan
+       at either gives the same scene, or None if that cannot be told.
+       Times in the same timeline segment, equally on or off its
+       boundary, have every action in the same phase, so only the
+       active actions need to be compared.
+    """
+    if not self.bound:
+      self.bind()
+    timeline = self.timeline
+    segment = timeline.segment(scriptTime)
+    onBoundary = segment > 0 and timeline.bounds[segment - 1] == scriptTime
+    activeStates = []
+    for index in timeline.active(scriptTime):
+      stateKey = self.stateKeys[index]
+      if stateKey is None:
+        return None
+      activeStates.append((index, stateKey(self.steps[index][1], scriptTime)))
+    return (segment, onBoundary, tuple(activeStates))
+
+
+class AnimationPlanCache(object):
+  """Compiled plans keyed by animation node.
+     Observes the scene so that plans rebind when nodes they use are
+     removed or nodes they were missing are added, and drops
+     everything when the scene is closed.
+  """
   def __init__(self):
-    super(VolumePropertyAction,self).__init__()
-    self.name = "Volume Property"
-
-  def defaultAction(self):
-    startVolumeProperty = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLVolumePropertyNode')
-    startVolumeProperty.SetName('Start VolumeProperty')
-    endVolumeProperty = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLVolumePropertyNode')
-    endVolumeProperty.SetName('End VolumeProperty')
-    #
-    # TODO: what to do if volume rendering not yet set up
-    #
-    volumeRenderingNode = slicer.mrmlScene.GetFirstNodeByName('VolumeRendering')
-    if volumeRenderingNode is None:
-      volumeNode = slicer.mrmlScene.GetFirstNodeByClass('vtkMRMLScalarVolumeNode')
-      if volumeNode is None:
-          print("No volume node in the scene")
-          return
-      logic = slicer.modules.volumerendering.logic()
-      displayNode = logic.CreateVolumeRenderingDisplayNode()
-      slicer.mrmlScene.AddNode(displayNode)
-      displayNode.UnRegister(logic)
-      logic.UpdateDisplayNodeFromVolumeNode(displayNode, volumeNode)
-      volumeNode.AddAndObserveDisplayNodeID(displayNode.GetID())
-    volumeRenderingNode = slicer.mrmlScene.GetFirstNodeByName('VolumeRendering')
-    animatedVolumeProperty = volumeRenderingNode.GetVolumePropertyNode()
-
-    startVolumeProperty.CopyParameterSet(animatedVolumeProperty)
-    endVolumeProperty.CopyParameterSet(animatedVolumeProperty)
-
-    volumePropertyAction = {
-      'name': 'Volume Property',
-      'class': 'VolumePropertyAction',
-      'id': 'volumeProperty1-'+str(self.uuid),
-      'startTime': 0,
-      'endTime': 1,
-      'interpolation': 'linear',
-      'startVolumePropertyID': startVolumeProperty.GetID(),
-      'endVolumePropertyID': endVolumeProperty.GetID(),
-      'animatedVolumePropertyID': animatedVolumeProperty.GetID(),
-    }
-    return(volumePropertyAction)
-
-  def act(self, action, scriptTime):
-    startVolumeProperty = slicer.mrmlScene.GetNodeByID(action['startVolumePropertyID'])
-    endVolumeProperty = slicer.mrmlScene.GetNodeByID(action['endVolumePropertyID'])
-    animatedVolumeProperty = slicer.mrmlScene.GetNodeByID(action['animatedVolumePropertyID'])
-
-    # TODO: set only volume in the scene to use animatedVolumeProperty
-    # TODO: animated to animated
-
-    if scriptTime <= action['startTime']:
-      animatedVolumeProperty.CopyParameterSet(startVolumeProperty)
-    elif scriptTime >= action['endTime']:
-      animatedVolumeProperty.CopyParameterSet(endVolumeProperty)
-    else:
-      actionTime = scriptTime - action['startTime']
-      duration = action['endTime'] - action['startTime']
-      fraction = actionTime / duration
-      disabledModify = animatedVolumeProperty.StartModify()
-      animatedVolumeProperty.CopyParameterSet(startVolumeProperty)
-      # interpolate the scalar opacity
-      startScalarOpacity = startVolumeProperty.GetScalarOpacity()
-      endScalarOpacity = endVolumeProperty.GetScalarOpacity()
-      animatedScalarOpacity = animatedVolumeProperty.GetScalarOpacity()
-      nodeElementCount = 4
-      startValue = [0.,]*nodeElementCount
-      endValue = [0.,]*nodeElementCount
-      animatedValue = [0.,]*nodeElementCount
-      for index in range(startScalarOpacity.GetSize()):
-        startScalarOpacity.GetNodeValue(index, startValue)
-        endScalarOpacity.GetNodeValue(index, endValue)
-        for i in range(nodeElementCount):
-          animatedValue[i] = startValue[i] + fraction * (endValue[i]-startValue[i])
-        animatedScalarOpacity.SetNodeValue(index, animatedValue)
-      # interpolate the color transfer
-      startColor = startVolumeProperty.GetColor()
-      endColor = endVolumeProperty.GetColor()
-      animatedColor = animatedVolumeProperty.GetColor()
-      nodeElementCount = 6
-      startValue = [0.,]*nodeElementCount
-      endValue = [0.,]*nodeElementCount
-      animatedValue = [0.,]*nodeElementCount
-      for index in range(startColor.GetSize()):
-        startColor.GetNodeValue(index, startValue)
-        endColor.GetNodeValue(index, endValue)
-        for i in range(nodeElementCount):
-          animatedValue[i] = startValue[i] + fraction * (endValue[i]-startValue[i])
-        animatedColor.SetNodeValue(index, animatedValue)
-      animatedVolumeProperty.EndModify(disabledModify)
-
-  def gui(self, action, layout):
-    super(VolumePropertyAction,self).gui(action, layout)
-
-    self.startSelector = slicer.qMRMLNodeComboBox()
-    self.startSelector.nodeTypes = ["vtkMRMLVolumePropertyNode"]
-    self.startSelector.addEnabled = True
-    self.startSelector.renameEnabled = True
-    self.startSelector.removeEnabled = False
-    self.startSelector.noneEnabled = False
-    self.startSelector.selectNodeUponCreation = True
-    self.startSelector.showHidden = True
-    self.startSelector.showChildNodeTypes = True
-    self.startSelector.setMRMLScene( slicer.mrmlScene )
-    self.startSelector.setToolTip( "Pick the start volume property" )
-    self.startSelector.currentNodeID = action['startVolumePropertyID']
-    layout.addRow("Start VolumeProperty", self.startSelector)
-
-    self.endSelector = slicer.qMRMLNodeComboBox()
-    self.endSelector.nodeTypes = ["vtkMRMLVolumePropertyNode"]
-    self.endSelector.addEnabled = True
-    self.endSelector.renameEnabled = True
-    self.endSelector.removeEnabled = False
-    self.endSelector.noneEnabled = False
-    self.endSelector.selectNodeUponCreation = True
-    self.endSelector.showHidden = True
-    self.endSelector.showChildNodeTypes = True
-    self.endSelector.setMRMLScene( slicer.mrmlScene )
-    self.endSelector.setToolTip( "Pick the end volume property" )
-    self.endSelector.currentNodeID = action['endVolumePropertyID']
-    layout.addRow("End VolumeProperty", self.endSelector)
-
-    self.animatedSelector = slicer.qMRMLNodeComboBox()
-    self.animatedSelector.nodeTypes = ["vtkMRMLVolumePropertyNode"]
-    self.animatedSelector.addEnabled = True
-    self.animatedSelector.renameEnabled = True
-    self.animatedSelector.removeEnabled = False
-    self.animatedSelector.noneEnabled = False
-    self.animatedSelector.selectNodeUponCreation = True
-    self.animatedSelector.showHidden = True
-    self.animatedSelector.showChildNodeTypes = True
-    self.animatedSelector.setMRMLScene( slicer.mrmlScene )
-    self.animatedSelector.setToolTip( "Pick the animated volume property" )
-    self.animatedSelector.currentNodeID = action['animatedVolumePropertyID']
-    layout.addRow("Animated VolumeProperty", self.animatedSelector)
-
-  def updateFromGUI(self, action):
-    action['startVolumePropertyID'] = self.startSelector.currentNodeID
-    action['endVolumePropertyID'] = self.endSelector.currentNodeID
-    action['animatedVolumePropertyID'] = self.animatedSelector.currentNodeID
-
-
-# add an module-specific dict for any module other to add animator plugins.
-# these must be subclasses (or duck types) of the
-# AnimatorAction class below.  Dict keys are action types
-# and values are classes
-try:
-  slicer.modules.animatorActionPlugins
-except AttributeError:
-  slicer.modules.animatorActionPlugins = {}
-# slicer.modules.animatorActionPlugins['TranslationAction'] = TranslationAction ;# disable since it does nothing
-slicer.modules.animatorActionPlugins['CameraRotationAction'] = CameraRotationAction
-slicer.modules.animatorActionPlugins['ROIAction'] = ROIAction
-slicer.modules.animatorActionPlugins['VolumePropertyAction'] = VolumePropertyAction
+    self.plans = {}
+    self.observerTags = []
+
+  def get(self, animationNode):
+    return self.plans.get(animationNode)
+
+  def set(self, animationNode, plan):
+    if not self.observerTags:
+      self.observeScene()
+    self.plans[animationNode] = plan
+
+  def invalidate(self, animationNode):
+    plan = self.plans.pop(animationNode, None)
+    if plan:
+      plan.releaseBake()
+
+  def observeScene(self):
+    scene = slicer.mrmlScene
+    self.observerTags = [
+      scene.AddObserver(scene.NodeAddedEvent, self.onNodeAdded),
+      scene.AddObserver(scene.NodeRemovedEvent, self.onNodeRemoved),
+      scene.AddObserver(scene.EndCloseEvent, self.onSceneEndClose),
+    ]
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeAdded(self, caller, event, node):
+    nodeID = node.GetID()
+    for plan in self.plans.values():
+      if nodeID in plan.danglingIDs:
+        plan.unbind()
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeRemoved(self, caller, event, node):
+    self.invalidate(node)
+    if node.IsA('vtkMRMLScriptedModuleNode') and node.GetAttribute('ModuleName') == 'Animation':
+      # timing nodes only make sense with their animation
+      timingNodeIDs = [node.GetAttribute('Animator.sequenceBrowserNodeID'),
+                       node.GetAttribute('Animator.sequenceNodeID')]
+      qt.QTimer.singleShot(0, lambda: self.removeTimingNodes(node.GetID(), timingNodeIDs))
+    nodeID = node.GetID()
+    for plan in self.plans.values():
+      if nodeID in plan.boundIDs:
+        plan.unbind()
+
+  def onSceneEndClose(self, caller, event):
+    for plan in self.plans.values():
+      plan.releaseBake()
+    self.plans = {}
+
+  def removeTimingNodes(self, animationNodeID, timingNodeIDs):
+    for nodeID in timingNodeIDs:
+      node = slicer.mrmlScene.GetNodeByID(nodeID) if nodeID else None
+      if node and node.GetAttribute('Animator.animationNodeID') == animationNodeID:
+        slicer.mrmlScene.RemoveNode(node)
 
 
 #
@@ -526,6 +436,9 @@ class AnimatorWidget(ScriptedLoadableModuleWidget):
 
     self.animatorActionsGUI = None
 
+    # the scheduler of the running playback, if any
+    self.playback = None
+
     self.logic = AnimatorLogic()
 
     # Instantiate and connect widgets ...
@@ -566,25 +479,44 @@ class AnimatorWidget(ScriptedLoadableModuleWidget):
     self.animationSelector.setToolTip( "Pick the animation description." )
     parametersFormLayout.addRow("Animation Node: ", self.animationSelector)
 
-    self.sequencePlay = slicer.qMRMLSequenceBrowserPlayWidget()
-    self.sequencePlay.setMRMLScene(slicer.mrmlScene)
+    self.playButton = qt.QPushButton("Play")
+    self.playButton.checkable = True
+    self.playButton.enabled = False
+    self.playbackPolicySelector = qt.QComboBox()
+    self.playbackPolicySelector.addItem("Drop frames to finish on time", Playback.DROP_FRAMES)
+    self.playbackPolicySelector.addItem("Show every frame", Playback.EVERY_FRAME)
+    self.playbackPolicySelector.toolTip = "What to do when frames take longer than the frame rate allows"
+    self.loopCheckBox = qt.QCheckBox("Loop")
+    playbackLayout = qt.QHBoxLayout()
+    playbackLayout.addWidget(self.playButton)
+    playbackLayout.addWidget(self.playbackPolicySelector)
+    playbackLayout.addWidget(self.loopCheckBox)
+    parametersFormLayout.addRow(playbackLayout)
+
     self.sequenceSeek = slicer.qMRMLSequenceBrowserSeekWidget()
     self.sequenceSeek.setMRMLScene(slicer.mrmlScene)
-
-    parametersFormLayout.addRow(self.sequencePlay)
     parametersFormLayout.addRow(self.sequenceSeek)
 
+    self.playbackMetricsLabel = qt.QLabel()
+    parametersFormLayout.addRow("Playback", self.playbackMetricsLabel)
+
 
     self.actionsMenuButton = qt.QPushButton("Add Action")
     self.actionsMenuButton.enabled = False
     self.actionsMenu = qt.QMenu()
     self.actionsMenuButton.setMenu(self.actionsMenu)
-    for actionName in slicer.modules.animatorActionPlugins.keys():
-      qAction = qt.QAction(actionName, self.actionsMenu)
+    actionPlugins = slicer.modules.animatorActionPlugins
+    for actionName in actionPlugins.keys():
+      qAction = qt.QAction(actionPlugins.displayName(actionName), self.actionsMenu)
       qAction.connect('triggered()', lambda actionName=actionName: self.onAddAction(actionName))
       self.actionsMenu.addAction(qAction)
     parametersFormLayout.addWidget(self.actionsMenuButton)
 
+    self.bakeButton = qt.QPushButton("Bake")
+    self.bakeButton.enabled = False
+    self.bakeButton.toolTip = "Precompute every frame so scrubbing and export only look values up"
+    parametersFormLayout.addWidget(self.bakeButton)
+
     #
     # Actions Area
     #
@@ -616,6 +548,28 @@ class AnimatorWidget(ScriptedLoadableModuleWidget):
     self.fileFormatSelector.currentText = self.defaultFileFormat
     self.exportFormLayout.addRow("Animation format", self.fileFormatSelector)
 
+    # (size, format) of each output written by one export, the
+    # selected size and format when the list is empty
+    self.exportOutputs = []
+    self.outputsList = qt.QListWidget()
+    self.outputsList.toolTip = "Outputs written together, each frame is rendered once for all of them"
+    self.outputsList.setMaximumHeight(80)
+    self.exportFormLayout.addRow("Outputs", self.outputsList)
+    self.addOutputButton = qt.QPushButton("Add output")
+    self.addOutputButton.toolTip = "Also write the selected size and format in the same export"
+    self.removeOutputButton = qt.QPushButton("Remove output")
+    outputButtonsLayout = qt.QHBoxLayout()
+    outputButtonsLayout.addWidget(self.addOutputButton)
+    outputButtonsLayout.addWidget(self.removeOutputButton)
+    self.exportFormLayout.addRow(outputButtonsLayout)
+
+    self.workersBox = qt.QSpinBox()
+    self.workersBox.minimum = 1
+    self.workersBox.maximum = os.cpu_count() or 1
+    self.workersBox.value = 1
+    self.workersBox.toolTip = "Render chunks of the animation in this many background Slicer processes (1 renders in this window)"
+    self.exportFormLayout.addRow("Worker processes", self.workersBox)
+
     self.outputFileButton = qt.QPushButton("Select a file...")
     self.exportFormLayout.addRow("Output file", self.outputFileButton)
 
@@ -623,10 +577,47 @@ class AnimatorWidget(ScriptedLoadableModuleWidget):
     self.exportButton.enabled = False
     self.exportFormLayout.addRow("", self.exportButton)
 
+    #
+    # Profiling Area
+    #
+    self.profilingCollapsibleButton = ctk.ctkCollapsibleButton()
+    self.profilingCollapsibleButton.text = "Profiling"
+    self.profilingCollapsibleButton.collapsed = True
+    self.layout.addWidget(self.profilingCollapsibleButton)
+    profilingFormLayout = qt.QFormLayout(self.profilingCollapsibleButton)
+
+    self.profilingCheckBox = qt.QCheckBox()
+    self.profilingCheckBox.toolTip = "Time every frame, action and render during playback and export"
+    profilingFormLayout.addRow("Record timings", self.profilingCheckBox)
+
+    self.profileTable = qt.QTableWidget()
+    self.profileTable.setColumnCount(5)
+    self.profileTable.setHorizontalHeaderLabels(["Name", "Frames", "Mean (ms)", "95% (ms)", "Max (ms)"])
+    self.profileTable.horizontalHeader().setStretchLastSection(True)
+    self.profileTable.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+    profilingFormLayout.addRow(self.profileTable)
+
+    self.frameBudgetLabel = qt.QLabel()
+    profilingFormLayout.addRow("Frame budget", self.frameBudgetLabel)
+
+    self.refreshProfileButton = qt.QPushButton("Refresh")
+    self.saveTraceButton = qt.QPushButton("Save Chrome trace...")
+    profilingButtonsLayout = qt.QHBoxLayout()
+    profilingButtonsLayout.addWidget(self.refreshProfileButton)
+    profilingButtonsLayout.addWidget(self.saveTraceButton)
+    profilingFormLayout.addRow(profilingButtonsLayout)
+
     # connections
     self.animationSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.onSelect)
+    self.playButton.connect("toggled(bool)", self.onPlayToggled)
+    self.profilingCheckBox.connect("toggled(bool)", self.onProfilingToggled)
+    self.refreshProfileButton.connect("clicked()", self.updateProfileTable)
+    self.saveTraceButton.connect("clicked()", self.onSaveTrace)
     self.outputFileButton.connect("clicked()", self.selectExportFile)
     self.exportButton.connect("clicked()", self.onExport)
+    self.addOutputButton.connect("clicked()", self.onAddOutput)
+    self.removeOutputButton.connect("clicked()", self.onRemoveOutput)
+    self.bakeButton.connect("clicked()", self.onBake)
 
     # Add vertical spacer
     self.layout.addStretch(1)
@@ -638,11 +629,13 @@ class AnimatorWidget(ScriptedLoadableModuleWidget):
     self.sequenceBrowserObserverRecord = None
 
   def cleanup(self):
+    self.stopPlayback()
+    self.logic.stopProfiling()
     self.removeSequenceBrowserObserver()
 
   def onSelect(self):
     sequenceBrowserNode = None
-    sequenceNode = None
+    self.stopPlayback()
 
     if self.animatorActionsGUI:
       self.animatorActionsGUI.destroyGUI()
@@ -652,38 +645,128 @@ class AnimatorWidget(ScriptedLoadableModuleWidget):
 
     animationNode = self.animationSelector.currentNode()
     if animationNode:
-      sequenceBrowserNodeID = animationNode.GetAttribute('Animator.sequenceBrowserNodeID')
-      if sequenceBrowserNodeID is None:
+      if animationNode.GetAttribute("Animation.script") is None:
         self.logic.initializeAnimationNode(animationNode, self.durationBox.value)
-        sequenceBrowserNodeID = animationNode.GetAttribute('Animator.sequenceBrowserNodeID')
-      sequenceBrowserNode = slicer.mrmlScene.GetNodeByID(sequenceBrowserNodeID)
-      sequenceNodeID = animationNode.GetAttribute('Animator.sequenceNodeID')
-      sequenceNode = slicer.mrmlScene.GetNodeByID(sequenceNodeID)
+      else:
+        # reuses the timing nodes, or recreates them after a scene load
+        self.logic.compileScript(animationNode)
+      sequenceBrowserNode = self.logic.getTimingNode(animationNode, 'Animator.sequenceBrowserNodeID')
       self.removeSequenceBrowserObserver()
 
       def onBrowserModified(caller, event):
-        index = sequenceBrowserNode.GetSelectedItemNumber()
-        scriptTime = float(sequenceNode.GetNthIndexValue(index))
+        if self.playback:
+          if sequenceBrowserNode.GetSelectedItemNumber() == self.playback.currentFrame:
+            # the seek slider following the playback
+            return
+          self.stopPlayback()
+        # frame times are computed rather than read back from the sequence
+        framesPerSecond = self.logic.getPlan(animationNode).script['framesPerSecond']
+        scriptTime = sequenceBrowserNode.GetSelectedItemNumber() / framesPerSecond
         self.logic.act(animationNode, scriptTime)
       tag = sequenceBrowserNode.AddObserver(vtk.vtkCommand.ModifiedEvent, onBrowserModified)
       self.sequenceBrowserObserverRecord = (sequenceBrowserNode, tag)
 
+      self.logic.getPlan(animationNode).resetAppliedState()
+
       self.animatorActionsGUI = AnimatorActionsGUI(animationNode, deleteCallback=self.onSelect)
       self.actionsFormLayout.addRow(self.animatorActionsGUI.buildGUI())
 
     self.actionsMenuButton.enabled = animationNode != None
+    self.playButton.enabled = animationNode != None
+    self.bakeButton.enabled = animationNode != None
     self.exportCollapsibleButton.enabled = animationNode != None
-    self.sequencePlay.setMRMLSequenceBrowserNode(sequenceBrowserNode)
     self.sequenceSeek.setMRMLSequenceBrowserNode(sequenceBrowserNode)
 
+  def onPlayToggled(self, checked):
+    animationNode = self.animationSelector.currentNode()
+    if not checked or not animationNode:
+      self.stopPlayback()
+      return
+    policy = self.playbackPolicySelector.itemData(self.playbackPolicySelector.currentIndex)
+    self.playback = self.logic.playbackScheduler(animationNode, policy, self.loopCheckBox.checked)
+    sequenceBrowserNode = self.logic.getTimingNode(animationNode, 'Animator.sequenceBrowserNodeID')
+    def onFrame(frame):
+      if sequenceBrowserNode:
+        sequenceBrowserNode.SetSelectedItemNumber(frame)
+      if self.playback.shownFrames % max(1, int(self.playback.framesPerSecond)) == 0:
+        self.updatePlaybackMetrics()
+    self.playback.frameCallback = onFrame
+    self.playback.finishedCallback = self.stopPlayback
+    self.playButton.text = "Stop"
+    self.playback.start(sequenceBrowserNode.GetSelectedItemNumber() if sequenceBrowserNode else 0)
+
+  def stopPlayback(self):
+    if self.playback:
+      self.playback.stop()
+      self.updatePlaybackMetrics()
+      self.playback = None
+    self.playButton.blockSignals(True)
+    self.playButton.checked = False
+    self.playButton.blockSignals(False)
+    self.playButton.text = "Play"
+
+  def updatePlaybackMetrics(self):
+    metrics = self.playback.metrics()
+    self.playbackMetricsLabel.text = "%.1f fps, %d dropped, %d late, latency %.1f ms (95%%: %.1f ms)" % (
+      metrics['framesPerSecond'], metrics['droppedFrames'], metrics['lateFrames'],
+      metrics['latencyMean'] * 1000., metrics['latencyP95'] * 1000.)
+
   def onAddAction(self, actionName):
     animationNode = self.animationSelector.currentNode()
     if animationNode:
       actionInstance = slicer.modules.animatorActionPlugins[actionName]()
-      action = actionInstance.defaultAction()
+      try:
+        action = actionInstance.defaultAction()
+      except ValueError as error:
+        slicer.util.errorDisplay("Cannot add %s action: %s" % (actionName, error))
+        return
       self.logic.addAction(animationNode, action)
       self.onSelect()
 
+  def onBake(self):
+    animationNode = self.animationSelector.currentNode()
+    if animationNode:
+      qt.QApplication.setOverrideCursor(qt.Qt.WaitCursor)
+      try:
+        self.logic.bakeAnimation(animationNode)
+      except (OSError, MemoryError) as error:
+        slicer.util.errorDisplay("Bake failed: %s" % error)
+      finally:
+        qt.QApplication.restoreOverrideCursor()
+
+  def onProfilingToggled(self, checked):
+    if checked:
+      self.logic.startProfiling()
+    else:
+      self.logic.stopProfiling()
+      self.updateProfileTable()
+
+  def updateProfileTable(self):
+    """List the recorded timings, slowest first, with the rows whose
+       95th percentile does not fit in a frame shown in red"""
+    animationNode = self.animationSelector.currentNode()
+    frameBudget = self.logic.frameBudget(animationNode) if animationNode else None
+    self.frameBudgetLabel.text = "%.1f ms" % (frameBudget * 1000) if frameBudget else ""
+    statistics = self.logic.profileStatistics()
+    overBudget = set(self.logic.profileOverBudget(frameBudget, statistics)) if frameBudget else set()
+    names = sorted(statistics.keys(), key=lambda name: -statistics[name]['p95'])
+    self.profileTable.setRowCount(len(names))
+    for row, name in enumerate(names):
+      entry = statistics[name]
+      cells = [name, str(entry['count'])] + ["%.2f" % (entry[key] * 1000) for key in ('mean', 'p95', 'max')]
+      for column, text in enumerate(cells):
+        item = qt.QTableWidgetItem(text)
+        if name in overBudget:
+          item.setBackground(qt.QBrush(qt.QColor(255, 200, 200)))
+        self.profileTable.setItem(row, column, item)
+    self.profileTable.resizeColumnsToContents()
+
+  def onSaveTrace(self):
+    path = qt.QFileDialog.getSaveFileName(
+            slicer.util.mainWindow(), "Chrome trace", "animator-trace.json", "JSON files (*.json)")
+    if path:
+      self.logic.writeChromeTrace(path)
+
   def selectExportFile(self):
     self.outputFileButton.text = qt.QFileDialog.getSaveFileName(
             slicer.util.mainWindow(),
@@ -692,7 +775,39 @@ class AnimatorWidget(ScriptedLoadableModuleWidget):
             "")
     self.exportButton.enabled = self.outputFileButton.text != ""
 
+  def onAddOutput(self):
+    output = (self.sizeSelector.currentText, self.fileFormatSelector.currentText)
+    if output not in self.exportOutputs:
+      self.exportOutputs.append(output)
+      self.outputsList.addItem("%s %s" % output)
+
+  def onRemoveOutput(self):
+    row = self.outputsList.currentRow
+    if 0 <= row < len(self.exportOutputs):
+      del self.exportOutputs[row]
+      self.outputsList.takeItem(row)
+
+  def exportTargets(self):
+    """A VideoExport.ExportTarget per output.  With several outputs
+       the size is added to the file names."""
+    outputs = self.exportOutputs or [(self.sizeSelector.currentText, self.fileFormatSelector.currentText)]
+    targets = []
+    for sizeName, formatName in outputs:
+      size = self.sizes[sizeName]
+      outputPath = self.outputFileButton.text
+      if len(outputs) > 1:
+        outputPath += "-" + sizeName
+      outputPath += self.fileFormats[formatName]
+      if self.fileFormats[formatName] == ".gif":
+        targets.append(VideoExport.GifTarget(outputPath, size["width"], size["height"]))
+      else:
+        targets.append(VideoExport.ExportTarget(outputPath, ["-pix_fmt", "yuv420p"], size["width"], size["height"]))
+    return targets
+
   def onExport(self):
+    if self.workersBox.value > 1:
+      self.onExportParallel()
+      return
 
     # set up the threeDWidget at the correct render size
     layoutManager = slicer.app.layoutManager()
@@ -701,41 +816,57 @@ class AnimatorWidget(ScriptedLoadableModuleWidget):
     threeDWidget.setParent(None)
     threeDWidget.show()
     geometry = threeDWidget.geometry
-    size =  self.sizes[self.sizeSelector.currentText]
+    targets = self.exportTargets()
+    width, height = VideoExport.renderSize(targets)
     threeDWidget.threeDController().visible = False
-    threeDWidget.setGeometry(geometry.x(), geometry.y(), size["width"], size["height"])
+    threeDWidget.setGeometry(geometry.x(), geometry.y(), width, height)
 
-    # set up the animation nodes
-    viewNode = threeDWidget.threeDView().mrmlViewNode()
+    # render the frames and stream them to the encoders
     animationNode = self.animationSelector.currentNode()
-    sequenceBrowserNode = slicer.util.getNode(animationNode.GetAttribute('Animator.sequenceBrowserNodeID'))
-    sequenceNodes = vtk.vtkCollection()
-    sequenceBrowserNode.GetSynchronizedSequenceNodes(sequenceNodes, True) # include master
-    sequenceNode = sequenceNodes.GetItemAsObject(0)
-    frameCount = sequenceNode.GetNumberOfDataNodes()
-    tempDir = qt.QTemporaryDir()
-    fileExtension = self.fileFormats[self.fileFormatSelector.currentText]
-
-    # perform the screen capture and video creation
-    from ScreenCapture import ScreenCaptureLogic
-    logic = ScreenCaptureLogic()
-    logic.captureSequence(
-            viewNode,
-            sequenceBrowserNode,
-            0, frameCount-1, frameCount,
-            tempDir.path(),
-            "Slicer-%04d.png")
-    logic.createVideo(
-            60,
-            "-pix_fmt yuv420p",
-            tempDir.path(),
-            "Slicer-%04d.png",
-            self.outputFileButton.text+fileExtension)
-
-    # reset the view
-    threeDWidget.threeDController().visible = True
-    layoutManager.setLayout(slicer.vtkMRMLLayoutNode.SlicerLayoutFinalView) ;# force change
-    layoutManager.setLayout(oldLayout)
+    frameCount = self.logic.getFrameCount(animationNode)
+    progressDialog = slicer.util.createProgressDialog(
+            labelText="Exporting animation...", maximum=frameCount)
+    def onProgress(frame):
+      progressDialog.value = frame
+      slicer.app.processEvents()
+      return not progressDialog.wasCanceled
+    try:
+      self.logic.exportAnimationTargets(
+              animationNode,
+              threeDWidget.threeDView(),
+              targets,
+              progressCallback=onProgress)
+    except (RuntimeError, ValueError) as error:
+      slicer.util.errorDisplay("Export failed: %s" % error)
+    finally:
+      progressDialog.close()
+
+      # reset the view
+      threeDWidget.threeDController().visible = True
+      layoutManager.setLayout(slicer.vtkMRMLLayoutNode.SlicerLayoutFinalView) ;# force change
+      layoutManager.setLayout(oldLayout)
+
+  def onExportParallel(self):
+    animationNode = self.animationSelector.currentNode()
+    progressDialog = slicer.util.createProgressDialog(
+            labelText="Exporting animation in %d processes..." % self.workersBox.value)
+    def onProgress(finishedChunks, chunkCount):
+      progressDialog.maximum = chunkCount
+      progressDialog.value = finishedChunks
+      slicer.app.processEvents()
+      return not progressDialog.wasCanceled
+    try:
+      self.logic.exportTargetsParallel(
+              animationNode,
+              self.exportTargets(),
+              self.workersBox.value,
+              progressCallback=onProgress)
+    except ParallelExport.ExportCanceled:
+      pass
+    except (RuntimeError, ValueError) as error:
+      slicer.util.errorDisplay("Export failed: %s" % error)
+    finally:
+      progressDialog.close()
 
 
 class AnimatorActionsGUI(object):
@@ -781,6 +912,8 @@ class AnimatorActionsGUI(object):
       durationSlider.orientation = qt.Qt.Horizontal
       self.layout.addRow(durationSlider)
       def updateDuration(start, end, action):
+        if 'keyframes' in action:
+          KeyframeTrack.retime(action, start, end)
         action['startTime'] = start
         action['endTime'] = end
         self.logic.setAction(self.animationNode, action)
@@ -834,6 +967,17 @@ class AnimatorLogic(ScriptedLoadableModuleLogic):
   https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
   """
 
+  # parsed scripts and compiled plans, shared by all logic instances
+  # so that a setScript from the GUI invalidates the plan used for playback
+  scriptModels = ScriptModel.ScriptModelCache()
+  planCache = AnimationPlanCache()
+
+  # bytes of baked samples kept in memory, the rest is memory mapped
+  bakeMemoryBudget = 256 * 1024 * 1024
+
+  # frame timings, recorded while profiler.enabled
+  profiler = Profiler.FrameProfiler()
+
   def initializeAnimationNode(self,animationNode,duration=5):
     animationNode.SetAttribute('ModuleName', 'Animation')
     script = {}
@@ -841,85 +985,375 @@ class AnimatorLogic(ScriptedLoadableModuleLogic):
     script['duration'] = duration # in seconds
     script['framesPerSecond'] = 60
     self.setScript(animationNode, script)
+    self.flushScript(animationNode)
     self.generateSequence(animationNode)
 
   def generateSequence(self,animationNode):
-    sequenceBrowserNode = self.compileScript(animationNode)
-    sequenceNodes = vtk.vtkCollection()
-    sequenceBrowserNode.GetSynchronizedSequenceNodes(sequenceNodes, True) # include master
-    sequenceNode = sequenceNodes.GetItemAsObject(0)
-    animationNode.SetAttribute('Animator.sequenceBrowserNodeID', sequenceBrowserNode.GetID())
-    animationNode.SetAttribute('Animator.sequenceNodeID', sequenceNode.GetID())
+    self.compileScript(animationNode)
+
+  def getScriptModel(self, animationNode):
+    """The in-memory script of the node, reparsed if the node's
+       attribute was changed from outside"""
+    model = AnimatorLogic.scriptModels.get(animationNode)
+    if model.synchronize():
+      AnimatorLogic.planCache.invalidate(animationNode)
+    return model
 
   def getScript(self, animationNode):
-    scriptJSON = animationNode.GetAttribute("Animation.script") or "{}"
-    script = json.loads(scriptJSON)
-    return(script)
+    """The node's script.  This is the in-memory copy, changes to it
+       take effect with setScript or the action methods."""
+    return(self.getScriptModel(animationNode).script)
 
   def setScript(self, animationNode, script):
-    scriptJSON = json.dumps(script)
-    animationNode.SetAttribute("Animation.script", scriptJSON)
+    """Replace the script.  It is written back to the node once edits
+       pause, when the scene is saved, or on flushScript."""
+    self.getScriptModel(animationNode).setScript(script)
+    AnimatorLogic.planCache.invalidate(animationNode)
+
+  def flushScript(self, animationNode=None):
+    """Write pending script edits of the node, or of all nodes, back to
+       the 'Animation.script' attribute"""
+    if animationNode is None:
+      AnimatorLogic.scriptModels.flush()
+    else:
+      self.getScriptModel(animationNode).flush()
+
+  def getPlan(self, animationNode):
+    """Return the compiled plan for the node's script, compiling
+       it only if the script changed since the last call.
+    """
+    model = self.getScriptModel(animationNode)
+    plan = AnimatorLogic.planCache.get(animationNode)
+    if plan is None:
+      plan = AnimationPlan(model.script)
+      AnimatorLogic.planCache.set(animationNode, plan)
+    return(plan)
 
   def getActions(self, animationNode):
-    script = self.getScript(animationNode)
-    actions = script['actions'] if "actions" in script else {}
-    return(actions)
+    return(self.getScriptModel(animationNode).actions())
 
   def addAction(self, animationNode, action):
     """Add an action to the script """
-    script = self.getScript(animationNode)
-    actions = self.getActions(animationNode)
-    actions[action['id']] = action
-    script['actions'] = actions
-    self.setScript(animationNode, script)
+    self.setAction(animationNode, action)
 
   def removeAction(self, animationNode, action):
     """Remove an action from the script """
+    self.getScriptModel(animationNode).removeAction(action['id'])
+    AnimatorLogic.planCache.invalidate(animationNode)
+
+  def setAction(self, animationNode, action):
+    self.getScriptModel(animationNode).setAction(action)
+    AnimatorLogic.planCache.invalidate(animationNode)
+
+  def setKeyframe(self, animationNode, actionID, scriptTime, value=None):
+    """Add a key at scriptTime to an action, by default holding the
+       current state of the action's animated node"""
     script = self.getScript(animationNode)
-    actions = self.getActions(animationNode)
-    del(actions[action['id']])
-    script['actions'] = actions
+    action = script['actions'][actionID]
+    if value is None:
+      actionInstance = self.getBoundActionInstance(animationNode, actionID)
+      animatedKey = actionInstance.outputKeys(action)[0]
+      value = actionInstance.keyValue(actionInstance.nodes[animatedKey])
+    KeyframeTrack.setKey(action, scriptTime, value)
     self.setScript(animationNode, script)
 
-  def setAction(self, animationNode, action):
+  def removeKeyframe(self, animationNode, actionID, index):
+    script = self.getScript(animationNode)
+    KeyframeTrack.removeKey(script['actions'][actionID], index)
+    self.setScript(animationNode, script)
+
+  def convertToKeyframes(self, animationNode, actionID):
+    """Replace the start and end nodes of an action by two keys
+       at its start and end times"""
     script = self.getScript(animationNode)
-    script['actions'][action['id']] = action
+    action = script['actions'][actionID]
+    actionInstance = self.getBoundActionInstance(animationNode, actionID)
+    startKey = [key for key in actionInstance.referenceKeys(action) if key.startswith('start')][0]
+    endKey = [key for key in actionInstance.referenceKeys(action) if key.startswith('end')][0]
+    startTime, endTime = action['startTime'], action['endTime']
+    KeyframeTrack.setKey(action, startTime, actionInstance.keyValue(actionInstance.nodes[startKey]))
+    KeyframeTrack.setKey(action, endTime, actionInstance.keyValue(actionInstance.nodes[endKey]))
+    del action[startKey]
+    del action[endKey]
     self.setScript(animationNode, script)
 
+  def getBoundActionInstance(self, animationNode, actionID):
+    plan = self.getPlan(animationNode)
+    if not plan.bound:
+      plan.bind()
+    actionInstance = plan.actionInstances[actionID]
+    if not actionInstance.nodes:
+      raise ValueError("Action %s refers to nodes that are not in the scene" % actionID)
+    if actionInstance not in plan.stepInstances:
+      raise ValueError("Action %s cannot be played, see the log for the reason" % actionID)
+    return actionInstance
+
   def compileScript(self, animationNode):
-    """Convert the node's script into sequences and a sequence browser node.
+    """Create or update the timing sequence and sequence browser used to
+       play the node's script.  They are created once per animation node,
+       resized in place when the duration or frame rate changes, and
+       not saved with the scene since they only carry the frame times.
        Returns the sequenceBrowserNode.
     """
-    sequenceBrowserNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSequenceBrowserNode')
-    sequenceBrowserNode.SetName(animationNode.GetName() + "-Browser")
-
-    # TODO: use this when exporting
-    # sequenceBrowserNode.SetPlaybackItemSkippingEnabled(False)
-
-    sequenceNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSequenceNode')
-    sequenceNode.SetIndexType(sequenceNode.NumericIndex)
-    sequenceNode.SetName(animationNode.GetName() + "-TimingSequence")
-    sequenceBrowserNode.AddSynchronizedSequenceNode(sequenceNode)
+    sequenceBrowserNode = self.getTimingNode(animationNode, 'Animator.sequenceBrowserNodeID')
+    sequenceNode = self.getTimingNode(animationNode, 'Animator.sequenceNodeID')
+    if sequenceBrowserNode is None or sequenceNode is None:
+      for node in (sequenceBrowserNode, sequenceNode):
+        if node:
+          slicer.mrmlScene.RemoveNode(node)
+      sequenceBrowserNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSequenceBrowserNode')
+      sequenceBrowserNode.SetName(animationNode.GetName() + "-Browser")
+
+      # TODO: use this when exporting
+      # sequenceBrowserNode.SetPlaybackItemSkippingEnabled(False)
+
+      sequenceNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSequenceNode')
+      sequenceNode.SetIndexType(sequenceNode.NumericIndex)
+      sequenceNode.SetName(animationNode.GetName() + "-TimingSequence")
+      sequenceBrowserNode.AddSynchronizedSequenceNode(sequenceNode)
+      for node in (sequenceBrowserNode, sequenceNode):
+        node.SetSaveWithScene(False)
+        node.SetAttribute('Animator.animationNodeID', animationNode.GetID())
+      animationNode.SetAttribute('Animator.sequenceBrowserNodeID', sequenceBrowserNode.GetID())
+      animationNode.SetAttribute('Animator.sequenceNodeID', sequenceNode.GetID())
+
+    self.resizeTimingSequence(sequenceNode, self.getPlan(animationNode).script)
+    return(sequenceBrowserNode)
 
-    # create one data node per frame of the script.
-    # these are used to synchronize the animation
-    # but don't hold any other data
-    script = self.getScript(animationNode)
-    frames = script['framesPerSecond'] * script['duration']
-    secondsPerFrame = 1. / script['framesPerSecond']
-    for frame in range(math.ceil(frames)):
+  def getTimingNode(self, animationNode, attributeName):
+    """Return the timing node recorded in the attribute if it still
+       exists and belongs to this animation node, otherwise None.
+    """
+    nodeID = animationNode.GetAttribute(attributeName)
+    node = slicer.mrmlScene.GetNodeByID(nodeID) if nodeID else None
+    if node and node.GetAttribute('Animator.animationNodeID') == animationNode.GetID():
+      return node
+    return None
+
+  def resizeTimingSequence(self, sequenceNode, script):
+    """Make the sequence hold one item per frame of the script.
+       Only the frames that were added or removed are touched, and
+       existing index values are rewritten only if the frame rate changed.
+    """
+    framesPerSecond = script['framesPerSecond']
+    frameCount = math.ceil(framesPerSecond * script['duration'])
+    secondsPerFrame = 1. / framesPerSecond
+    disabledModify = sequenceNode.StartModify()
+    currentCount = sequenceNode.GetNumberOfDataNodes()
+    # remove frames past the end
+    for frame in range(currentCount-1, frameCount-1, -1):
+      sequenceNode.RemoveDataNodeAtValue(sequenceNode.GetNthIndexValue(frame))
+    currentCount = min(currentCount, frameCount)
+    # retime the remaining frames, in an order where no new value
+    # collides with a value that is yet to be updated
+    previousFramesPerSecond = sequenceNode.GetAttribute('Animator.framesPerSecond')
+    if previousFramesPerSecond is not None and float(previousFramesPerSecond) != framesPerSecond:
+      frames = range(currentCount)
+      if framesPerSecond < float(previousFramesPerSecond):
+        frames = reversed(frames)
+      for frame in frames:
+        sequenceNode.UpdateIndexValue(sequenceNode.GetNthIndexValue(frame), str(frame * secondsPerFrame))
+    # add frames to reach the end.  The data nodes are only
+    # placeholders, each one is a copy of the same empty node.
+    timePointDataNode = slicer.vtkMRMLScriptedModuleNode()
+    for frame in range(currentCount, frameCount):
       scriptTime = frame * secondsPerFrame
-      timePointDataNode = slicer.vtkMRMLScriptedModuleNode()
       sequenceNode.SetDataNodeAtValue(timePointDataNode, str(scriptTime))
-
-    return(sequenceBrowserNode)
+    sequenceNode.SetAttribute('Animator.framesPerSecond', str(framesPerSecond))
+    sequenceNode.EndModify(disabledModify)
+
+  def bakeAnimation(self, animationNode):
+    """Precompute the animation at every frame so playback and export
+       only look the values up.  The bake is dropped when the script or
+       the nodes it was computed from change."""
+    baked = self.getPlan(animationNode).bake(self.bakeMemoryBudget, slicer.app.temporaryPath)
+    logging.info("Baked %d actions, %d bytes in memory%s" % (
+                 len(baked.tracks), baked.memoryUsed,
+                 ", the rest in " + baked.spillPath if baked.spillPath else ""))
+    return baked
 
   def act(self, animationNode, scriptTime):
     """Give each action in the script a chance to act at the current script time"""
-    actions = self.getActions(animationNode)
-    for action in actions.values():
-      actionInstance = slicer.modules.animatorActionPlugins[action['class']]()
-      actionInstance.act(action, scriptTime)
+    self.getPlan(animationNode).act(scriptTime, self.activeProfiler())
+
+  def playbackScheduler(self, animationNode, policy=Playback.DROP_FRAMES, loop=False):
+    """A Playback.PlaybackScheduler that plays the animation in the views
+       in real time"""
+    return Playback.PlaybackScheduler(lambda scriptTime: self.act(animationNode, scriptTime),
+                                      slicer.util.forceRenderAllViews,
+                                      self.getFrameCount(animationNode),
+                                      self.getPlan(animationNode).script['framesPerSecond'],
+                                      policy, loop)
+
+  def activeProfiler(self):
+    return AnimatorLogic.profiler if AnimatorLogic.profiler.enabled else None
+
+  def startProfiling(self):
+    """Record the time of each frame, action and 3D view render"""
+    profiler = AnimatorLogic.profiler
+    profiler.clear()
+    profiler.removeRenderObservers()
+    layoutManager = slicer.app.layoutManager()
+    if layoutManager:
+      for index in range(layoutManager.threeDViewCount):
+        profiler.observeRenderWindow(layoutManager.threeDWidget(index).threeDView().renderWindow())
+    profiler.enabled = True
+
+  def stopProfiling(self):
+    AnimatorLogic.profiler.enabled = False
+    AnimatorLogic.profiler.removeRenderObservers()
+
+  def frameBudget(self, animationNode):
+    """Seconds available for a frame at the script's frame rate"""
+    return 1. / self.getPlan(animationNode).script['framesPerSecond']
+
+  def profileStatistics(self, bins=20):
+    """Per action, and for whole frames, updates and renders, the count,
+       mean, max, percentiles and histogram of the recorded seconds"""
+    return AnimatorLogic.profiler.statistics(bins)
+
+  def profileOverBudget(self, frameBudget, statistics=None):
+    """Names of the recorded timings whose 95th percentile takes longer
+       than frameBudget seconds"""
+    return AnimatorLogic.profiler.overBudget(frameBudget, statistics=statistics)
+
+  def writeChromeTrace(self, path):
+    AnimatorLogic.profiler.writeChromeTrace(path)
+
+  def getFrameCount(self, animationNode):
+    script = self.getPlan(animationNode).script
+    return(math.ceil(script['framesPerSecond'] * script['duration']))
+
+  def getFfmpegPath(self):
+    from ScreenCapture import ScreenCaptureLogic
+    screenCaptureLogic = ScreenCaptureLogic()
+    if not screenCaptureLogic.isFfmpegPathValid():
+      raise ValueError("ffmpeg is not configured, set it up in the Screen Capture module")
+    return(screenCaptureLogic.getFfmpegPath())
+
+  def exportAnimation(self, animationNode, threeDView, outputPath, outputOptions=[],
+                      startFrame=0, endFrame=None, progressCallback=None):
+    """Render frames [startFrame,endFrame) of the animation in the view and
+       stream them as raw RGB into an ffmpeg process writing outputPath.
+       Frames whose animation state matches the previous frame are not
+       rendered again, the previous image is repeated instead.
+       progressCallback(frame) is called after each frame and can
+       return False to cancel the export.
+       Returns the number of frames that were rendered.
+    """
+    return self.exportAnimationTargets(animationNode, threeDView,
+                                       [VideoExport.ExportTarget(outputPath, outputOptions)],
+                                       startFrame, endFrame, progressCallback)
+
+  def exportAnimationTargets(self, animationNode, threeDView, targets,
+                             startFrame=0, endFrame=None, progressCallback=None):
+    """Like exportAnimation, but write every VideoExport.ExportTarget in
+       the same pass.  Each frame is rendered once at the view's size and
+       cropped and scaled to the size of each target by its encoder.
+       Targets that are encoded in two steps, like GIFs, are finished
+       once all frames are written.
+    """
+    plan = self.getPlan(animationNode)
+    framesPerSecond = plan.script['framesPerSecond']
+    if endFrame is None:
+      endFrame = self.getFrameCount(animationNode)
+    ffmpegPath = self.getFfmpegPath()
+    plan.resetAppliedState()
+    grabber = VideoExport.FrameGrabber(threeDView.renderWindow())
+    stream = None
+    lastStateKey = None
+    renderedFrames = 0
+    try:
+      for frame in range(startFrame, endFrame):
+        scriptTime = frame / framesPerSecond
+        stateKey = plan.frameStateKey(scriptTime)
+        if stream is not None and stateKey is not None and stateKey == lastStateKey:
+          stream.repeat()
+        else:
+          lastStateKey = stateKey
+          plan.act(scriptTime, self.activeProfiler())
+          renderedFrames += 1
+          threeDView.forceRender()
+          image = grabber.grab()
+          # most encoders need even dimensions
+          image = image[:image.shape[0] - image.shape[0] % 2, :image.shape[1] - image.shape[1] % 2]
+          if stream is None:
+            stream = VideoExport.FrameStream.forTargets(ffmpegPath, targets, image.shape, framesPerSecond)
+          stream.submit(image)
+        if progressCallback and progressCallback(frame) == False:
+          stream.abort()
+          stream = None
+          for target in targets:
+            target.discard()
+          break
+      if stream:
+        closedStream, stream = stream, None
+        closedStream.close()
+        for target in targets:
+          target.finish(ffmpegPath, endFrame - startFrame, framesPerSecond)
+    except Exception:
+      if stream:
+        stream.abort()
+      for target in targets:
+        target.discard()
+      raise
+    logging.info("Animator export rendered %d of %d frames" % (renderedFrames, endFrame - startFrame))
+    return renderedFrames
+
+  def exportAnimationParallel(self, animationNode, outputPath, width, height, outputOptions,
+                              workerCount, progressCallback=None):
+    """Export the animation by rendering chunks of frames in workerCount
+       headless Slicer processes, each loading a saved copy of the scene,
+       and joining the encoded chunks in order.
+       progressCallback(finishedChunks, chunkCount) can return False to cancel,
+       which raises ParallelExport.ExportCanceled.
+    """
+    self.exportTargetsParallel(animationNode,
+                               [VideoExport.ExportTarget(outputPath, outputOptions, width, height)],
+                               workerCount, progressCallback)
+
+  def exportTargetsParallel(self, animationNode, targets, workerCount, progressCallback=None):
+    """Like exportAnimationParallel, but write every VideoExport.ExportTarget.
+       The workers render each frame once, at the size of the largest
+       target, and encode a chunk for every target.
+    """
+    renderSize = VideoExport.renderSize(targets)
+    if renderSize is None:
+      raise ValueError("Parallel export needs the size of at least one output")
+    ffmpegPath = self.getFfmpegPath()
+    workDirectory = tempfile.mkdtemp(prefix='Animator-', dir=slicer.app.temporaryPath)
+    try:
+      scenePath = os.path.join(workDirectory, 'scene.mrb')
+      # the workers read the script from the saved node attribute
+      self.flushScript(animationNode)
+      if not slicer.util.saveScene(scenePath):
+        raise RuntimeError("Could not save the scene for the export workers")
+      outputs = []
+      for target in targets:
+        outputPath, outputOptions = target.encoderOutput()
+        extension = os.path.splitext(outputPath)[1].lower()
+        if extension in ['.mp4', '.mkv', '.mov']:
+          # chunks in the final codec are joined without re-encoding
+          chunkOptions, chunkExtension, finalOptions = outputOptions, extension, ['-c', 'copy']
+        else:
+          # other formats are rendered to a lossless intermediate and encoded once
+          chunkOptions, chunkExtension, finalOptions = ['-c:v', 'ffv1'], '.mkv', outputOptions
+        outputs.append(ParallelExport.ExportOutput(outputPath, target.width, target.height,
+                                                   chunkOptions, chunkExtension, finalOptions))
+      exporter = ParallelExport.ParallelExporter(
+                   slicer.app.launcherExecutableFilePath, ffmpegPath,
+                   scenePath, animationNode.GetID(), workDirectory,
+                   renderSize[0], renderSize[1], outputs, workerCount)
+      frameCount = self.getFrameCount(animationNode)
+      exporter.run(frameCount, progressCallback)
+      for target in targets:
+        target.finish(ffmpegPath, frameCount, self.getPlan(animationNode).script['framesPerSecond'])
+    except Exception:
+      for target in targets:
+        target.discard()
+      raise
+    finally:
+      shutil.rmtree(workDirectory, ignore_errors=True)
 
 
 class AnimatorTest(ScriptedLoadableModuleTest):
@@ -939,6 +1373,20 @@ class AnimatorTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_Animator1()
+    self.test_TransformInterpolation()
+    self.test_Easing()
+    self.test_Timeline()
+    self.test_KeyframeTrack()
+    self.test_CameraPath()
+    self.test_Playback()
+    self.test_PropertyTrack()
+    self.test_Plugins()
+    self.test_ScriptStorage()
+    self.test_Bake()
+    self.test_FrameStateKey()
+    self.test_TransferFunctions()
+    self.test_VideoExport()
+    self.test_DanglingReferences()
 
   def test_Animator1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -982,15 +1430,11 @@ class AnimatorTest(ScriptedLoadableModuleTest):
 
     #
     # set up a translation action
-    # - this is just an example, it's not used in the self test
     #
-
-    #actionInstance = slicer.modules.animatorActionPlugins["TranslationAction"]()
-    #translationAction = actionInstance.defaultAction()
-    #mrHead.SetAndObserveTransformNodeID(translationAction['animatedTransformID'])
-    # don't add this because it's not a fully worked out example
-    # (it does translation only, not full transformation interpolation)
-    #logic.addAction(animationNode, translationAction)
+    actionInstance = slicer.modules.animatorActionPlugins["TranslationAction"]()
+    translationAction = actionInstance.defaultAction()
+    mrHead.SetAndObserveTransformNodeID(translationAction['animatedTransformID'])
+    logic.addAction(animationNode, translationAction)
 
     #
     # set up a camera rotation action
@@ -1018,15 +1462,563 @@ class AnimatorTest(ScriptedLoadableModuleTest):
     #
     sequenceBrowserNode = logic.compileScript(animationNode)
 
-    sequenceNodes = vtk.vtkCollection()
-    sequenceBrowserNode.GetSynchronizedSequenceNodes(sequenceNodes, True) # include master
-    sequenceNode = sequenceNodes.GetItemAsObject(0)
-
-    animationNode.SetAttribute('Animator.sequenceBrowserNodeID', sequenceBrowserNode.GetID())
-    animationNode.SetAttribute('Animator.sequenceNodeID', sequenceNode.GetID())
-
     slicer.modules.AnimatorWidget.animationSelector.setCurrentNode(animationNode)
 
     sequenceBrowserNode.SetPlaybackActive(True)
 
     self.delayDisplay('Test passed!', 10)
+
+  def test_TransformInterpolation(self):
+    """Check the batched transform interpolation against known matrices"""
+    self.delayDisplay("Starting the transform interpolation test", 10)
+    from AnimatorLib import TransformInterpolation
+
+    def rotationAboutS(degrees):
+      matrix = numpy.eye(4)
+      radians = math.radians(degrees)
+      matrix[:2,:2] = [[math.cos(radians), -math.sin(radians)],
+                       [math.sin(radians), math.cos(radians)]]
+      return matrix
+
+    startMatrix = rotationAboutS(0)
+    startMatrix[:3,3] = [10, 0, 0]
+    endMatrix = rotationAboutS(90)
+    endMatrix[:3,:3] *= 2
+    interpolator = TransformInterpolation.TransformInterpolator(startMatrix, endMatrix)
+    matrices = interpolator.evaluate([0, 0.5, 1])
+    self.assertEqual(matrices.shape, (3,4,4))
+    self.assertTrue(numpy.allclose(matrices[0], startMatrix))
+    self.assertTrue(numpy.allclose(matrices[2], endMatrix))
+    middleMatrix = rotationAboutS(45)
+    middleMatrix[:3,:3] *= 1.5
+    middleMatrix[:3,3] = [5, 0, 0]
+    self.assertTrue(numpy.allclose(matrices[1], middleMatrix))
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_Easing(self):
+    """Check the sampled easing curves behind the 'interpolation' key"""
+    self.delayDisplay("Starting the easing test", 10)
+
+    interpolations = Easing.presetNames + [
+      {'type': 'cubicBezier', 'controlPoints': [0.42, 0, 0.58, 1]},
+      {'type': 'step', 'steps': 4},
+      {'type': 'spline', 'points': [[0.3, 0.6], [0.7, 0.8]]},
+    ]
+    for interpolation in interpolations:
+      curve = Easing.curve(interpolation)
+      self.assertEqual(curve(0), 0)
+      self.assertEqual(curve(1), 1)
+      samples = curve.evaluate(numpy.linspace(0, 1, 101))
+      self.assertTrue(numpy.all(numpy.diff(samples) >= 0))
+    self.assertIs(Easing.curve('easeIn'), Easing.curve('easeIn'))
+    self.assertAlmostEqual(Easing.curve('linear')(0.3), 0.3)
+    self.assertAlmostEqual(Easing.curve({'type': 'cubicBezier', 'controlPoints': [0.42, 0, 0.58, 1]})(0.5), 0.5, places=3)
+    self.assertEqual(Easing.curve({'type': 'step', 'steps': 4})(0.3), 0.25)
+    # steps change right at their boundary
+    threeSteps = Easing.curve({'type': 'step', 'steps': 3})
+    self.assertAlmostEqual(threeSteps(0.3335), 1/3.)
+    numpy.testing.assert_allclose(threeSteps.evaluate([0.3332, 0.3335, 0.6668]), [0, 1/3., 2/3.])
+    with self.assertRaises(ValueError):
+      Easing.curve('bounce')
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_Timeline(self):
+    """Check the interval index used to skip idle actions"""
+    self.delayDisplay("Starting the timeline test", 10)
+
+    timeline = Timeline.TimelineIndex([(0, 1), (0.5, 4), (2, 2), (3, 5)])
+    self.assertEqual(timeline.active(0), [])
+    self.assertEqual(timeline.active(0.75), [0, 1])
+    self.assertEqual(timeline.active(2), [1])
+    self.assertEqual(timeline.active(3.5), [1, 3])
+    self.assertEqual(timeline.active(6), [])
+    self.assertEqual(timeline.phase(2, 2), Timeline.BEFORE)
+    self.assertEqual(timeline.phase(0, 1), Timeline.AFTER)
+    self.assertEqual(sorted(set(timeline.crossed(1.5, 2.5))), [2])
+    self.assertEqual(sorted(set(timeline.crossed(6, 0.9))), [0, 1, 2, 3])
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_KeyframeTrack(self):
+    """Check keyframe lookup and editing"""
+    self.delayDisplay("Starting the keyframe track test", 10)
+
+    track = KeyframeTrack.KeyframeTrack([2, 0, 1, 1], [[4], [0], [1], [3]])
+    self.assertEqual(track.times.tolist(), [0, 1, 1, 2])
+    values = track.evaluate([-1, 0.5, 1, 1.5, 3])[:,0]
+    self.assertEqual(values.tolist(), [0, 0.5, 3, 3.5, 4])
+    self.assertEqual(KeyframeTrack.KeyframeTrack([1], [[7, 8]]).evaluate([0, 2]).tolist(), [[7, 8], [7, 8]])
+
+    action = {'startTime': 0, 'endTime': 0}
+    KeyframeTrack.setKey(action, 2, [1])
+    KeyframeTrack.setKey(action, 1, [0])
+    KeyframeTrack.setKey(action, 2, [5])
+    self.assertEqual(action['keyframes'], {'times': [1, 2], 'values': [[0], [5]]})
+    self.assertEqual((action['startTime'], action['endTime']), (1, 2))
+    KeyframeTrack.removeKey(action, 0)
+    self.assertEqual((action['startTime'], action['endTime']), (2, 2))
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_CameraPath(self):
+    """Check that camera paths pass the keys at constant speed"""
+    self.delayDisplay("Starting the camera path test", 10)
+    from AnimatorLib import CameraPath
+
+    keyCameras = [[0, 0, 0, 0, 0, -1, 0, 1, 0],
+                  [10, 0, 0, 10, 0, -1, 0, 1, 0],
+                  [12, 2, 0, 12, 2, -1, 0, 1, 0],
+                  [30, 5, 0, 30, 5, -1, 0, 1, 0]]
+    path = CameraPath.CameraPath(keyCameras)
+    cameras = path.evaluate(numpy.linspace(0, 1, 101))
+    numpy.testing.assert_allclose(cameras[0], keyCameras[0], atol=1e-9)
+    numpy.testing.assert_allclose(cameras[-1], keyCameras[-1], atol=1e-9)
+    steps = numpy.linalg.norm(numpy.diff(cameras[:,0:3], axis=0), axis=1)
+    self.assertLess(steps.max() - steps.min(), 0.1 * steps.mean())
+    numpy.testing.assert_allclose(numpy.linalg.norm(cameras[:,6:9], axis=1), 1)
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_PropertyTrack(self):
+    """Check the batched evaluation of property tracks against KeyframeTrack"""
+    self.delayDisplay("Starting the property track test", 10)
+    from AnimatorLib import PropertyTrack
+
+    rng = numpy.random.default_rng(0)
+    tracks = []
+    easings = []
+    for index, keyCount in enumerate([1, 2, 5, 2, 8]):
+      times = numpy.sort(rng.uniform(0, 10, keyCount))
+      tracks.append(KeyframeTrack.KeyframeTrack(times, rng.normal(size=(keyCount, 3))))
+      easings.append(Easing.curve(['linear', 'easeInOut', 'step', 'easeIn', {'type': 'step', 'steps': 4}][index]))
+    group = PropertyTrack.TrackGroup(tracks, easings)
+    for scriptTime in numpy.linspace(-1, 11, 97):
+      expected = [track.evaluate([scriptTime], easing)[0] for track, easing in zip(tracks, easings)]
+      numpy.testing.assert_allclose(group.evaluate(scriptTime), expected, atol=1e-12)
+    # steps change right at their boundary
+    stepGroup = PropertyTrack.TrackGroup([KeyframeTrack.KeyframeTrack([0, 1], [[0.], [3.]])],
+                                         [Easing.curve({'type': 'step', 'steps': 3})])
+    numpy.testing.assert_allclose(stepGroup.evaluate(0.3335), [[1.]])
+    numpy.testing.assert_allclose(stepGroup.evaluate(0.3332), [[0.]])
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_Plugins(self):
+    """Check that plugins registered by descriptor are imported on first use"""
+    self.delayDisplay("Starting the plugin registry test", 10)
+
+    registry = Plugins.ActionPluginRegistry({'TranslationAction': object})
+    registry.register('PropertyTrackAction', 'Property Track', 'AnimatorLib.PropertyTrack')
+    self.assertEqual(registry.displayName('PropertyTrackAction'), 'Property Track')
+    self.assertEqual(registry.displayName('TranslationAction'), 'TranslationAction')
+    self.assertFalse(registry.isLoaded('PropertyTrackAction'))
+    self.assertEqual(registry['PropertyTrackAction'].__name__, 'PropertyTrackAction')
+    self.assertTrue(registry.isLoaded('PropertyTrackAction'))
+    self.assertIsNone(registry.get('MissingAction'))
+    registry.register('ROIAction', 'ROI', 'AnimatorLib.VolumeRenderingAction')
+    descriptors = registry.descriptors()
+    self.assertEqual([descriptor.displayName for descriptor in descriptors],
+                     ['TranslationAction', 'Property Track', 'ROI'])
+    self.assertEqual(descriptors[2].modulePath, 'AnimatorLib.VolumeRenderingAction')
+    self.assertFalse(registry.isLoaded('ROIAction'))
+    plugins = registry.values()
+    self.assertFalse(registry.isLoaded('ROIAction'))
+    self.assertEqual(len(list(plugins)), 3)
+    self.assertTrue(registry.isLoaded('ROIAction'))
+    self.assertIs(Plugins.registry(registry), registry)
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_ScriptStorage(self):
+    """Check the round trip of large scripts through the payload node"""
+    self.delayDisplay("Starting the script storage test", 10)
+    import json
+    from AnimatorLib import ScriptStorage
+
+    size = ScriptStorage.MIN_ARRAY_SIZE
+    script = {
+      'ints': list(range(size)),
+      'floats': [0.5 * index for index in range(size)],
+      'mixed': [1.5] * (size - 1) + [2],
+      'nested': {'points': [[index, index + 0.25, -index] for index in range(size)]},
+      'short': list(range(size - 1)),
+      'booleans': [1, True] * size,
+      'name': 'storage',
+    }
+    header, payload = ScriptStorage.pack(script)
+    for key in ('ints', 'floats', 'mixed'):
+      self.assertEqual(header[key], {ScriptStorage.ARRAY_KEY: header[key][ScriptStorage.ARRAY_KEY]})
+    self.assertEqual(header['short'], script['short'])
+    self.assertEqual(header['booleans'], script['booleans'])
+    restored = ScriptStorage.unpack(json.loads(json.dumps(header)), payload)
+    self.assertEqual(restored, script)
+    self.assertTrue(all(isinstance(value, int) for value in restored['ints']))
+    # mixed lists come back as floats
+    self.assertTrue(all(isinstance(value, float) for value in restored['mixed']))
+    self.assertIs(restored['booleans'][1], True)
+    with self.assertRaises(ValueError):
+      ScriptStorage.unpack(header, None)
+    with self.assertRaises(ValueError):
+      ScriptStorage.unpack(header, ScriptStorage.pack({'other': list(range(size))})[1])
+    with self.assertRaises(ValueError):
+      ScriptStorage.join({'keys': {ScriptStorage.ARRAY_KEY: 'a0'}}, {})
+
+    # a script past the inline limit is flushed to a payload node and
+    # read back by a new model
+    animationNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScriptedModuleNode')
+    model = ScriptModel.ScriptModel(animationNode)
+    largeScript = {'title': 'storage', 'values': list(range(ScriptStorage.INLINE_LIMIT // 4)), 'actions': {}}
+    model.setScript(largeScript)
+    payloadNode = model.flush()
+    self.assertIsNotNone(payloadNode)
+    self.assertIs(animationNode.GetNodeReference(ScriptStorage.PAYLOAD_ROLE), payloadNode)
+    self.assertLess(len(animationNode.GetAttribute("Animation.script")), ScriptStorage.INLINE_LIMIT)
+    self.assertEqual(ScriptModel.ScriptModel(animationNode).script, largeScript)
+
+    # edits of a script with a payload wait for the timer and are packed once
+    packedScripts = []
+    pack = ScriptStorage.pack
+    ScriptStorage.pack = lambda script: packedScripts.append(script) or pack(script)
+    try:
+      for index in range(5):
+        model.setAction({'id': 'edit', 'class': 'PropertyTrackAction', 'startTime': 0, 'endTime': index})
+      self.assertEqual(packedScripts, [])
+      self.assertTrue(model.dirty)
+      model.flush()
+      model.flush()
+    finally:
+      ScriptStorage.pack = pack
+    self.assertEqual(len(packedScripts), 1)
+    self.assertEqual(ScriptModel.ScriptModel(animationNode).script['actions']['edit']['endTime'], 4)
+
+    model.setScript({'title': 'storage'})
+    self.assertIsNone(model.flush())
+    self.assertIsNone(animationNode.GetNodeReference(ScriptStorage.PAYLOAD_ROLE))
+    model.setScript(largeScript)
+    model.flush()
+    # a header without its payload is not loaded
+    slicer.mrmlScene.RemoveNode(animationNode.GetNodeReference(ScriptStorage.PAYLOAD_ROLE))
+    with self.assertRaises(ValueError):
+      ScriptModel.ScriptModel(animationNode)
+
+    self.delayDisplay('Test passed!', 10)
+
+  def addTransformAndROIAnimation(self, logic):
+    """An animation of a linear transform and an roi, and a function
+       returning the state of their animated nodes as an array"""
+    scene = slicer.mrmlScene
+    startTransform, endTransform, animatedTransform = [
+      scene.AddNewNodeByClass('vtkMRMLLinearTransformNode') for index in range(3)]
+    transform = vtk.vtkTransform()
+    transform.RotateWXYZ(60, 0, 0, 1)
+    transform.Translate(10, 0, 5)
+    endMatrix = vtk.vtkMatrix4x4()
+    transform.GetMatrix(endMatrix)
+    endTransform.SetMatrixTransformFromParent(endMatrix)
+    startROI, endROI, animatedROI = [scene.AddNewNodeByClass('vtkMRMLAnnotationROINode') for index in range(3)]
+    startROI.SetRadiusXYZ([1, 1, 1])
+    endROI.SetXYZ([5, -3, 2])
+    endROI.SetRadiusXYZ([4, 6, 8])
+    actions = [
+      {'name': 'Translation', 'class': 'TranslationAction', 'id': 'testTranslation',
+       'startTime': 0.25, 'endTime': 1.5, 'interpolation': 'easeInOut',
+       'startTransformID': startTransform.GetID(), 'endTransformID': endTransform.GetID(),
+       'animatedTransformID': animatedTransform.GetID()},
+      {'name': 'ROI', 'class': 'ROIAction', 'id': 'testROI',
+       'startTime': 0, 'endTime': 2, 'interpolation': 'linear',
+       'startROIID': startROI.GetID(), 'endROIID': endROI.GetID(), 'animatedROIID': animatedROI.GetID()},
+    ]
+    animationNode = scene.AddNewNodeByClass('vtkMRMLScriptedModuleNode')
+    animationNode.SetAttribute('ModuleName', 'Animation')
+    logic.setScript(animationNode, {'title': 'Test', 'duration': 2, 'framesPerSecond': 30,
+                                    'actions': dict([(action['id'], action) for action in actions])})
+
+    def state():
+      matrix = vtk.vtkMatrix4x4()
+      animatedTransform.GetMatrixTransformFromParent(matrix)
+      center = [0.] * 3
+      radius = [0.] * 3
+      animatedROI.GetXYZ(center)
+      animatedROI.GetRadiusXYZ(radius)
+      return numpy.concatenate([slicer.util.arrayFromVTKMatrix(matrix).ravel(), center, radius])
+    return animationNode, state
+
+  def test_Bake(self):
+    """Check that baked playback, partly spilled to disk, sets the nodes as live playback does"""
+    self.delayDisplay("Starting the bake test", 10)
+
+    logic = AnimatorLogic()
+    animationNode, state = self.addTransformAndROIAnimation(logic)
+    plan = logic.getPlan(animationNode)
+    frames = [0, 1, 7, 8, 20, 44, 45, 46, 59]
+    frameTimes = [frame / 30. for frame in frames]
+    plan.releaseBake()
+    liveStates = []
+    for scriptTime in frameTimes:
+      plan.resetAppliedState()
+      plan.act(scriptTime)
+      liveStates.append(state())
+
+    # the roi's 59 samples fit in memory, the transform's spill
+    baked = plan.bake(59 * 6 * 8, slicer.app.temporaryPath)
+    self.assertEqual(len(baked.tracks), 2)
+    self.assertGreater(baked.memoryUsed, 0)
+    spillPath = baked.spillPath
+    self.assertTrue(os.path.isdir(spillPath))
+    self.assertEqual(len(os.listdir(spillPath)), 1)
+    for index, (act, action) in enumerate(plan.steps):
+      self.assertIsNotNone(baked.sample(index, 20))
+    for scriptTime, liveState in zip(frameTimes, liveStates):
+      plan.resetAppliedState()
+      plan.act(scriptTime)
+      numpy.testing.assert_allclose(state(), liveState, atol=1e-9)
+    self.assertIs(plan.baked, baked)
+
+    plan.releaseBake()
+    self.assertIsNone(plan.baked)
+    self.assertFalse(os.path.exists(spillPath))
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_FrameStateKey(self):
+    """Check that frames with equal state keys leave the nodes in the same state"""
+    self.delayDisplay("Starting the frame state key test", 10)
+
+    logic = AnimatorLogic()
+    animationNode, state = self.addTransformAndROIAnimation(logic)
+    script = logic.getScript(animationNode)
+    translation = script['actions']['testTranslation']
+    translation['endTime'] = 0.75
+    translation['interpolation'] = {'type': 'step', 'steps': 2}
+    roi = script['actions']['testROI']
+    roi['interpolation'] = {'type': 'step', 'steps': 3}
+    # keys on frame times, the last segment holding still
+    for scriptTime, value in ((0.5, [0, 0, 0, 1, 1, 1]), (1., [5, -3, 2, 4, 6, 8]), (1.5, [5, -3, 2, 4, 6, 8])):
+      KeyframeTrack.setKey(roi, scriptTime, value)
+    logic.setScript(animationNode, script)
+    # a zero length jump back to the start transform on a frame time
+    logic.addAction(animationNode, dict(translation, id='testJump', startTime=1., endTime=1.,
+                                        interpolation='linear',
+                                        startTransformID=translation['endTransformID'],
+                                        endTransformID=translation['startTransformID']))
+
+    plan = logic.getPlan(animationNode)
+    plan.resetAppliedState()
+    keys = []
+    states = []
+    for frame in range(logic.getFrameCount(animationNode)):
+      scriptTime = frame / 30.
+      keys.append(plan.frameStateKey(scriptTime))
+      plan.act(scriptTime)
+      states.append(state())
+    self.assertNotIn(None, keys)
+    repeated = [frame for frame in range(1, len(keys)) if keys[frame] == keys[frame - 1]]
+    # idle frames before and after the actions, and frames within a step
+    for frame in (1, 17, 59):
+      self.assertIn(frame, repeated)
+    for frame in repeated:
+      numpy.testing.assert_array_equal(states[frame], states[frame - 1])
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_TransferFunctions(self):
+    """Check that transfer function blends start and end on their functions"""
+    self.delayDisplay("Starting the transfer function test", 10)
+    from AnimatorLib import TransferFunctions
+
+    def piecewiseFunction(points):
+      function = vtk.vtkPiecewiseFunction()
+      for point in points:
+        function.AddPoint(*point)
+      return function
+
+    def colorFunction(points):
+      function = vtk.vtkColorTransferFunction()
+      for point in points:
+        function.AddRGBPoint(*point)
+      return function
+
+    def points(function, columns):
+      return TransferFunctions.functionToArray(function, columns)
+
+    # equal point counts are blended point by point
+    start = piecewiseFunction([(0, 0), (100, 0.5), (200, 1)])
+    end = piecewiseFunction([(0, 1), (150, 0.2), (255, 0)])
+    blend = TransferFunctions.FunctionBlend(start, end, TransferFunctions.PIECEWISE_COLUMNS)
+    animated = vtk.vtkPiecewiseFunction()
+    for fraction, expected in ((0, start), (1, end)):
+      blend.blend(fraction, animated)
+      numpy.testing.assert_allclose(points(animated, 4), points(expected, 4))
+
+    # unequal point counts are resampled onto the union of the points
+    start = piecewiseFunction([(0, 0), (255, 1)])
+    blend = TransferFunctions.FunctionBlend(start, end, TransferFunctions.PIECEWISE_COLUMNS)
+    samples = numpy.linspace(0, 255, 52)
+    for fraction, expected in ((0, start), (1, end)):
+      blend.blend(fraction, animated)
+      numpy.testing.assert_allclose([animated.GetValue(x) for x in samples],
+                                    [expected.GetValue(x) for x in samples], atol=1e-9)
+    start = colorFunction([(0, 0, 0, 0), (255, 1, 1, 1)])
+    end = colorFunction([(0, 1, 0, 0), (100, 0, 1, 0), (255, 0, 0, 1)])
+    blend = TransferFunctions.FunctionBlend(start, end, TransferFunctions.COLOR_COLUMNS)
+    animated = vtk.vtkColorTransferFunction()
+    for fraction, expected in ((0, start), (1, end)):
+      blend.blend(fraction, animated)
+      numpy.testing.assert_allclose([animated.GetColor(x) for x in samples],
+                                    [expected.GetColor(x) for x in samples], atol=1e-9)
+
+    # midpoints and sharpness are written with AddPoint into a function
+    # of another size and with SetNodeValue into one of the same size
+    start = piecewiseFunction([(0, 0, 0.3, 0.2), (255, 1, 0.5, 0)])
+    end = piecewiseFunction([(0, 1, 0.7, 0.5), (255, 0, 0.5, 0.1)])
+    blend = TransferFunctions.FunctionBlend(start, end, TransferFunctions.PIECEWISE_COLUMNS)
+    animated = piecewiseFunction([(0, 0), (100, 0), (255, 0)])
+    for fraction, expected in ((0, start), (1, end)):
+      blend.blend(fraction, animated)
+      numpy.testing.assert_allclose(points(animated, 4), points(expected, 4))
+    start = colorFunction([(0, 0, 0, 0, 0.3, 0.2), (255, 1, 1, 1, 0.5, 0)])
+    end = colorFunction([(0, 1, 0, 0, 0.6, 0.4), (255, 0, 0, 1, 0.5, 0.9)])
+    blend = TransferFunctions.FunctionBlend(start, end, TransferFunctions.COLOR_COLUMNS)
+    animated = vtk.vtkColorTransferFunction()
+    for fraction, expected in ((0, start), (1, end)):
+      blend.blend(fraction, animated)
+      numpy.testing.assert_allclose(points(animated, 6), points(expected, 6))
+    blend.blend(0.5, animated)
+    numpy.testing.assert_allclose(points(animated, 6)[:,4:], [[0.45, 0.3], [0.5, 0.45]])
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_VideoExport(self):
+    """Check the frame buffer pool and the resize filters without ffmpeg"""
+    self.delayDisplay("Starting the video export test", 10)
+    import threading
+
+    class PipeStandIn(object):
+      """Keeps the written frames and holds each write until released"""
+      def __init__(self):
+        self.frames = []
+        self.pending = []
+        self.closed = False
+        self.aborted = False
+      def write(self, buffer, onWritten):
+        self.frames.append(buffer.copy())
+        self.pending.append((buffer, onWritten))
+      def release(self):
+        while self.pending:
+          buffer, onWritten = self.pending.pop(0)
+          onWritten(buffer)
+      def close(self):
+        self.release()
+        self.closed = True
+      def abort(self):
+        self.aborted = True
+
+    def frame(value):
+      return numpy.full((4, 6, 3), value, dtype=numpy.uint8)
+
+    pipes = [PipeStandIn(), PipeStandIn()]
+    stream = VideoExport.FrameStream(pipes, (4, 6, 3), maxQueuedFrames=2)
+    image = frame(1)
+    stream.submit(image)
+    # the stream keeps a copy, the caller can reuse its image
+    image[:] = 9
+    stream.repeat()
+    self.assertEqual(stream.pendingWrites, {id(stream.lastBuffer): 4})
+    for pipe in pipes:
+      pipe.release()
+    # the last buffer is kept for repeats rather than freed
+    self.assertEqual(stream.pendingWrites, {})
+    self.assertEqual(stream.freeBuffers.qsize(), 1)
+    stream.submit(frame(2))
+    self.assertEqual(stream.freeBuffers.qsize(), 1)
+
+    # with every buffer waiting to be written, submit blocks
+    stream.submit(frame(3))
+    self.assertEqual(stream.freeBuffers.qsize(), 0)
+    blocked = threading.Thread(target=stream.submit, args=(frame(4),))
+    blocked.start()
+    blocked.join(0.2)
+    self.assertTrue(blocked.is_alive())
+    for pipe in pipes:
+      pipe.release()
+    blocked.join(5)
+    self.assertFalse(blocked.is_alive())
+    stream.repeat()
+    stream.close()
+    for pipe in pipes:
+      self.assertTrue(pipe.closed)
+      self.assertEqual([int(written[0,0,0]) for written in pipe.frames], [1, 1, 2, 3, 4, 4])
+    stream.abort()
+    self.assertTrue(all([pipe.aborted for pipe in pipes]))
+    with self.assertRaises(ValueError):
+      VideoExport.FrameStream([PipeStandIn()], (4, 6, 3)).repeat()
+
+    # frames are cropped around the center to the target aspect, then scaled
+    self.assertEqual(VideoExport.resizeFilters(1920, 1080, 1920, 1080), [])
+    self.assertEqual(VideoExport.resizeFilters(1920, 1080, 1280, 720), ['scale=1280:720:flags=area'])
+    self.assertEqual(VideoExport.resizeFilters(1920, 1080, 1080, 1080), ['crop=1080:1080'])
+    self.assertEqual(VideoExport.resizeFilters(1920, 1080, 540, 540), ['crop=1080:1080', 'scale=540:540:flags=area'])
+    self.assertEqual(VideoExport.resizeFilters(1000, 1000, 1920, 800), ['crop=1000:417', 'scale=1920:800:flags=area'])
+    targets = [VideoExport.ExportTarget('small.mp4', width=640, height=360),
+               VideoExport.ExportTarget('large.mp4', width=1920, height=1080),
+               VideoExport.ExportTarget('view.mp4')]
+    self.assertEqual(VideoExport.renderSize(targets), (1920, 1080))
+    self.assertIsNone(VideoExport.renderSize(targets[2:]))
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_DanglingReferences(self):
+    """Check that actions whose nodes were removed are no longer bound"""
+    self.delayDisplay("Starting the dangling reference test", 10)
+
+    logic = AnimatorLogic()
+    animationNode, state = self.addTransformAndROIAnimation(logic)
+    self.assertTrue(logic.getBoundActionInstance(animationNode, 'testROI').nodes)
+    roi = logic.getScript(animationNode)['actions']['testROI']
+    slicer.mrmlScene.RemoveNode(slicer.mrmlScene.GetNodeByID(roi['endROIID']))
+    # the plan cache rebinds on removal, do it here too for scenes that
+    # do not report it
+    logic.getPlan(animationNode).unbind()
+    with self.assertRaises(ValueError):
+      logic.getBoundActionInstance(animationNode, 'testROI')
+    with self.assertRaises(ValueError):
+      logic.convertToKeyframes(animationNode, 'testROI')
+    with self.assertRaises(ValueError):
+      logic.setKeyframe(animationNode, 'testROI', 0.5)
+    self.assertNotIn('keyframes', logic.getScript(animationNode)['actions']['testROI'])
+    # the other action is still played
+    self.assertTrue(logic.getBoundActionInstance(animationNode, 'testTranslation').nodes)
+
+    self.delayDisplay('Test passed!', 10)
+
+  def test_Playback(self):
+    """Check both playback policies against a simulated clock"""
+    self.delayDisplay("Starting the playback test", 10)
+
+    for policy in Playback.POLICIES:
+      clock = [0.]
+      shownTimes = []
+      def act(scriptTime):
+        # every third frame takes three frame periods
+        shownTimes.append(scriptTime)
+        clock[0] += 0.1 if len(shownTimes) % 3 == 0 else 0.01
+      scheduler = Playback.PlaybackScheduler(act, lambda: None, 30, 30, policy, clock=lambda: clock[0])
+      scheduler.start()
+      while scheduler.playing:
+        clock[0] += 0.005
+        scheduler.tick()
+      metrics = scheduler.metrics()
+      self.assertEqual(shownTimes[0], 0)
+      self.assertAlmostEqual(shownTimes[-1], 29 / 30.)
+      if policy == Playback.DROP_FRAMES:
+        self.assertLess(clock[0], 1.1)
+        self.assertGreater(metrics['droppedFrames'], 0)
+        self.assertEqual(metrics['shownFrames'] + metrics['droppedFrames'], 30)
+      else:
+        self.assertEqual(len(shownTimes), 30)
+        self.assertEqual(metrics['droppedFrames'], 0)
+        self.assertGreater(metrics['lateFrames'], 0)
+
+    self.delayDisplay('Test passed!', 10)
@@ -0,0 +1,115 @@
+import numpy
+import qt
+import uuid
+
+from AnimatorLib import Easing
+
+"""
+
+The superclass of animator action plugins.
+
+An action is a dict in the animation script with a 'class' naming the
+plugin in slicer.modules.animatorActionPlugins, a 'startTime' and
+'endTime' in seconds, an optional 'interpolation' and any number of
+node references in keys ending in 'ID'.  The plugin instance turns the
+action into changes of its output nodes at a given script time.
+
+"""
+
+class AnimatorAction(object):
+  """Superclass for actions to be animated."""
+
+  # a class whose instances play the bound instances of this plugin in
+  # a plan together: constructed with the instances after they are
+  # compiled, its act(members, scriptTime) replaces act for the
+  # instances at the given positions.  None plays each action alone.
+  batch = None
+  def __init__(self):
+    self.name = "Action"
+    self.startTime = 0 # in seconds from start of script
+    self.endTime = 0
+    self.uuid = uuid.uuid4()
+    # live nodes for the action's node ID references, keyed like the
+    # action (e.g. nodes['startROIID']).  Filled in by the plan.
+    self.nodes = {}
+    # sampled curve for the action's 'interpolation'.  Set by the plan.
+    self.easing = Easing.curve('linear')
+    # sorted keys of the action's 'keyframes', if it has any.  Set by the plan.
+    self.track = None
+
+  def referenceKeys(self, action):
+    """The keys of the action whose values are MRML node IDs"""
+    return [key for key in action.keys() if key.endswith('ID')]
+
+  def outputKeys(self, action):
+    """The reference keys of the nodes that act modifies"""
+    return [key for key in self.referenceKeys(action) if key.startswith('animated')]
+
+  def compile(self, action):
+    """Called when the script is compiled into a plan, after the
+    node references have been bound and before any call to act.
+    Subclasses can precompute per-action state here.
+    """
+    pass
+
+  def fraction(self, action, scriptTime):
+    """The eased progress of the action at scriptTime,
+    from 0 at startTime to 1 at endTime"""
+    duration = action['endTime'] - action['startTime']
+    if duration <= 0:
+      return self.easing(1. if scriptTime > action['startTime'] else 0.)
+    return self.easing((scriptTime - action['startTime']) / duration)
+
+  def fractions(self, action, scriptTimes):
+    """The eased progress of the action at an array of script times"""
+    scriptTimes = numpy.asarray(scriptTimes, dtype=float)
+    duration = action['endTime'] - action['startTime']
+    if duration <= 0:
+      return self.easing.evaluate(numpy.where(scriptTimes > action['startTime'], 1., 0.))
+    return self.easing.evaluate((scriptTimes - action['startTime']) / duration)
+
+  def stateKey(self, action, scriptTime):
+    """A value that is equal at two script times within the action's
+       window only if act leaves the output nodes in the same state.
+       Used to detect frames that do not need to be rendered again.
+    """
+    if self.track is not None:
+      return self.track.stateKey(scriptTime, self.easing)
+    return self.fraction(action, scriptTime)
+
+  def keyValue(self, node):
+    """The keyframe value describing the state of a node of the type the
+       action animates.  Actions supporting 'keyframes' implement this.
+    """
+    raise NotImplementedError("%s does not support keyframes" % self.name)
+
+  def bake(self, action, scriptTimes):
+    """Return an array with one row per script time holding everything
+       act would write to the output nodes at that time, or None if the
+       action cannot be baked.  Only called for times inside the action's
+       window.  Actions that return samples implement applyBaked.
+    """
+    return None
+
+  def applyBaked(self, action, sample):
+    """Write one row returned by bake to the output nodes"""
+    raise NotImplementedError("%s cannot be baked" % self.name)
+
+  def act(self, action, scriptTime):
+    pass
+
+  def gui(self, action, layout):
+    self.interpolationSelector = qt.QComboBox()
+    for name in Easing.presetNames:
+      self.interpolationSelector.addItem(name)
+    interpolation = action.get('interpolation', 'linear')
+    if interpolation not in Easing.presetNames:
+      # parametric curves are kept unless another preset is chosen
+      self.interpolationSelector.addItem('custom')
+      interpolation = 'custom'
+    self.interpolationSelector.currentText = interpolation
+    layout.addRow("Interpolation", self.interpolationSelector)
+
+  def updateFromGUI(self, action):
+    if self.interpolationSelector.currentText != 'custom':
+      action['interpolation'] = self.interpolationSelector.currentText
@@ -0,0 +1,77 @@
+import numpy
+import os
+import shutil
+import tempfile
+
+"""
+
+Baked samples of an animation.
+
+Baking evaluates every action once at each frame time of the script
+and keeps the results, so playing or scrubbing a frame is an array
+lookup per action followed by one update of the animated node.
+
+Only the frames where an action is interpolating are stored, one row
+per frame, e.g. an (N,4,4) matrix stack for a transform or (N,6)
+centers and radii for an roi.  Samples are kept in memory up to a
+budget in bytes; tracks that do not fit are written to memory mapped
+files in a spill directory that is removed when the bake is released.
+
+"""
+
+class BakedTimeline(object):
+
+  def __init__(self, framesPerSecond, frameCount, memoryBudget, spillDirectory):
+    self.framesPerSecond = framesPerSecond
+    self.frameCount = frameCount
+    self.memoryBudget = memoryBudget
+    self.spillDirectory = spillDirectory
+    self.memoryUsed = 0
+    self.spillPath = None
+    # action index -> (first frame, samples)
+    self.tracks = {}
+    # set by the owner to detect edits of the baked inputs
+    self.sourceMTime = None
+
+  def frameTimes(self):
+    return numpy.arange(self.frameCount) / self.framesPerSecond
+
+  def allocate(self, index, firstFrame, frameCount, sampleShape, dtype=float):
+    """Return the storage for frameCount samples of an action starting at
+    firstFrame, in memory if the budget allows and on disk otherwise"""
+    shape = (frameCount,) + tuple(sampleShape)
+    size = int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+    if self.memoryUsed + size <= self.memoryBudget:
+      samples = numpy.empty(shape, dtype=dtype)
+      self.memoryUsed += size
+    else:
+      if self.spillPath is None:
+        self.spillPath = tempfile.mkdtemp(prefix='AnimatorBake-', dir=self.spillDirectory)
+      fileName = os.path.join(self.spillPath, 'action-%d.dat' % index)
+      samples = numpy.memmap(fileName, dtype=dtype, mode='w+', shape=shape)
+    self.tracks[index] = (firstFrame, samples)
+    return samples
+
+  def frame(self, scriptTime):
+    """The frame at scriptTime, or None if it is not a frame time"""
+    frame = int(round(scriptTime * self.framesPerSecond))
+    if frame < 0 or frame >= self.frameCount or frame / self.framesPerSecond != scriptTime:
+      return None
+    return frame
+
+  def sample(self, index, frame):
+    """The baked sample of an action at a frame, or None"""
+    track = self.tracks.get(index)
+    if track is None:
+      return None
+    firstFrame, samples = track
+    if frame < firstFrame or frame >= firstFrame + len(samples):
+      return None
+    return samples[frame - firstFrame]
+
+  def release(self):
+    self.tracks = {}
+    self.memoryUsed = 0
+    if self.spillPath:
+      shutil.rmtree(self.spillPath, ignore_errors=True)
+      self.spillPath = None
@@ -0,0 +1,233 @@
+import numpy
+import vtk, qt, ctk, slicer
+
+from AnimatorLib import CameraPath
+from AnimatorLib.AnimatorAction import AnimatorAction
+
+"""
+
+Animator plugins for the 3D view camera.
+
+CameraRotationAction orbits or spins a camera at a fixed rate and
+CameraPathAction flies it through a spline of key cameras.
+
+"""
+
+class CameraRotationAction(AnimatorAction):
+  """Defines an animation of a transform"""
+  def __init__(self):
+    super(CameraRotationAction,self).__init__()
+    self.name = "Camera Rotation"
+    self.animationMethods = ['azimuth', 'elevation', 'roll']
+    self.methodMapping = {'azimuth': vtk.vtkCamera.Azimuth,
+                          'elevation': vtk.vtkCamera.Elevation,
+                          'roll': vtk.vtkCamera.Roll,}
+
+  def defaultAction(self):
+    layoutManager = slicer.app.layoutManager()
+    threeDView = layoutManager.threeDWidget(0).threeDView()
+    animatedCamera = threeDView.interactorStyle().GetCameraNode()
+    referenceCamera = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLCameraNode')
+    referenceCamera.SetName('referenceCamera')
+    referenceCamera.GetCamera().DeepCopy(animatedCamera.GetCamera())
+    cameraRotationAction = {
+      'name': 'CameraRotation',
+      'class': 'CameraRotationAction',
+      'id': 'cameraRotation-'+str(self.uuid),
+      'startTime': .1,
+      'endTime': 4,
+      'interpolation': 'linear',
+      'referenceCameraID': referenceCamera.GetID(),
+      'animatedCameraID': animatedCamera.GetID(),
+      'degreesPerSecond': 90,
+      'animationMethod': 'azimuth',
+    }
+    return(cameraRotationAction)
+
+  def compile(self, action):
+    self.rotate = self.methodMapping[action['animationMethod']]
+
+  def act(self, action, scriptTime):
+    referenceCamera = self.nodes['referenceCameraID']
+    animatedCamera = self.nodes['animatedCameraID']
+
+    animatedCamera.GetCamera().DeepCopy(referenceCamera.GetCamera())
+    if scriptTime <= action['startTime']:
+      return
+    else:
+      duration = action['endTime'] - action['startTime']
+      angle = self.fraction(action, scriptTime) * duration * action['degreesPerSecond']
+      cameraObject = animatedCamera.GetCamera()
+      self.rotate(cameraObject, angle)
+      cameraObject.OrthogonalizeViewUp()
+      # TODO: this->Renderer->UpdateLightsGeometryToFollowCamera()
+
+  def bake(self, action, scriptTimes):
+    """Position, focal point and view up of the rotated camera"""
+    referenceCamera = self.nodes['referenceCameraID'].GetCamera()
+    camera = vtk.vtkCamera()
+    duration = action['endTime'] - action['startTime']
+    samples = numpy.empty((len(scriptTimes), 9))
+    for row, fraction in enumerate(self.fractions(action, scriptTimes)):
+      camera.DeepCopy(referenceCamera)
+      self.rotate(camera, fraction * duration * action['degreesPerSecond'])
+      camera.OrthogonalizeViewUp()
+      samples[row] = camera.GetPosition() + camera.GetFocalPoint() + camera.GetViewUp()
+    return samples
+
+  def applyBaked(self, action, sample):
+    cameraObject = self.nodes['animatedCameraID'].GetCamera()
+    cameraObject.DeepCopy(self.nodes['referenceCameraID'].GetCamera())
+    cameraObject.SetPosition(sample[0:3])
+    cameraObject.SetFocalPoint(sample[3:6])
+    cameraObject.SetViewUp(sample[6:9])
+
+  def gui(self, action, layout):
+    super(CameraRotationAction,self).gui(action, layout)
+
+    self.referenceSelector = slicer.qMRMLNodeComboBox()
+    self.referenceSelector.nodeTypes = ["vtkMRMLCameraNode"]
+    self.referenceSelector.addEnabled = True
+    self.referenceSelector.renameEnabled = True
+    self.referenceSelector.removeEnabled = False
+    self.referenceSelector.noneEnabled = False
+    self.referenceSelector.selectNodeUponCreation = True
+    self.referenceSelector.showHidden = True
+    self.referenceSelector.showChildNodeTypes = True
+    self.referenceSelector.setMRMLScene( slicer.mrmlScene )
+    self.referenceSelector.setToolTip( "Pick the reference camera" )
+    self.referenceSelector.currentNodeID = action['referenceCameraID']
+    layout.addRow("Reference camera", self.referenceSelector)
+
+    self.animatedSelector = slicer.qMRMLNodeComboBox()
+    self.animatedSelector.nodeTypes = ["vtkMRMLCameraNode"]
+    self.animatedSelector.addEnabled = True
+    self.animatedSelector.renameEnabled = True
+    self.animatedSelector.removeEnabled = False
+    self.animatedSelector.noneEnabled = False
+    self.animatedSelector.selectNodeUponCreation = True
+    self.animatedSelector.showHidden = True
+    self.animatedSelector.showChildNodeTypes = True
+    self.animatedSelector.setMRMLScene( slicer.mrmlScene )
+    self.animatedSelector.setToolTip( "Pick the animated camera" )
+    self.animatedSelector.currentNodeID = action['animatedCameraID']
+    layout.addRow("Animated camera", self.animatedSelector)
+
+    self.rate = ctk.ctkDoubleSpinBox()
+    self.rate.suffix = " degreesPerSecond"
+    self.rate.decimals = 2
+    self.rate.minimum = 0
+    self.rate.value = action['degreesPerSecond']
+    layout.addRow("Rotation rate", self.rate)
+
+    self.method = qt.QComboBox()
+    for method in self.animationMethods:
+      self.method.addItem(method)
+    self.method.currentText = action['animationMethod']
+    layout.addRow("Animation method", self.method)
+
+  def updateFromGUI(self, action):
+    super(CameraRotationAction,self).updateFromGUI(action)
+    action['referenceCameraID'] = self.referenceSelector.currentNodeID
+    action['animatedCameraID'] = self.animatedSelector.currentNodeID
+    action['degreesPerSecond'] = self.rate.value
+    action['animationMethod'] = self.method.currentText
+
+
+class CameraPathAction(AnimatorAction):
+  """Defines a camera fly-through along a spline through key cameras.
+  The path is parameterized by arc length when the action is compiled
+  (see AnimatorLib.CameraPath), so the camera moves at constant speed
+  and each frame is a table lookup.
+  """
+  def __init__(self):
+    super(CameraPathAction,self).__init__()
+    self.name = "Camera Path"
+
+  def defaultAction(self):
+    layoutManager = slicer.app.layoutManager()
+    threeDView = layoutManager.threeDWidget(0).threeDView()
+    animatedCamera = threeDView.interactorStyle().GetCameraNode()
+    startCamera = numpy.array(self.keyValue(animatedCamera))
+    # fly halfway towards the focal point
+    endCamera = numpy.array(startCamera)
+    endCamera[0:3] += (startCamera[3:6] - startCamera[0:3]) / 2.
+    cameraPathAction = {
+      'name': 'CameraPath',
+      'class': 'CameraPathAction',
+      'id': 'cameraPath-'+str(self.uuid),
+      'startTime': 0,
+      'endTime': 4,
+      'interpolation': 'easeInOut',
+      'animatedCameraID': animatedCamera.GetID(),
+      'keyCameras': [startCamera.tolist(), endCamera.tolist()],
+    }
+    return(cameraPathAction)
+
+  def keyValue(self, cameraNode):
+    """Position, focal point and view up of a camera node"""
+    return list(cameraNode.GetPosition()) + list(cameraNode.GetFocalPoint()) + list(cameraNode.GetViewUp())
+
+  def compile(self, action):
+    self.path = CameraPath.CameraPath(action['keyCameras'])
+
+  def evaluate(self, action, scriptTimes):
+    """Return the (N,9) cameras at an array of script times"""
+    return self.path.evaluate(self.fractions(action, scriptTimes))
+
+  def act(self, action, scriptTime):
+    self.applyBaked(action, self.path.evaluate([self.fraction(action, scriptTime)])[0])
+
+  def bake(self, action, scriptTimes):
+    return self.evaluate(action, scriptTimes)
+
+  def applyBaked(self, action, sample):
+    animatedCamera = self.nodes['animatedCameraID']
+    animatedCamera.SetPosition(sample[0:3])
+    animatedCamera.SetFocalPoint(sample[3:6])
+    animatedCamera.SetViewUp(sample[6:9])
+
+  def gui(self, action, layout):
+    super(CameraPathAction,self).gui(action, layout)
+
+    self.animatedSelector = slicer.qMRMLNodeComboBox()
+    self.animatedSelector.nodeTypes = ["vtkMRMLCameraNode"]
+    self.animatedSelector.addEnabled = True
+    self.animatedSelector.renameEnabled = True
+    self.animatedSelector.removeEnabled = False
+    self.animatedSelector.noneEnabled = False
+    self.animatedSelector.selectNodeUponCreation = True
+    self.animatedSelector.showHidden = True
+    self.animatedSelector.showChildNodeTypes = True
+    self.animatedSelector.setMRMLScene( slicer.mrmlScene )
+    self.animatedSelector.setToolTip( "Pick the animated camera" )
+    self.animatedSelector.currentNodeID = action['animatedCameraID']
+    layout.addRow("Animated camera", self.animatedSelector)
+
+    self.keyCameras = list(action['keyCameras'])
+    self.keyCameraCount = qt.QLabel()
+    self.keyCameraCount.text = str(len(self.keyCameras))
+    layout.addRow("Key cameras", self.keyCameraCount)
+
+    self.addKeyCameraButton = qt.QPushButton("Add current camera")
+    self.addKeyCameraButton.toolTip = "Append the current view of the animated camera to the path"
+    layout.addRow("", self.addKeyCameraButton)
+    self.removeKeyCameraButton = qt.QPushButton("Remove last camera")
+    layout.addRow("", self.removeKeyCameraButton)
+
+    def addKeyCamera():
+      cameraNode = self.animatedSelector.currentNode()
+      if cameraNode:
+        self.keyCameras.append(self.keyValue(cameraNode))
+        self.keyCameraCount.text = str(len(self.keyCameras))
+    def removeKeyCamera():
+      if len(self.keyCameras) > 1:
+        self.keyCameras.pop()
+        self.keyCameraCount.text = str(len(self.keyCameras))
+    self.addKeyCameraButton.connect("clicked()", addKeyCamera)
+    self.removeKeyCameraButton.connect("clicked()", removeKeyCamera)
+
+  def updateFromGUI(self, action):
+    super(CameraPathAction,self).updateFromGUI(action)
+    action['animatedCameraID'] = self.animatedSelector.currentNodeID
+    action['keyCameras'] = self.keyCameras
@@ -0,0 +1,87 @@
+import numpy
+
+"""
+
+Smooth camera paths through key cameras.
+
+Each key camera is a row of 9 numbers: position, focal point and view
+up.  The keys are joined by a Catmull-Rom spline through all 9
+coordinates, and the spline is reparameterized by the distance the
+camera position travels so that the camera moves at constant speed.
+
+The reparameterization is done once: the spline is sampled densely, the
+cumulative length is inverted onto an evenly spaced table of path
+samples, and evaluating the path at a progress in [0,1] is a lookup
+and a linear blend of two table rows.
+
+"""
+
+TABLE_SIZE = 1025
+
+SAMPLES_PER_SEGMENT = 64
+
+def catmullRom(keys, parameters):
+  """Evaluate the uniform Catmull-Rom spline through the (K,d) keys at
+  (N,) parameters in [0,K-1], the integer parameters being the keys"""
+  keys = numpy.asarray(keys, dtype=float)
+  parameters = numpy.asarray(parameters, dtype=float)
+  segmentCount = len(keys) - 1
+  # the end keys are repeated so the curve starts and ends on them
+  padded = numpy.concatenate([keys[:1], keys, keys[-1:]])
+  segments = numpy.clip(numpy.floor(parameters).astype(int), 0, segmentCount - 1)
+  t = (parameters - segments)[:,numpy.newaxis]
+  p0 = padded[segments]
+  p1 = padded[segments + 1]
+  p2 = padded[segments + 2]
+  p3 = padded[segments + 3]
+  return 0.5 * ((2 * p1) +
+                (p2 - p0) * t +
+                (2 * p0 - 5 * p1 + 4 * p2 - p3) * t**2 +
+                (3 * p1 - p0 - 3 * p2 + p3) * t**3)
+
+
+class CameraPath(object):
+
+  def __init__(self, keyCameras, tableSize=TABLE_SIZE):
+    keys = numpy.asarray(keyCameras, dtype=float)
+    if keys.ndim != 2 or keys.shape[1] != 9 or len(keys) == 0:
+      raise ValueError("A camera path needs key cameras of 9 values each")
+    if len(keys) == 1:
+      self.table = numpy.repeat(keys, tableSize, axis=0)
+    else:
+      segmentCount = len(keys) - 1
+      parameters = numpy.linspace(0, segmentCount, segmentCount * SAMPLES_PER_SEGMENT + 1)
+      samples = catmullRom(keys, parameters)
+      lengths = self.cumulativeLength(samples[:,0:3])
+      if lengths[-1] <= 0:
+        # the camera only turns, so pace it by its focal point instead
+        lengths = self.cumulativeLength(samples[:,3:6])
+      if lengths[-1] > 0:
+        tableParameters = numpy.interp(numpy.linspace(0, lengths[-1], tableSize), lengths, parameters)
+      else:
+        tableParameters = numpy.linspace(0, segmentCount, tableSize)
+      self.table = catmullRom(keys, tableParameters)
+    self.last = len(self.table) - 1
+    self.length = self.cumulativeLength(self.table[:,0:3])[-1]
+
+  @staticmethod
+  def cumulativeLength(points):
+    steps = numpy.linalg.norm(numpy.diff(points, axis=0), axis=1)
+    return numpy.concatenate([[0.], numpy.cumsum(steps)])
+
+  def evaluate(self, fractions):
+    """The (N,9) cameras at an array of progress fractions in [0,1], with
+    the view up made orthogonal to the direction of projection"""
+    positions = numpy.clip(numpy.atleast_1d(numpy.asarray(fractions, dtype=float)), 0., 1.) * self.last
+    indices = numpy.minimum(positions.astype(int), self.last - 1) if self.last > 0 else numpy.zeros(len(positions), dtype=int)
+    weights = (positions - indices)[:,numpy.newaxis]
+    upper = numpy.minimum(indices + 1, self.last)
+    cameras = self.table[indices] + weights * (self.table[upper] - self.table[indices])
+    directions = cameras[:,3:6] - cameras[:,0:3]
+    directionLengths = numpy.linalg.norm(directions, axis=1, keepdims=True)
+    directions = directions / numpy.where(directionLengths > 0, directionLengths, 1.)
+    viewUps = cameras[:,6:9]
+    viewUps = viewUps - numpy.sum(viewUps * directions, axis=1, keepdims=True) * directions
+    viewUpLengths = numpy.linalg.norm(viewUps, axis=1, keepdims=True)
+    cameras[:,6:9] = viewUps / numpy.where(viewUpLengths > 0, viewUpLengths, 1.)
+    return cameras
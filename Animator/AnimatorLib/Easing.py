@@ -0,0 +1,167 @@
+import json
+import math
+import numpy
+
+"""
+
+Easing curves for the 'interpolation' key of animator actions.
+
+An interpolation is either the name of a preset curve:
+
+  'linear', 'easeIn', 'easeOut', 'easeInOut', 'step'
+
+or a dict describing a parametric curve:
+
+  {'type': 'cubicBezier', 'controlPoints': [x1, y1, x2, y2]}
+  {'type': 'step', 'steps': 4}
+  {'type': 'spline', 'points': [[0, 0], [0.3, 0.6], [1, 1]]}
+
+Every curve maps the linear progress of an action in [0,1] to an
+eased progress.  Curves are sampled once into a lookup table that is
+shared by every action using the same interpolation, so evaluating a
+curve during playback is a single table lookup.  Step curves are
+evaluated exactly from their step count instead, as a table would move
+each step to the next sample.
+
+"""
+
+TABLE_SIZE = 1025
+
+presetNames = ['linear', 'easeIn', 'easeOut', 'easeInOut', 'step']
+
+def linear(x):
+  return x
+
+def easeIn(x):
+  return x**3
+
+def easeOut(x):
+  return 1 - (1 - x)**3
+
+def easeInOut(x):
+  return numpy.where(x < 0.5, 4 * x**3, 1 - (-2 * x + 2)**3 / 2)
+
+def cubicBezier(x1, y1, x2, y2):
+  """CSS style cubic Bezier from (0,0) to (1,1) with the given inner
+  control points, returned as a function of x."""
+  x1 = min(max(x1, 0.), 1.)
+  x2 = min(max(x2, 0.), 1.)
+  u = numpy.linspace(0, 1, 8 * TABLE_SIZE)
+  def bezier(p1, p2):
+    return 3 * (1-u)**2 * u * p1 + 3 * (1-u) * u**2 * p2 + u**3
+  curveX = bezier(x1, x2)
+  curveY = bezier(y1, y2)
+  return lambda x: numpy.interp(x, curveX, curveY)
+
+def steps(count):
+  return lambda x: numpy.minimum(numpy.floor(x * count) / count, 1.)
+
+def spline(points):
+  """Monotone piecewise cubic (Fritsch-Carlson) through the given
+  [x,y] points, which are extended to start at (0,0) and end at (1,1)."""
+  points = sorted([tuple(point) for point in points])
+  if points[0][0] > 0:
+    points.insert(0, (0., 0.))
+  if points[-1][0] < 1:
+    points.append((1., 1.))
+  knotX, knotY = numpy.array(points, dtype=float).T
+  spans = numpy.diff(knotX)
+  slopes = numpy.diff(knotY) / spans
+  tangents = numpy.zeros(len(knotX))
+  tangents[0] = slopes[0]
+  tangents[-1] = slopes[-1]
+  tangents[1:-1] = (slopes[:-1] + slopes[1:]) / 2
+  for index, slope in enumerate(slopes):
+    if slope == 0:
+      tangents[index] = tangents[index+1] = 0
+    else:
+      alpha = tangents[index] / slope
+      beta = tangents[index+1] / slope
+      scale = alpha**2 + beta**2
+      if scale > 9:
+        tau = 3 / numpy.sqrt(scale)
+        tangents[index] = tau * alpha * slope
+        tangents[index+1] = tau * beta * slope
+  def evaluate(x):
+    segment = numpy.clip(numpy.searchsorted(knotX, x, side='right') - 1, 0, len(spans) - 1)
+    h = spans[segment]
+    t = (x - knotX[segment]) / h
+    h00 = 2*t**3 - 3*t**2 + 1
+    h10 = t**3 - 2*t**2 + t
+    h01 = -2*t**3 + 3*t**2
+    h11 = t**3 - t**2
+    return (h00 * knotY[segment] + h10 * h * tangents[segment] +
+            h01 * knotY[segment+1] + h11 * h * tangents[segment+1])
+  return evaluate
+
+
+class EasingCurve(object):
+  """A curve sampled into a lookup table, or a step curve with the given
+  number of steps.  Calling the curve with a linear fraction returns the
+  eased fraction; evaluate does the same for an array of fractions."""
+
+  def __init__(self, function, steps=None):
+    samples = numpy.linspace(0, 1, TABLE_SIZE)
+    self.table = numpy.asarray(function(samples), dtype=float)
+    self.values = self.table.tolist()
+    self.last = TABLE_SIZE - 1
+    self.steps = steps
+    self.stepped = steps is not None
+
+  def __call__(self, fraction):
+    if fraction <= 0.:
+      return self.values[0]
+    if fraction >= 1.:
+      return self.values[-1]
+    if self.stepped:
+      return math.floor(fraction * self.steps) / self.steps
+    position = fraction * self.last
+    index = int(position)
+    low = self.values[index]
+    return low + (position - index) * (self.values[index+1] - low)
+
+  def evaluate(self, fractions):
+    fractions = numpy.clip(numpy.asarray(fractions, dtype=float), 0., 1.)
+    if self.stepped:
+      return numpy.floor(fractions * self.steps) / self.steps
+    return numpy.interp(fractions * self.last, numpy.arange(TABLE_SIZE), self.table)
+
+
+# sampled curves keyed by the canonical json form of their interpolation
+curveCache = {}
+
+def curveKey(interpolation):
+  return json.dumps(interpolation, sort_keys=True)
+
+def curve(interpolation='linear'):
+  """Return the EasingCurve for an interpolation value, sampling it on first use.
+  Unknown interpolations raise ValueError."""
+  if interpolation is None:
+    interpolation = 'linear'
+  key = curveKey(interpolation)
+  if key not in curveCache:
+    curveCache[key] = buildCurve(interpolation)
+  return curveCache[key]
+
+def buildCurve(interpolation):
+  if isinstance(interpolation, str):
+    presets = {
+      'linear': linear,
+      'easeIn': easeIn,
+      'easeOut': easeOut,
+      'easeInOut': easeInOut,
+    }
+    if interpolation == 'step':
+      return EasingCurve(steps(1), steps=1)
+    if interpolation in presets:
+      return EasingCurve(presets[interpolation])
+    raise ValueError("Unknown interpolation '%s'" % interpolation)
+  curveType = interpolation.get('type')
+  if curveType == 'cubicBezier':
+    return EasingCurve(cubicBezier(*interpolation['controlPoints']))
+  if curveType == 'step':
+    count = interpolation.get('steps', 1)
+    return EasingCurve(steps(count), steps=count)
+  if curveType == 'spline':
+    return EasingCurve(spline(interpolation['points']))
+  raise ValueError("Unknown interpolation type '%s'" % curveType)
@@ -0,0 +1,76 @@
+import argparse
+import json
+import sys
+import traceback
+
+"""
+
+Renders and encodes one chunk of an animation in a headless Slicer.
+
+Started by ParallelExport as:
+
+  Slicer --no-splash --no-main-window --python-script ExportWorker.py
+         --scene scene.mrb --animation-node-id vtkMRMLScriptedModuleNode1
+         --start-frame 0 --end-frame 120 --width 1920 --height 1080
+         --targets '[{"output": "chunk-0000-0.mp4", "options": ["-pix_fmt", "yuv420p"],
+                      "width": 1920, "height": 1080},
+                     {"output": "chunk-0000-1.mp4", "options": ["-pix_fmt", "yuv420p"],
+                      "width": 640, "height": 360}]'
+
+The frames are rendered once at --width x --height and written to every
+target, scaled to its size.  The process exits with status 0 only if
+the chunk of every target was written.
+
+"""
+
+def parseArguments(argv):
+  parser = argparse.ArgumentParser(description="Render one chunk of an Animator animation")
+  parser.add_argument('--scene', required=True)
+  parser.add_argument('--animation-node-id', required=True)
+  parser.add_argument('--start-frame', type=int, required=True)
+  parser.add_argument('--end-frame', type=int, required=True)
+  parser.add_argument('--width', type=int, required=True)
+  parser.add_argument('--height', type=int, required=True)
+  parser.add_argument('--targets', required=True)
+  return parser.parse_args(argv)
+
+def offscreenThreeDWidget(width, height):
+  """A 3D widget on the scene's first view node rendering offscreen at the given size"""
+  import slicer
+  viewNode = slicer.mrmlScene.GetFirstNodeByClass('vtkMRMLViewNode')
+  if viewNode is None:
+    viewNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLViewNode')
+  threeDWidget = slicer.qMRMLThreeDWidget()
+  threeDWidget.setMRMLScene(slicer.mrmlScene)
+  threeDWidget.setMRMLViewNode(viewNode)
+  threeDView = threeDWidget.threeDView()
+  renderWindow = threeDView.renderWindow()
+  renderWindow.SetOffScreenRendering(1)
+  renderWindow.SetSize(width, height)
+  return threeDWidget
+
+def main(argv):
+  import slicer
+  from Animator import AnimatorLogic
+  from AnimatorLib import VideoExport
+  arguments = parseArguments(argv)
+  slicer.util.loadScene(arguments.scene)
+  animationNode = slicer.mrmlScene.GetNodeByID(arguments.animation_node_id)
+  if animationNode is None or animationNode.GetAttribute('ModuleName') != 'Animation':
+    raise ValueError("No animation %s in %s" % (arguments.animation_node_id, arguments.scene))
+  targets = [VideoExport.ExportTarget(target['output'], target['options'], target['width'], target['height'])
+             for target in json.loads(arguments.targets)]
+  threeDWidget = offscreenThreeDWidget(arguments.width, arguments.height)
+  AnimatorLogic().exportAnimationTargets(animationNode, threeDWidget.threeDView(), targets,
+                                         startFrame=arguments.start_frame,
+                                         endFrame=arguments.end_frame)
+
+if __name__ == '__main__':
+  import slicer
+  try:
+    main(sys.argv[1:])
+    exitStatus = 0
+  except Exception:
+    traceback.print_exc()
+    exitStatus = 1
+  slicer.util.exit(exitStatus)
@@ -0,0 +1,118 @@
+import bisect
+import numpy
+
+"""
+
+Keyframe tracks for animator actions.
+
+Instead of a start and an end node, an action can carry any number of
+keys in its script entry:
+
+  'keyframes': {'times': [t0, t1, ...], 'values': [[...], [...], ...]}
+
+with times in script seconds and one flat list of numbers per key,
+e.g. the 16 elements of a transform matrix or an ROI center and radius.
+The action's startTime and endTime span the first and last key.
+
+When the action is compiled the keys become sorted numpy arrays, so
+finding the segment of a script time is a binary search and the value
+is an interpolation between the two keys around it, with the action's
+easing curve applied within each segment.  Before the first key the
+track holds the first value and after the last key the last value.
+
+"""
+
+class KeyframeTrack(object):
+
+  def __init__(self, times, values):
+    times = numpy.asarray(times, dtype=float)
+    values = numpy.asarray(values, dtype=float)
+    if values.ndim == 1:
+      values = values[:,numpy.newaxis]
+    if len(times) == 0 or len(times) != len(values):
+      raise ValueError("A keyframe track needs one value per key time")
+    order = numpy.argsort(times, kind='stable')
+    self.times = times[order]
+    self.values = values[order]
+
+  @classmethod
+  def fromAction(cls, action):
+    keyframes = action['keyframes']
+    return cls(keyframes['times'], keyframes['values'])
+
+  def __len__(self):
+    return len(self.times)
+
+  def segments(self, scriptTimes):
+    """For an array of script times, the index of the key starting each
+    time's segment and the linear progress in [0,1] through the segment"""
+    scriptTimes = numpy.atleast_1d(numpy.asarray(scriptTimes, dtype=float))
+    if len(self.times) == 1:
+      return numpy.zeros(len(scriptTimes), dtype=int), numpy.zeros(len(scriptTimes))
+    indices = numpy.searchsorted(self.times, scriptTimes, side='right') - 1
+    indices = numpy.clip(indices, 0, len(self.times) - 2)
+    startTimes = self.times[indices]
+    durations = self.times[indices + 1] - startTimes
+    # a zero length segment is a jump to its end value
+    progress = numpy.where(durations > 0,
+                           (scriptTimes - startTimes) / numpy.where(durations > 0, durations, 1.),
+                           1.)
+    return indices, numpy.clip(progress, 0., 1.)
+
+  def evaluate(self, scriptTimes, easing=None):
+    """The (N,k) interpolated values at an array of N script times"""
+    indices, progress = self.segments(scriptTimes)
+    if len(self.times) == 1:
+      return self.values[indices]
+    if easing is not None:
+      progress = easing.evaluate(progress)
+    startValues = self.values[indices]
+    return startValues + progress[:,numpy.newaxis] * (self.values[indices + 1] - startValues)
+
+  def stateKey(self, scriptTime, easing=None):
+    """A value that is equal at two script times only if the track
+    has the same value at both"""
+    indices, progress = self.segments([scriptTime])
+    if easing is not None:
+      progress = easing.evaluate(progress)
+    return (int(indices[0]), float(progress[0]))
+
+
+def setKey(action, scriptTime, value):
+  """Add a key to the action's keyframes, replacing any key at the same
+  time, and stretch the action's window to span the keys"""
+  keyframes = action.setdefault('keyframes', {'times': [], 'values': []})
+  times = keyframes['times']
+  values = keyframes['values']
+  value = [float(element) for element in value]
+  index = bisect.bisect_left(times, scriptTime)
+  if index < len(times) and times[index] == scriptTime:
+    values[index] = value
+  else:
+    times.insert(index, float(scriptTime))
+    values.insert(index, value)
+  action['startTime'] = times[0]
+  action['endTime'] = times[-1]
+
+def removeKey(action, index):
+  """Remove the key at index, dropping the keyframes when none are left"""
+  keyframes = action['keyframes']
+  del keyframes['times'][index]
+  del keyframes['values'][index]
+  if keyframes['times']:
+    action['startTime'] = keyframes['times'][0]
+    action['endTime'] = keyframes['times'][-1]
+  else:
+    del action['keyframes']
+
+def retime(action, startTime, endTime):
+  """Move the keys linearly so they span [startTime, endTime]"""
+  times = action['keyframes']['times']
+  oldStart, oldEnd = times[0], times[-1]
+  if oldEnd > oldStart:
+    scale = (endTime - startTime) / (oldEnd - oldStart)
+    action['keyframes']['times'] = [startTime + (time - oldStart) * scale for time in times]
+  else:
+    action['keyframes']['times'] = [float(startTime)] * len(times)
+  action['startTime'] = startTime
+  action['endTime'] = endTime
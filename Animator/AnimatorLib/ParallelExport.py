@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import subprocess
+import time
+
+"""
+
+Parallel export of an animation across headless Slicer processes.
+
+Rendering a frame only depends on the scene and the script time, so the
+frame range is cut into contiguous chunks and each chunk is rendered
+and encoded by its own worker process running ExportWorker.py.  Chunks
+that fail are retried, and the finished chunk files are joined in frame
+order with ffmpeg's concat demuxer.
+
+Several outputs, e.g. the same animation in three sizes, are exported
+in one pass: each worker renders its frames once at the render size and
+writes a chunk file per ExportOutput, and the chunks of each output are
+joined into its file.
+
+"""
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ExportWorker.py')
+
+class ExportCanceled(RuntimeError):
+  """Raised when the progress callback cancels an export"""
+  pass
+
+def frameChunks(frameCount, chunkCount):
+  """Split range(frameCount) into at most chunkCount contiguous (start,end) ranges"""
+  chunkCount = max(1, min(chunkCount, frameCount))
+  bounds = [round(chunk * frameCount / chunkCount) for chunk in range(chunkCount + 1)]
+  return [(bounds[chunk], bounds[chunk+1]) for chunk in range(chunkCount)]
+
+
+class ExportOutput(object):
+  """One output file of a parallel export.  Its chunks are encoded with
+  chunkOptions into files with chunkExtension and joined with
+  finalOptions, which can be ['-c', 'copy'] when the chunks are already
+  in the final format.  A width and height of None is the render size."""
+
+  def __init__(self, outputPath, width, height, chunkOptions, chunkExtension, finalOptions):
+    self.outputPath = outputPath
+    self.width = width
+    self.height = height
+    self.chunkOptions = chunkOptions
+    self.chunkExtension = chunkExtension
+    self.finalOptions = finalOptions
+
+
+class ExportChunk(object):
+  def __init__(self, index, startFrame, endFrame, outputPaths, logPath):
+    self.index = index
+    self.startFrame = startFrame
+    self.endFrame = endFrame
+    # the chunk file of each output
+    self.outputPaths = outputPaths
+    self.attempts = 0
+    self.process = None
+    self.logPath = logPath
+    self.done = False
+
+
+class ParallelExporter(object):
+  """Render and encode frame chunks in worker processes.
+
+  slicerPath is the Slicer launcher, scenePath a saved scene (e.g. .mrb)
+  holding the animation, and workDirectory a scratch directory for the
+  chunk files.  Frames are rendered at width x height and written to
+  every ExportOutput in outputs."""
+
+  def __init__(self, slicerPath, ffmpegPath, scenePath, animationNodeID, workDirectory,
+               width, height, outputs, workerCount, chunkCount=None, maxAttempts=3):
+    self.slicerPath = slicerPath
+    self.ffmpegPath = ffmpegPath
+    self.scenePath = scenePath
+    self.animationNodeID = animationNodeID
+    self.workDirectory = workDirectory
+    self.width = width
+    self.height = height
+    self.outputs = outputs
+    self.workerCount = max(1, workerCount)
+    self.chunkCount = chunkCount or self.workerCount
+    self.maxAttempts = maxAttempts
+
+  def workerCommand(self, chunk):
+    targets = [{'output': outputPath, 'options': output.chunkOptions,
+                'width': output.width, 'height': output.height}
+               for output, outputPath in zip(self.outputs, chunk.outputPaths)]
+    return [self.slicerPath, '--no-splash', '--no-main-window',
+            '--python-script', WORKER_SCRIPT,
+            '--scene', self.scenePath,
+            '--animation-node-id', self.animationNodeID,
+            '--start-frame', str(chunk.startFrame),
+            '--end-frame', str(chunk.endFrame),
+            '--width', str(self.width),
+            '--height', str(self.height),
+            '--targets', json.dumps(targets)]
+
+  def start(self, chunk):
+    chunk.attempts += 1
+    for outputPath in chunk.outputPaths:
+      if os.path.exists(outputPath):
+        os.remove(outputPath)
+    with open(chunk.logPath, 'wb') as log:
+      chunk.process = subprocess.Popen(self.workerCommand(chunk), stdout=log, stderr=subprocess.STDOUT)
+
+  def logTail(self, chunk, lines=20):
+    try:
+      with open(chunk.logPath, 'r', errors='replace') as log:
+        return ''.join(log.readlines()[-lines:])
+    except OSError:
+      return ''
+
+  def run(self, frameCount, progressCallback=None, pollInterval=0.2):
+    """Export frames [0,frameCount) into every output.
+    progressCallback(finishedChunks, chunkCount) is called while waiting
+    and can return False to cancel, which raises ExportCanceled."""
+    chunks = []
+    for index, (startFrame, endFrame) in enumerate(frameChunks(frameCount, self.chunkCount)):
+      outputPaths = [os.path.join(self.workDirectory, 'chunk-%04d-%d%s' % (index, outputIndex, output.chunkExtension))
+                     for outputIndex, output in enumerate(self.outputs)]
+      logPath = os.path.join(self.workDirectory, 'chunk-%04d.log' % index)
+      chunks.append(ExportChunk(index, startFrame, endFrame, outputPaths, logPath))
+    waiting = list(chunks)
+    running = []
+    try:
+      while waiting or running:
+        while waiting and len(running) < self.workerCount:
+          chunk = waiting.pop(0)
+          self.start(chunk)
+          running.append(chunk)
+        for chunk in list(running):
+          returnCode = chunk.process.poll()
+          if returnCode is None:
+            continue
+          running.remove(chunk)
+          if returnCode == 0 and all([os.path.exists(outputPath) for outputPath in chunk.outputPaths]):
+            chunk.done = True
+          elif chunk.attempts < self.maxAttempts:
+            logging.warning("Animator export chunk %d (frames %d-%d) failed, retrying:\n%s"
+                            % (chunk.index, chunk.startFrame, chunk.endFrame-1, self.logTail(chunk)))
+            waiting.insert(0, chunk)
+          else:
+            raise RuntimeError("Export chunk %d (frames %d-%d) failed %d times:\n%s"
+                               % (chunk.index, chunk.startFrame, chunk.endFrame-1, chunk.attempts, self.logTail(chunk)))
+        finished = len([chunk for chunk in chunks if chunk.done])
+        if progressCallback and progressCallback(finished, len(chunks)) == False:
+          raise ExportCanceled("Export canceled")
+        if waiting or running:
+          time.sleep(pollInterval)
+    finally:
+      for chunk in running:
+        chunk.process.kill()
+        chunk.process.wait()
+    for outputIndex, output in enumerate(self.outputs):
+      self.concatenate([chunk.outputPaths[outputIndex] for chunk in chunks], output)
+
+  def concatenate(self, chunkPaths, output):
+    listPath = os.path.join(self.workDirectory, 'chunks.txt')
+    with open(listPath, 'w') as listFile:
+      for chunkPath in chunkPaths:
+        listFile.write("file '%s'\n" % chunkPath.replace("'", "'\\''"))
+    command = [self.ffmpegPath, '-y', '-loglevel', 'error',
+               '-f', 'concat', '-safe', '0', '-i', listPath]
+    command += list(output.finalOptions)
+    command.append(output.outputPath)
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+      raise RuntimeError("Joining export chunks failed: %s" % result.stdout.decode(errors='replace'))
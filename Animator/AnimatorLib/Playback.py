@@ -0,0 +1,153 @@
+import collections
+import math
+import time
+
+import numpy
+import qt
+
+"""
+
+Real-time playback of an animation.
+
+The scheduler computes which frame to show from a monotonic clock
+rather than advancing one frame per timer tick, so a slow frame does
+not make the animation drift.  Two policies decide what happens when
+frames take longer than the frame period:
+
+DROP_FRAMES: the frame follows the clock and frames whose time passed
+  while an earlier one was being shown are skipped, so the animation
+  ends on time.
+EVERY_FRAME: every frame is shown and a late frame moves the clock
+  origin, so the rest of the animation plays at the frame rate and
+  ends late.
+
+Each frame is rendered right after it is applied, and the time it was
+due and the time it was on screen are recorded.  The metrics give the
+achieved frame rate, the dropped and late frame counts and the latency
+from due time to display.
+
+"""
+
+DROP_FRAMES = 'dropFrames'
+EVERY_FRAME = 'everyFrame'
+
+POLICIES = (DROP_FRAMES, EVERY_FRAME)
+
+
+class PlaybackScheduler(object):
+
+  def __init__(self, act, render, frameCount, framesPerSecond, policy=DROP_FRAMES,
+               loop=False, clock=time.perf_counter, historySize=600):
+    """act(scriptTime) applies the animation and render() puts it on screen.
+       frameCallback(frame) and finishedCallback() can be set to follow
+       the playback."""
+    if policy not in POLICIES:
+      raise ValueError("Unknown playback policy %s" % policy)
+    self.act = act
+    self.render = render
+    self.frameCount = max(1, frameCount)
+    self.framesPerSecond = float(framesPerSecond)
+    self.policy = policy
+    self.loop = loop
+    self.clock = clock
+    self.frameCallback = None
+    self.finishedCallback = None
+    self.playing = False
+    self.currentFrame = None
+    # (frame, due, displayed) of the most recent frames
+    self.history = collections.deque(maxlen=historySize)
+    self.shownFrames = 0
+    self.droppedFrames = 0
+    self.lateFrames = 0
+    self.timer = qt.QTimer()
+    self.timer.singleShot = True
+    self.timer.timerType = qt.Qt.PreciseTimer
+    self.timer.connect('timeout()', self.tick)
+
+  def start(self, frame=0):
+    """Play from frame, showing it right away"""
+    if frame >= self.frameCount - 1:
+      frame = 0
+    self.history.clear()
+    self.shownFrames = 0
+    self.droppedFrames = 0
+    self.lateFrames = 0
+    self.originFrame = frame
+    self.originClock = self.clock()
+    self.currentFrame = None
+    self.playing = True
+    self.tick()
+
+  def stop(self):
+    self.timer.stop()
+    self.playing = False
+
+  def dueTime(self, frame):
+    return self.originClock + (frame - self.originFrame) / self.framesPerSecond
+
+  def tick(self):
+    if not self.playing:
+      return
+    now = self.clock()
+    if self.policy == DROP_FRAMES:
+      frame = self.originFrame + int(math.floor((now - self.originClock) * self.framesPerSecond + 1e-6))
+    else:
+      frame = self.originFrame if self.currentFrame is None else self.currentFrame + 1
+    if frame >= self.frameCount:
+      if self.loop:
+        self.originClock = self.dueTime(self.frameCount)
+        self.originFrame = 0
+        frame = 0 if self.policy == EVERY_FRAME else frame - self.frameCount
+        frame = min(frame, self.frameCount - 1)
+        self.currentFrame = None
+      elif self.currentFrame == self.frameCount - 1:
+        self.finish()
+        return
+      else:
+        # the last frame is always shown
+        frame = self.frameCount - 1
+    due = self.dueTime(frame)
+    if self.currentFrame is not None and frame == self.currentFrame or now < due - 0.5e-3:
+      self.schedule(due if frame != self.currentFrame else self.dueTime(frame + 1))
+      return
+    if self.policy == EVERY_FRAME and now - due > 1. / self.framesPerSecond:
+      # slow down rather than skip
+      self.lateFrames += 1
+      self.originClock += now - due
+      due = now
+    if self.currentFrame is not None and frame > self.currentFrame + 1:
+      self.droppedFrames += frame - self.currentFrame - 1
+    self.currentFrame = frame
+    self.shownFrames += 1
+    self.act(frame / self.framesPerSecond)
+    self.render()
+    self.history.append((frame, due, self.clock()))
+    if self.frameCallback:
+      self.frameCallback(frame)
+    self.schedule(self.dueTime(frame + 1))
+
+  def schedule(self, due):
+    if self.playing:
+      self.timer.start(max(0, int(math.ceil((due - self.clock()) * 1000.))))
+
+  def finish(self):
+    self.stop()
+    if self.finishedCallback:
+      self.finishedCallback()
+
+  def metrics(self):
+    """The shown, dropped and late frame counts, and over the recent
+       frames the achieved framesPerSecond and the mean, 95th percentile
+       and max seconds from the time a frame was due to its display"""
+    metrics = {'framesPerSecond': 0., 'shownFrames': self.shownFrames,
+               'droppedFrames': self.droppedFrames, 'lateFrames': self.lateFrames,
+               'latencyMean': 0., 'latencyP95': 0., 'latencyMax': 0.}
+    if self.history:
+      frames, dues, displayed = numpy.array(self.history).T
+      if len(displayed) > 1 and displayed[-1] > displayed[0]:
+        metrics['framesPerSecond'] = float((len(displayed) - 1) / (displayed[-1] - displayed[0]))
+      latencies = displayed - dues
+      metrics['latencyMean'] = float(latencies.mean())
+      metrics['latencyP95'] = float(numpy.percentile(latencies, 95))
+      metrics['latencyMax'] = float(latencies.max())
+    return metrics
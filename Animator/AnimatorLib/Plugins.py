@@ -0,0 +1,106 @@
+import importlib
+import logging
+import time
+
+"""
+
+Deferred discovery of animator action plugins.
+
+slicer.modules.animatorActionPlugins maps the 'class' of actions to the
+plugin classes that play them.  Importing every plugin when the module
+loads would make each Slicer startup pay for code that most sessions
+never run, so plugins are registered with a PluginDescriptor instead:
+
+  slicer.modules.animatorActionPlugins.register(
+    'ROIAction', 'ROI', 'AnimatorLib.VolumeRenderingAction')
+
+The registry keeps the descriptor and imports the plugin's module the
+first time the class is looked up, when an action of that class is
+added from the menu or played from a script.  The import time of each
+plugin is logged.
+
+Classes can still be stored directly, which imports them right away.
+Looking a plugin up, with [], get, values or items, imports it.  To
+list the plugins without importing them, use keys with displayName, or
+descriptors.
+
+"""
+
+class PluginDescriptor(object):
+  """Where to import an action plugin class from"""
+
+  def __init__(self, className, displayName, modulePath):
+    self.className = className
+    self.displayName = displayName
+    self.modulePath = modulePath
+
+  def load(self):
+    """Import the module and return the plugin class"""
+    start = time.perf_counter()
+    module = importlib.import_module(self.modulePath)
+    pluginClass = getattr(module, self.className)
+    logging.info("Animator loaded %s from %s in %.1f ms" % (
+                 self.className, self.modulePath, (time.perf_counter() - start) * 1000.))
+    return pluginClass
+
+
+class ActionPluginRegistry(dict):
+  """Action plugin classes keyed by action class name.  Values stored as
+     PluginDescriptors are replaced by their class when first looked up."""
+
+  def __init__(self, plugins=None):
+    dict.__init__(self, plugins or {})
+    self.displayNames = {}
+
+  def __getitem__(self, className):
+    plugin = dict.__getitem__(self, className)
+    if isinstance(plugin, PluginDescriptor):
+      plugin = plugin.load()
+      dict.__setitem__(self, className, plugin)
+    return plugin
+
+  def get(self, className, default=None):
+    if className in self:
+      return self[className]
+    return default
+
+  def values(self):
+    """The plugin classes, each imported as the iteration reaches it"""
+    for className in list(self.keys()):
+      yield self[className]
+
+  def items(self):
+    """The (className, plugin class) pairs, each class imported as the
+       iteration reaches it"""
+    for className in list(self.keys()):
+      yield className, self[className]
+
+  def descriptors(self):
+    """A PluginDescriptor per plugin, without importing any"""
+    descriptors = []
+    for className in self.keys():
+      plugin = dict.__getitem__(self, className)
+      if not isinstance(plugin, PluginDescriptor):
+        plugin = PluginDescriptor(className, self.displayName(className), plugin.__module__)
+      descriptors.append(plugin)
+    return descriptors
+
+  def register(self, className, displayName, modulePath):
+    """Register a plugin to be imported from modulePath when first used"""
+    self[className] = PluginDescriptor(className, displayName, modulePath)
+    self.displayNames[className] = displayName
+
+  def isLoaded(self, className):
+    return not isinstance(dict.__getitem__(self, className), PluginDescriptor)
+
+  def displayName(self, className):
+    """The name of the plugin for menus, without importing it"""
+    return self.displayNames.get(className, className)
+
+
+def registry(plugins):
+  """The plugins as an ActionPluginRegistry, keeping the ones already
+     added to a plain dict by modules loaded earlier"""
+  if isinstance(plugins, ActionPluginRegistry):
+    return plugins
+  return ActionPluginRegistry(plugins)
@@ -0,0 +1,133 @@
+import collections
+import json
+import time
+
+import numpy
+
+"""
+
+Frame timing for animation playback and export.
+
+While recording, every frame applied by the plan is logged with the
+wall time spent in each action, in flushing the node modifications at
+the end of the frame, and in the render that follows.  Timings are
+kept for the most recent frames only, so recording can be left on.
+
+The statistics give per action counts, means, percentiles and
+histograms in seconds, and the log can be written as a Chrome trace
+(chrome://tracing or https://ui.perfetto.dev) to see the frames on a
+timeline.
+
+"""
+
+FRAME = '(frame)'
+UPDATE = '(update)'
+RENDER = '(render)'
+
+PERCENTILES = (50, 95, 99)
+
+
+class FrameProfiler(object):
+
+  def __init__(self, maxFrames=10000):
+    self.enabled = False
+    self.frames = collections.deque(maxlen=maxFrames)
+    self.renderObservations = []
+    self.renderStart = None
+
+  def clear(self):
+    self.frames.clear()
+
+  def beginFrame(self, scriptTime):
+    frame = {'scriptTime': scriptTime, 'start': time.perf_counter(),
+             'duration': None, 'events': []}
+    self.frames.append(frame)
+    return frame
+
+  def record(self, frame, name, start, duration):
+    """Log a slice of the frame, e.g. one action's act"""
+    frame['events'].append((name, start, duration))
+
+  def endFrame(self, frame):
+    frame['duration'] = time.perf_counter() - frame['start']
+
+  def recordRender(self, start, duration):
+    """Attach a render to the most recent frame that has none yet"""
+    if self.frames:
+      frame = self.frames[-1]
+      if not any(name == RENDER for name, eventStart, eventDuration in frame['events']):
+        self.record(frame, RENDER, start, duration)
+
+  def observeRenderWindow(self, renderWindow):
+    """Time the renders of a view while recording"""
+    def onStart(caller, event):
+      self.renderStart = time.perf_counter()
+    def onEnd(caller, event):
+      if self.enabled and self.renderStart is not None:
+        self.recordRender(self.renderStart, time.perf_counter() - self.renderStart)
+      self.renderStart = None
+    tags = [renderWindow.AddObserver('StartEvent', onStart),
+            renderWindow.AddObserver('EndEvent', onEnd)]
+    self.renderObservations.append((renderWindow, tags))
+
+  def removeRenderObservers(self):
+    for renderWindow, tags in self.renderObservations:
+      for tag in tags:
+        renderWindow.RemoveObserver(tag)
+    self.renderObservations = []
+
+  def durations(self):
+    """Seconds per slice name, with the whole frames under FRAME"""
+    durations = collections.defaultdict(list)
+    for frame in self.frames:
+      if frame['duration'] is None:
+        continue
+      durations[FRAME].append(frame['duration'])
+      for name, start, duration in frame['events']:
+        durations[name].append(duration)
+    return durations
+
+  def statistics(self, bins=20):
+    """Per slice name, the count, mean, max, PERCENTILES and a
+    (counts, edges) histogram of the durations in seconds"""
+    statistics = {}
+    for name, durations in self.durations().items():
+      durations = numpy.array(durations)
+      entry = {'count': len(durations), 'mean': float(durations.mean()), 'max': float(durations.max())}
+      for percentile, value in zip(PERCENTILES, numpy.percentile(durations, PERCENTILES)):
+        entry['p%d' % percentile] = float(value)
+      counts, edges = numpy.histogram(durations, bins=bins)
+      entry['histogram'] = (counts.tolist(), edges.tolist())
+      statistics[name] = entry
+    return statistics
+
+  def overBudget(self, frameBudget, percentile=95, statistics=None):
+    """Names whose given percentile takes longer than frameBudget seconds,
+       in the given statistics or the current ones"""
+    if statistics is None:
+      statistics = self.statistics()
+    key = 'p%d' % percentile
+    return sorted([name for name, entry in statistics.items() if entry[key] > frameBudget])
+
+  def chromeTrace(self):
+    """The log in the Chrome trace event format"""
+    events = []
+    origin = self.frames[0]['start'] if self.frames else 0.
+    def microseconds(seconds):
+      return round((seconds - origin) * 1e6, 3)
+    for frame in self.frames:
+      if frame['duration'] is None:
+        continue
+      events.append({'name': 'frame %.3f s' % frame['scriptTime'], 'cat': 'frame', 'ph': 'X', 'pid': 0, 'tid': 0,
+                     'ts': microseconds(frame['start']), 'dur': round(frame['duration'] * 1e6, 3),
+                     'args': {'scriptTime': frame['scriptTime']}})
+      for name, start, duration in frame['events']:
+        # renders follow the frame, so they get a row of their own
+        events.append({'name': name, 'cat': 'render' if name == RENDER else 'action', 'ph': 'X', 'pid': 0,
+                       'tid': 1 if name == RENDER else 0,
+                       'ts': microseconds(start), 'dur': round(duration * 1e6, 3)})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+  def writeChromeTrace(self, path):
+    with open(path, 'w') as traceFile:
+      json.dump(self.chromeTrace(), traceFile)
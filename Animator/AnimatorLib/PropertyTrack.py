@@ -0,0 +1,213 @@
+import numpy
+import qt, slicer
+
+from AnimatorLib import Easing
+from AnimatorLib import KeyframeTrack
+from AnimatorLib.AnimatorAction import AnimatorAction
+
+"""
+
+Animation of any numeric property of any node.
+
+A PropertyTrackAction animates the value a node reads with
+Get<property>() and writes with Set<property>(...), e.g. 'Opacity' of
+a model display node, 'Window' or 'Level' of a volume display node or
+the three components of 'Color':
+
+  {'class': 'PropertyTrackAction', 'animatedNodeID': 'vtkMRMLModelDisplayNode4',
+   'property': 'Opacity', 'startValue': [1.], 'endValue': [0.], ...}
+
+or with 'keyframes' holding the values instead of startValue and
+endValue.
+
+Scripts animate dozens of such properties at once, so the plan plays
+the property tracks of a frame together through a PropertyTrackBatch.
+The keys of all tracks with the same number of components are
+concatenated into flat arrays, with the easing tables stacked beside
+them, and a frame is a few numpy operations over every track followed
+by one setter call per track.
+
+"""
+
+class TrackGroup(object):
+  """Struct of arrays over tracks of the same width"""
+
+  def __init__(self, tracks, easings):
+    counts = numpy.array([len(track) for track in tracks])
+    self.offsets = numpy.concatenate([[0], numpy.cumsum(counts)[:-1]])
+    self.lasts = self.offsets + counts - 1
+    # the start key of a segment, at most the one before the last key
+    self.lastStarts = numpy.maximum(self.lasts - 1, self.offsets)
+    self.times = numpy.concatenate([track.times for track in tracks])
+    self.values = numpy.concatenate([track.values for track in tracks])
+    self.tables = numpy.array([easing.table for easing in easings])
+    self.stepped = numpy.array([easing.stepped for easing in easings])
+    self.stepCounts = numpy.array([easing.steps if easing.stepped else 1 for easing in easings])
+    self.rows = numpy.arange(len(tracks))
+
+  def evaluate(self, scriptTime):
+    """The (tracks, width) values at scriptTime, as KeyframeTrack.evaluate
+    gives them for each track"""
+    keysBefore = numpy.add.reduceat((self.times <= scriptTime).astype(int), self.offsets)
+    starts = numpy.clip(self.offsets + keysBefore - 1, self.offsets, self.lastStarts)
+    ends = numpy.minimum(starts + 1, self.lasts)
+    durations = self.times[ends] - self.times[starts]
+    progress = numpy.where(durations > 0,
+                           (scriptTime - self.times[starts]) / numpy.where(durations > 0, durations, 1.),
+                           1.)
+    # the easing table lookup of every track at once, step curves are
+    # evaluated from their step count
+    progress = numpy.clip(progress, 0., 1.)
+    positions = progress * (Easing.TABLE_SIZE - 1)
+    lows = positions.astype(int)
+    highs = numpy.minimum(lows + 1, Easing.TABLE_SIZE - 1)
+    lowValues = self.tables[self.rows, lows]
+    eased = numpy.where(self.stepped,
+                        numpy.floor(progress * self.stepCounts) / self.stepCounts,
+                        lowValues + (positions - lows) * (self.tables[self.rows, highs] - lowValues))
+    startValues = self.values[starts]
+    return startValues + eased[:,numpy.newaxis] * (self.values[ends] - startValues)
+
+
+class PropertyTrackBatch(object):
+  """The bound PropertyTrackAction instances of a plan, played together"""
+
+  def __init__(self, instances):
+    self.setters = [instance.setValue for instance in instances]
+    widths = {}
+    for member, instance in enumerate(instances):
+      widths.setdefault(instance.track.values.shape[1], []).append(member)
+    self.groups = []
+    for members in widths.values():
+      group = TrackGroup([instances[member].track for member in members],
+                         [instances[member].easing for member in members])
+      self.groups.append((group, members))
+    self.selected = numpy.zeros(len(instances), dtype=bool)
+
+  def act(self, members, scriptTime):
+    """Set the properties of the instances at the given positions"""
+    selected = self.selected
+    selected[:] = False
+    selected[members] = True
+    setters = self.setters
+    for group, groupMembers in self.groups:
+      for member, value in zip(groupMembers, group.evaluate(scriptTime).tolist()):
+        if selected[member]:
+          setters[member](value)
+
+
+class PropertyTrackAction(AnimatorAction):
+  """Animates a numeric property of a node through its getter and setter"""
+
+  batch = PropertyTrackBatch
+
+  def __init__(self):
+    super(PropertyTrackAction,self).__init__()
+    self.name = "Property Track"
+    self.property = None
+    self.setValue = None
+
+  def defaultAction(self):
+    displayNodes = slicer.util.getNodesByClass('vtkMRMLModelDisplayNode')
+    if not displayNodes:
+      raise ValueError("There is no model whose opacity could be animated")
+    displayNode = displayNodes[0]
+
+    propertyTrackAction = {
+      'name': 'Property Track',
+      'class': 'PropertyTrackAction',
+      'id': 'propertyTrack-'+str(self.uuid),
+      'startTime': 0,
+      'endTime': 2,
+      'interpolation': 'linear',
+      'animatedNodeID': displayNode.GetID(),
+      'property': 'Opacity',
+      'startValue': [displayNode.GetOpacity()],
+      'endValue': [0.],
+    }
+    return(propertyTrackAction)
+
+  def compile(self, action):
+    node = self.nodes['animatedNodeID']
+    self.property = action['property']
+    getter = getattr(node, 'Get' + self.property, None)
+    setter = getattr(node, 'Set' + self.property, None)
+    if getter is None or setter is None:
+      raise ValueError("%s has no property %s" % (node.GetName(), self.property))
+    current = getter()
+    if isinstance(current, bool) or not isinstance(current, (int, float)):
+      try:
+        width = len(current)
+      except TypeError:
+        raise ValueError("Property %s of %s is not numeric" % (self.property, node.GetName()))
+      self.setValue = lambda value: setter(*value)
+    elif isinstance(current, int):
+      width = 1
+      self.setValue = lambda value: setter(int(round(value[0])))
+    else:
+      width = 1
+      self.setValue = lambda value: setter(value[0])
+    if self.track is None:
+      self.track = KeyframeTrack.KeyframeTrack([action['startTime'], action['endTime']],
+                                               [action['startValue'], action['endValue']])
+    if self.track.values.shape[1] != width:
+      raise ValueError("Property %s of %s has %d components, the action gives %d" % (
+                       self.property, node.GetName(), width, self.track.values.shape[1]))
+
+  def keyValue(self, node):
+    value = getattr(node, 'Get' + self.property)()
+    if isinstance(value, (int, float)):
+      return [float(value)]
+    return [float(element) for element in value]
+
+  def bake(self, action, scriptTimes):
+    return self.track.evaluate(scriptTimes, self.easing)
+
+  def applyBaked(self, action, sample):
+    self.setValue(sample.tolist())
+
+  def act(self, action, scriptTime):
+    self.setValue(self.track.evaluate([scriptTime], self.easing)[0].tolist())
+
+  def gui(self, action, layout):
+    super(PropertyTrackAction,self).gui(action, layout)
+
+    self.animatedSelector = slicer.qMRMLNodeComboBox()
+    self.animatedSelector.nodeTypes = ["vtkMRMLNode"]
+    self.animatedSelector.addEnabled = False
+    self.animatedSelector.renameEnabled = True
+    self.animatedSelector.removeEnabled = False
+    self.animatedSelector.noneEnabled = False
+    self.animatedSelector.showHidden = True
+    self.animatedSelector.showChildNodeTypes = True
+    self.animatedSelector.setMRMLScene( slicer.mrmlScene )
+    self.animatedSelector.setToolTip( "Pick the node whose property is animated" )
+    self.animatedSelector.currentNodeID = action['animatedNodeID']
+    layout.addRow("Animated node", self.animatedSelector)
+
+    self.propertyEdit = qt.QLineEdit()
+    self.propertyEdit.text = action['property']
+    self.propertyEdit.setToolTip( "Name of the property, read with Get<name> and written with Set<name>" )
+    layout.addRow("Property", self.propertyEdit)
+
+    if 'keyframes' in action:
+      layout.addRow("Keyframes", qt.QLabel(str(len(action['keyframes']['times']))))
+    else:
+      self.startValueEdit = qt.QLineEdit()
+      self.startValueEdit.text = ", ".join([str(value) for value in action['startValue']])
+      layout.addRow("Start value", self.startValueEdit)
+      self.endValueEdit = qt.QLineEdit()
+      self.endValueEdit.text = ", ".join([str(value) for value in action['endValue']])
+      layout.addRow("End value", self.endValueEdit)
+
+  def updateFromGUI(self, action):
+    super(PropertyTrackAction,self).updateFromGUI(action)
+    action['animatedNodeID'] = self.animatedSelector.currentNodeID
+    action['property'] = self.propertyEdit.text.strip()
+    if 'keyframes' not in action:
+      for key, edit in (('startValue', self.startValueEdit), ('endValue', self.endValueEdit)):
+        try:
+          action[key] = [float(value) for value in edit.text.split(',')]
+        except ValueError:
+          # keep the previous value for text that is not a list of numbers
+          pass
@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+
+import vtk, qt, slicer
+
+from AnimatorLib import ScriptStorage
+
+"""
+
+In-memory animation scripts.
+
+The script of an animation is persisted as JSON in the node's
+'Animation.script' attribute.  A ScriptModel holds the parsed script
+of one node and is the copy that edits and playback use; edits only
+mark it dirty and restart a short timer, and the JSON is written back
+once the edits pause, when the scene is saved, or when flush is called.
+
+A model notices when the attribute was set by someone else, e.g. by
+undo or a script, and reparses it unless it has edits of its own that
+are not written yet.
+
+Large scripts are written as a header plus a binary payload node, see
+ScriptStorage.  Storable nodes are written before the scene's
+StartSaveEvent, so when the flush on that event writes a payload, its
+file is written again right away, before the scene file that holds the
+matching header.
+
+"""
+
+WRITE_DELAY = 500 # milliseconds of quiet before writing back
+
+
+class ScriptAction(dict):
+  """An action of the script.  Still a dict, which is what the action
+     plugins and the JSON form use, with typed access to the keys that
+     every action has."""
+
+  @property
+  def id(self):
+    return self['id']
+
+  @property
+  def name(self):
+    return self['name']
+
+  @property
+  def className(self):
+    return self['class']
+
+  @property
+  def startTime(self):
+    return float(self['startTime'])
+
+  @startTime.setter
+  def startTime(self, value):
+    self['startTime'] = float(value)
+
+  @property
+  def endTime(self):
+    return float(self['endTime'])
+
+  @endTime.setter
+  def endTime(self, value):
+    self['endTime'] = float(value)
+
+
+class ScriptModel(object):
+
+  def __init__(self, animationNode, writeDelay=WRITE_DELAY):
+    self.animationNode = animationNode
+    self.script = None
+    self.dirty = False
+    self.writeTimer = qt.QTimer()
+    self.writeTimer.singleShot = True
+    self.writeTimer.interval = writeDelay
+    self.writeTimer.connect('timeout()', self.flush)
+    self.load()
+
+  def load(self):
+    """Parse the node attribute into the model.
+       Raises ValueError, leaving the model as it was, if the script's
+       payload is missing or does not belong to it."""
+    attributeJSON = self.animationNode.GetAttribute("Animation.script") or "{}"
+    script = json.loads(attributeJSON)
+    payloadNode = self.animationNode.GetNodeReference(ScriptStorage.PAYLOAD_ROLE)
+    if payloadNode or ScriptStorage.PAYLOAD_KEY in script:
+      script = ScriptStorage.unpack(script, payloadNode.GetText() if payloadNode else None)
+    self.attributeJSON = attributeJSON
+    self.setScript(script, markDirty=False)
+    self.dirty = False
+    self.syncedMTime = self.animationNode.GetMTime()
+
+  def setScript(self, script, markDirty=True):
+    if "actions" in script and script is not self.script:
+      script['actions'] = dict([(actionID, ScriptAction(action)) for actionID, action in script['actions'].items()])
+    self.script = script
+    if markDirty:
+      self.markDirty()
+
+  def actions(self):
+    return self.script.setdefault('actions', {})
+
+  def setAction(self, action):
+    self.actions()[action['id']] = action if isinstance(action, ScriptAction) else ScriptAction(action)
+    self.markDirty()
+
+  def removeAction(self, actionID):
+    del self.actions()[actionID]
+    self.markDirty()
+
+  def markDirty(self):
+    self.dirty = True
+    self.writeTimer.start()
+
+  def flush(self):
+    """Write the script back to the node if it changed.
+       Returns the payload node if its text was written."""
+    self.writeTimer.stop()
+    if not self.dirty:
+      return None
+    scriptJSON = json.dumps(self.script)
+    payloadNode = self.animationNode.GetNodeReference(ScriptStorage.PAYLOAD_ROLE)
+    payload = None
+    if len(scriptJSON) > ScriptStorage.INLINE_LIMIT:
+      header, payload = ScriptStorage.pack(self.script)
+    if payload:
+      scriptJSON = json.dumps(header)
+      if payloadNode is None:
+        payloadNode = self.addPayloadNode()
+      payloadNode.SetText(payload)
+    elif payloadNode:
+      self.animationNode.RemoveNodeReferenceIDs(ScriptStorage.PAYLOAD_ROLE)
+      slicer.mrmlScene.RemoveNode(payloadNode)
+      payloadNode = None
+    self.attributeJSON = scriptJSON
+    self.animationNode.SetAttribute("Animation.script", self.attributeJSON)
+    self.dirty = False
+    self.syncedMTime = self.animationNode.GetMTime()
+    return payloadNode
+
+  def writePayloadFile(self, payloadNode):
+    """Write the payload node's file now, e.g. when the scene is being
+       saved and the storable nodes were already written"""
+    storageNode = payloadNode.GetStorageNode()
+    if storageNode is None:
+      payloadNode.AddDefaultStorageNode()
+      storageNode = payloadNode.GetStorageNode()
+    if not storageNode.GetFileName():
+      storageNode.SetFileName(os.path.join(slicer.mrmlScene.GetRootDirectory(),
+                              payloadNode.GetName() + '.' + storageNode.GetDefaultWriteFileExtension()))
+    if not storageNode.WriteData(payloadNode):
+      logging.error("Could not write the animation script payload to %s" % storageNode.GetFileName())
+
+  def addPayloadNode(self):
+    payloadNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTextNode')
+    payloadNode.SetName(self.animationNode.GetName() + "-Payload")
+    payloadNode.HideFromEditorsOn()
+    payloadNode.SetForceCreateStorageNode(payloadNode.CreateStorageNodeAlways)
+    # a reference rather than an ID attribute, so that it follows
+    # the node IDs being renamed when the scene is imported
+    self.animationNode.SetNodeReferenceID(ScriptStorage.PAYLOAD_ROLE, payloadNode.GetID())
+    return payloadNode
+
+  def synchronize(self):
+    """Reload if the attribute was changed outside the model.
+       Returns True if the script was reloaded."""
+    if self.dirty or self.animationNode.GetMTime() == self.syncedMTime:
+      return False
+    self.syncedMTime = self.animationNode.GetMTime()
+    if (self.animationNode.GetAttribute("Animation.script") or "{}") == self.attributeJSON:
+      return False
+    self.load()
+    return True
+
+
+class ScriptModelCache(object):
+  """Script models keyed by animation node.
+     Flushes every model when the scene is about to be saved and
+     drops models of removed nodes and closed scenes, along with the
+     payload nodes of removed animations.
+  """
+  def __init__(self):
+    self.models = {}
+    self.observerTags = []
+
+  def get(self, animationNode):
+    model = self.models.get(animationNode)
+    if model is None:
+      if not self.observerTags:
+        self.observeScene()
+      model = ScriptModel(animationNode)
+      self.models[animationNode] = model
+    return model
+
+  def flush(self):
+    for model in self.models.values():
+      model.flush()
+
+  def observeScene(self):
+    scene = slicer.mrmlScene
+    self.observerTags = [
+      scene.AddObserver(scene.StartSaveEvent, self.onSceneStartSave),
+      scene.AddObserver(scene.NodeRemovedEvent, self.onNodeRemoved),
+      scene.AddObserver(scene.EndCloseEvent, self.onSceneEndClose),
+    ]
+
+  def onSceneStartSave(self, caller, event):
+    for model in self.models.values():
+      payloadNode = model.flush()
+      if payloadNode:
+        model.writePayloadFile(payloadNode)
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeRemoved(self, caller, event, node):
+    model = self.models.pop(node, None)
+    if model:
+      model.writeTimer.stop()
+    payloadNodeID = node.GetNodeReferenceID(ScriptStorage.PAYLOAD_ROLE)
+    if payloadNodeID and not slicer.mrmlScene.IsClosing():
+      qt.QTimer.singleShot(0, lambda: self.removePayloadNode(payloadNodeID))
+
+  def removePayloadNode(self, payloadNodeID):
+    payloadNode = slicer.mrmlScene.GetNodeByID(payloadNodeID)
+    if payloadNode:
+      slicer.mrmlScene.RemoveNode(payloadNode)
+
+  def onSceneEndClose(self, caller, event):
+    for model in self.models.values():
+      model.writeTimer.stop()
+    self.models = {}
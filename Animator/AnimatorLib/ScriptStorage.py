@@ -0,0 +1,155 @@
+import base64
+import hashlib
+import io
+
+import numpy
+
+"""
+
+Sidecar storage for large animation scripts.
+
+Scripts are JSON in the animation node's 'Animation.script' attribute,
+which is inlined in the scene's MRML file.  Once the JSON of a script
+grows past INLINE_LIMIT characters, its long lists of numbers
+(keyframes, landmarks, transfer function points) are split off into
+binary arrays, and the attribute keeps a small JSON header in which
+each array is replaced by {ARRAY_KEY: name}.
+
+The arrays are packed as an npz archive, base64 encoded, into a hidden
+text node that the animation node references under PAYLOAD_ROLE.  The
+text node always gets a storage node, so the payload is saved as a file
+next to the scene, or inside the MRB, and is read back with the scene.
+It is only decoded and merged into the script when the script is first
+used.
+
+The header records, under PAYLOAD_KEY, the number of arrays and a
+digest of the payload text, so a payload that was not written along
+with its header, or is missing, is detected when the script is loaded
+instead of filling the header with the wrong lists.
+
+Only lists of plain numbers are split off.  A list that mixes ints and
+floats comes back as floats, and lists holding booleans stay in the
+JSON, as numpy would turn them into numbers.
+
+"""
+
+INLINE_LIMIT = 64 * 1024 # characters of JSON kept in the node attribute
+
+MIN_ARRAY_SIZE = 64 # numbers below which a list stays in the JSON
+
+ARRAY_KEY = '$array'
+
+PAYLOAD_KEY = '$payload'
+
+PAYLOAD_ROLE = 'Animator.payload'
+
+
+def numericArray(value):
+  """The list as an array if it is a large enough regular list of
+  numbers, otherwise None"""
+  if not isinstance(value, list) or not value:
+    return None
+  # look at the first number before numpy converts the whole list
+  first = value[0]
+  while isinstance(first, list) and first:
+    first = first[0]
+  if isinstance(first, bool) or not isinstance(first, (int, float)):
+    return None
+  try:
+    array = numpy.array(value)
+  except ValueError:
+    # ragged lists
+    return None
+  if array.dtype.kind not in 'if' or array.size < MIN_ARRAY_SIZE:
+    return None
+  if any(isinstance(element, bool) for element in elements(value)):
+    return None
+  return array
+
+def elements(value):
+  """The numbers of a list of numbers or of nested lists"""
+  for element in value:
+    if isinstance(element, list):
+      for nested in elements(element):
+        yield nested
+    else:
+      yield element
+
+def split(script):
+  """The (header, arrays) of the script, where the header is the script
+  with its large numeric lists replaced by references into the arrays
+  dictionary"""
+  arrays = {}
+  def extract(value):
+    if isinstance(value, dict):
+      return dict([(key, extract(item)) for key, item in value.items()])
+    if isinstance(value, list):
+      array = numericArray(value)
+      if array is None:
+        return [extract(item) for item in value]
+      name = 'a%d' % len(arrays)
+      arrays[name] = array
+      return {ARRAY_KEY: name}
+    return value
+  return extract(script), arrays
+
+def join(header, arrays):
+  """The script with the array references of the header replaced by the
+  lists from arrays, which can be a dictionary or an npz archive.
+  Raises ValueError if the header refers to a missing array."""
+  def restore(value):
+    if isinstance(value, dict):
+      if len(value) == 1 and ARRAY_KEY in value:
+        name = value[ARRAY_KEY]
+        if name not in arrays:
+          raise ValueError("Animation script refers to array %s which is missing from its payload" % name)
+        return arrays[name].tolist()
+      return dict([(key, restore(item)) for key, item in value.items()])
+    if isinstance(value, list):
+      return [restore(item) for item in value]
+    return value
+  return restore(header)
+
+def encode(arrays):
+  """The arrays as base64 text of an npz archive"""
+  archive = io.BytesIO()
+  numpy.savez(archive, **arrays)
+  return base64.b64encode(archive.getvalue()).decode('ascii')
+
+def decode(text):
+  """The arrays of text written by encode, read from the archive as
+  they are accessed"""
+  if not text:
+    return {}
+  return numpy.load(io.BytesIO(base64.b64decode(text)), allow_pickle=False)
+
+def digest(text):
+  return hashlib.sha1(text.encode('ascii')).hexdigest()
+
+def pack(script):
+  """The (header, payload text) of the script, or (script, None) if it
+  has no lists to split off"""
+  header, arrays = split(script)
+  if not arrays:
+    return script, None
+  text = encode(arrays)
+  header[PAYLOAD_KEY] = {'arrays': len(arrays), 'digest': digest(text)}
+  return header, text
+
+def unpack(header, text):
+  """The script of a header and the payload text written by pack, where
+  text is None if there is no payload.  Raises ValueError if the
+  payload is missing or is not the one written with the header."""
+  header = dict(header)
+  signature = header.pop(PAYLOAD_KEY, None)
+  if signature is None:
+    return join(header, decode(text)) if text else header
+  if text is None:
+    raise ValueError("The payload of the animation script is missing")
+  if digest(text) != signature['digest']:
+    raise ValueError("The payload of the animation script does not match its header")
+  arrays = decode(text)
+  if len(arrays) != signature['arrays']:
+    raise ValueError("The payload of the animation script has %d arrays, its header %d" % (
+                     len(arrays), signature['arrays']))
+  return join(header, arrays)
@@ -0,0 +1,68 @@
+import bisect
+
+"""
+
+Interval index over the actions of an animation script.
+
+Each action has a [startTime, endTime] window.  At a given script time
+an action is BEFORE its window (it shows its start state), ACTIVE
+(interpolating) or AFTER (it shows its end state); this matches the
+'<= startTime' and '>= endTime' tests in the action act methods.
+
+The index splits the script into the segments between consecutive
+action boundaries and records which actions are active in each, so
+finding the active actions at a time is a binary search plus the size
+of the answer, and finding the actions whose phase may have changed
+between two times is a binary search over the sorted boundaries.
+
+"""
+
+BEFORE = 0
+ACTIVE = 1
+AFTER = 2
+
+class TimelineIndex(object):
+
+  def __init__(self, intervals):
+    """intervals is a list of (startTime, endTime), one per action"""
+    self.startTimes = [float(start) for start, end in intervals]
+    self.endTimes = [float(end) for start, end in intervals]
+    self.bounds = sorted(set(self.startTimes + self.endTimes))
+    # segments[k] holds the actions active in the open interval
+    # (bounds[k-1], bounds[k]); the first and last segments are unbounded
+    self.segments = [[] for segment in range(len(self.bounds) + 1)]
+    boundIndex = {bound: index for index, bound in enumerate(self.bounds)}
+    for index, (start, end) in enumerate(zip(self.startTimes, self.endTimes)):
+      if start < end:
+        for segment in range(boundIndex[start] + 1, boundIndex[end] + 1):
+          self.segments[segment].append(index)
+    events = sorted([(start, index) for index, start in enumerate(self.startTimes)] +
+                    [(end, index) for index, end in enumerate(self.endTimes)])
+    self.eventTimes = [time for time, index in events]
+    self.eventIndices = [index for time, index in events]
+
+  def __len__(self):
+    return len(self.startTimes)
+
+  def phase(self, index, scriptTime):
+    if scriptTime <= self.startTimes[index]:
+      return BEFORE
+    if scriptTime >= self.endTimes[index]:
+      return AFTER
+    return ACTIVE
+
+  def segment(self, scriptTime):
+    """The index of the segment containing scriptTime.  Times exactly on a
+    boundary belong to the following segment."""
+    return bisect.bisect_right(self.bounds, scriptTime)
+
+  def active(self, scriptTime):
+    """Indices of the actions interpolating at scriptTime, in script order"""
+    startTimes = self.startTimes
+    return [index for index in self.segments[self.segment(scriptTime)] if startTimes[index] < scriptTime]
+
+  def crossed(self, fromTime, toTime):
+    """Indices of the actions with a boundary between the two times, inclusive"""
+    low = bisect.bisect_left(self.eventTimes, min(fromTime, toTime))
+    high = bisect.bisect_right(self.eventTimes, max(fromTime, toTime))
+    return self.eventIndices[low:high]
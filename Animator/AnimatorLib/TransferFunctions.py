@@ -0,0 +1,91 @@
+import numpy
+
+"""
+
+Transfer function helpers for volume property animation.
+
+Transfer functions are pulled out of vtk into numpy arrays once, with
+one row per control point (x, y, midpoint, sharpness for piecewise
+functions and x, r, g, b, midpoint, sharpness for color functions),
+so that a whole function can be blended in one vectorized operation
+and written back in one call.
+
+"""
+
+PIECEWISE_COLUMNS = 4
+COLOR_COLUMNS = 6
+
+def functionToArray(function, columns):
+  """Return the control points of a vtkPiecewiseFunction (columns=4)
+  or vtkColorTransferFunction (columns=6) as an (n,columns) array."""
+  size = function.GetSize()
+  array = numpy.zeros((size, columns))
+  value = [0.,]*columns
+  for index in range(size):
+    function.GetNodeValue(index, value)
+    array[index] = value
+  return array
+
+def hasDefaultShape(array):
+  """True if every control point uses the default midpoint (0.5)
+  and sharpness (0), which is the only shape FillFromDataPointer makes."""
+  return bool(numpy.all(array[:,-2] == 0.5) and numpy.all(array[:,-1] == 0.))
+
+def alignFunctions(startArray, endArray):
+  """Return start and end arrays with matching control points.
+  Functions with the same number of points are paired point by point.
+  Otherwise both are resampled onto the union of their abscissas so
+  they can be blended row by row.  The resampled points get the default
+  midpoint and sharpness, so the midpoints and sharpness of functions
+  with different numbers of points are not kept."""
+  if startArray.shape == endArray.shape:
+    return startArray, endArray
+  columns = startArray.shape[1]
+  if len(startArray) == 0 or len(endArray) == 0:
+    nonEmpty = startArray if len(startArray) else endArray
+    return nonEmpty.copy(), nonEmpty.copy()
+  abscissa = numpy.union1d(startArray[:,0], endArray[:,0])
+  aligned = []
+  for array in (startArray, endArray):
+    resampled = numpy.zeros((len(abscissa), columns))
+    resampled[:,0] = abscissa
+    for column in range(1, columns-2):
+      resampled[:,column] = numpy.interp(abscissa, array[:,0], array[:,column])
+    resampled[:,-2] = 0.5
+    resampled[:,-1] = 0.
+    aligned.append(resampled)
+  return aligned[0], aligned[1]
+
+def arrayToFunction(array, function):
+  """Write an (n,columns) control point array into a vtk transfer function."""
+  columns = array.shape[1]
+  size = len(array)
+  if hasDefaultShape(array):
+    points = numpy.ascontiguousarray(array[:,:columns-2]).ravel()
+    function.FillFromDataPointer(size, points)
+  elif function.GetSize() == size:
+    for index in range(size):
+      function.SetNodeValue(index, array[index])
+  else:
+    addPoint = function.AddPoint if columns == PIECEWISE_COLUMNS else function.AddRGBPoint
+    function.RemoveAllPoints()
+    for index in range(size):
+      addPoint(*array[index])
+
+
+class FunctionBlend(object):
+  """Linear blend between two transfer functions.
+  The aligned start points and start-to-end deltas are computed once;
+  each blend is a single multiply-add into a preallocated buffer."""
+
+  def __init__(self, startFunction, endFunction, columns):
+    startArray = functionToArray(startFunction, columns)
+    endArray = functionToArray(endFunction, columns)
+    self.start, end = alignFunctions(startArray, endArray)
+    self.delta = end - self.start
+    self.blended = numpy.empty_like(self.start)
+
+  def blend(self, fraction, function):
+    numpy.multiply(self.delta, fraction, out=self.blended)
+    self.blended += self.start
+    arrayToFunction(self.blended, function)
@@ -1,65 +1,469 @@
-
 import numpy
+import vtk, qt, slicer
+from vtk.util.numpy_support import vtk_to_numpy
 
-"""
+from AnimatorLib import TransformInterpolation
+from AnimatorLib.AnimatorAction import AnimatorAction
 
-This is a placeholder for Animator plugins
-for transforms.
+"""
 
-For testing:
+Animator plugins for transforms.
 
-import os
-pathPrefix = "/Users/pieper/slicer/latest/Slicer"
-moduleName = "Animator"
+TranslationAction interpolates a linear transform between two
+transforms or through matrix keyframes.
 
-modulePath = os.path.join(pathPrefix+moduleName, moduleName, moduleName+".py")
+ThinPlateSplineAction morphs a thin plate spline transform from the
+identity (targets on the sources) to the registration result.  The
+registered landmarks are kept in a hidden reference copy of the
+transform and each frame writes
 
-factoryManager = slicer.app.moduleManager().factoryManager()
+  targets = sources + fraction * (referenceTargets - sources)
 
-factoryManager.registerModule(qt.QFileInfo(modulePath))
+directly into the numpy view of the animated transform's target
+landmarks.
 
-factoryManager.loadModules([moduleName,])
+A spline is linear in its targets and is the identity when targets
+equal sources, so the displacement at any point for a given fraction is
+fraction times the displacement of the reference transform.  With
+'useGrid' the reference displacement is sampled once on a coarse grid
+and the animated transform becomes a grid transform whose
+displacements are that grid scaled in place, so dense models and
+volumes deform without solving the spline for each frame.
 
-slicer.util.selectModule(moduleName)
+DisplacementFieldAction does the same for a transform that already is
+a displacement grid, such as a deformable registration result: the
+reference copy keeps the field and each frame is one multiply of the
+reference displacements into the animated grid's numpy view.
 
 """
 
-class animateThinPlate(object):
+def storedTransform(transformNode, className):
+  """The transform of the class stored in either direction of the node
+     and whether it is the to parent direction, or (None, None)"""
+  for toParent, getTransform in ((False, transformNode.GetTransformFromParentAs),
+                                 (True, transformNode.GetTransformToParentAs)):
+    transform = getTransform(className, False, True)
+    if transform:
+      return transform, toParent
+  return None, None
+
+def storedThinPlateSpline(transformNode):
+  """The thin plate spline stored in either direction of the node, or None"""
+  return storedTransform(transformNode, 'vtkThinPlateSplineTransform')[0]
+
+def isThinPlateSplineNode(transformNode):
+  return storedThinPlateSpline(transformNode) is not None
+
+def isDisplacementFieldNode(transformNode):
+  return storedTransform(transformNode, 'vtkGridTransform')[0] is not None
+
+def setStoredTransform(transformNode, transform, toParent):
+  if toParent:
+    transformNode.SetAndObserveTransformToParent(transform)
+  else:
+    transformNode.SetAndObserveTransformFromParent(transform)
+
+def addReferenceCopy(transformNode):
+  """A hidden node holding a copy of the transform, kept as the end
+     state while the original node is animated"""
+  referenceTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTransformNode')
+  referenceTransform.SetName(transformNode.GetName() + ' Reference')
+  referenceTransform.HideFromEditorsOn()
+  referenceTransform.CopyContent(transformNode)
+  return referenceTransform
+
+
+class TranslationAction(AnimatorAction):
+  """Defines an animation of a linear transform.
+  Rotation is interpolated with quaternion slerp and scale/shear and
+  translation linearly (see AnimatorLib.TransformInterpolation).
+  With 'keyframes' each key holds the 16 elements of a matrix and
+  the start and end transforms are not used.
+  """
+  def __init__(self):
+    super(TranslationAction,self).__init__()
+    self.name = "Translation"
+    self.startMatrix = vtk.vtkMatrix4x4()
+    self.endMatrix = vtk.vtkMatrix4x4()
+    self.animatedMatrix = vtk.vtkMatrix4x4()
+
+  def defaultAction(self):
+    startTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    startTransform.SetName('Start Transform')
+    endTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    endTransform.SetName('End Transform')
+    animatedTransform = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    animatedTransform.SetName('Animated Transform')
+
+    matrix = vtk.vtkMatrix4x4()
+    matrix.SetElement(0,3, 10)
+    matrix.SetElement(1,3, 5)
+    matrix.SetElement(2,3, 15)
+    endTransform.SetMatrixTransformFromParent(matrix)
+
+    translationAction = {
+      'name': 'Translation',
+      'class': 'TranslationAction',
+      'id': 'translation-'+str(self.uuid),
+      'startTime': 4,
+      'endTime': 5,
+      'interpolation': 'linear',
+      'startTransformID': startTransform.GetID(),
+      'endTransformID': endTransform.GetID(),
+      'animatedTransformID': animatedTransform.GetID(),
+    }
+    return(translationAction)
+
+  def keyValue(self, transformNode):
+    transformNode.GetMatrixTransformFromParent(self.animatedMatrix)
+    return slicer.util.arrayFromVTKMatrix(self.animatedMatrix).flatten().tolist()
+
+  def compile(self, action):
+    if self.track is not None:
+      matrices = self.track.values.reshape(-1, 4, 4)
+      self.interpolators = [TransformInterpolation.TransformInterpolator(matrices[index], matrices[index + 1])
+                            for index in range(len(matrices) - 1)]
+      return
+    startTransform = self.nodes['startTransformID']
+    endTransform = self.nodes['endTransformID']
+    startTransform.GetMatrixTransformFromParent(self.startMatrix)
+    endTransform.GetMatrixTransformFromParent(self.endMatrix)
+    self.interpolator = TransformInterpolation.TransformInterpolator(
+                          slicer.util.arrayFromVTKMatrix(self.startMatrix),
+                          slicer.util.arrayFromVTKMatrix(self.endMatrix))
+    self.compiledMTime = max(startTransform.GetMTime(), endTransform.GetMTime())
+
+  def evaluate(self, action, scriptTimes):
+    """Return the (N,4,4) stack of animated matrices at an array of script times"""
+    if self.track is not None:
+      indices, progress = self.track.segments(scriptTimes)
+      if not self.interpolators:
+        return self.track.values[indices].reshape(-1, 4, 4)
+      progress = self.easing.evaluate(progress)
+      matrices = numpy.empty((len(indices), 4, 4))
+      for index in numpy.unique(indices):
+        selected = indices == index
+        matrices[selected] = self.interpolators[index].evaluate(progress[selected])
+      return matrices
+    return self.interpolator.evaluate(self.fractions(action, scriptTimes))
+
+  def bake(self, action, scriptTimes):
+    return self.evaluate(action, scriptTimes)
+
+  def applyBaked(self, action, sample):
+    slicer.util.updateVTKMatrixFromArray(self.animatedMatrix, sample)
+    self.nodes['animatedTransformID'].SetMatrixTransformFromParent(self.animatedMatrix)
+
+  def act(self, action, scriptTime):
+    if self.track is not None:
+      slicer.util.updateVTKMatrixFromArray(self.animatedMatrix, self.evaluate(action, [scriptTime])[0])
+      self.nodes['animatedTransformID'].SetMatrixTransformFromParent(self.animatedMatrix)
+      return
+    startTransform = self.nodes['startTransformID']
+    endTransform = self.nodes['endTransformID']
+    animatedTransform = self.nodes['animatedTransformID']
+    if max(startTransform.GetMTime(), endTransform.GetMTime()) != self.compiledMTime:
+      self.compile(action)
+    if scriptTime <= action['startTime']:
+      animatedTransform.SetMatrixTransformFromParent(self.startMatrix)
+    elif scriptTime >= action['endTime']:
+      animatedTransform.SetMatrixTransformFromParent(self.endMatrix)
+    else:
+      matrix = self.evaluate(action, [scriptTime])[0]
+      slicer.util.updateVTKMatrixFromArray(self.animatedMatrix, matrix)
+      animatedTransform.SetMatrixTransformFromParent(self.animatedMatrix)
+
+  def gui(self, action, layout):
+    super(TranslationAction,self).gui(action, layout)
+
+    if 'keyframes' in action:
+      layout.addRow("Keyframes", qt.QLabel(str(len(action['keyframes']['times']))))
+    else:
+      self.startSelector = slicer.qMRMLNodeComboBox()
+      self.startSelector.nodeTypes = ["vtkMRMLLinearTransformNode"]
+      self.startSelector.addEnabled = True
+      self.startSelector.renameEnabled = True
+      self.startSelector.removeEnabled = False
+      self.startSelector.noneEnabled = False
+      self.startSelector.selectNodeUponCreation = True
+      self.startSelector.showHidden = True
+      self.startSelector.showChildNodeTypes = True
+      self.startSelector.setMRMLScene( slicer.mrmlScene )
+      self.startSelector.setToolTip( "Pick the start transform" )
+      self.startSelector.currentNodeID = action['startTransformID']
+      layout.addRow("Start transform", self.startSelector)
+
+      self.endSelector = slicer.qMRMLNodeComboBox()
+      self.endSelector.nodeTypes = ["vtkMRMLLinearTransformNode"]
+      self.endSelector.addEnabled = True
+      self.endSelector.renameEnabled = True
+      self.endSelector.removeEnabled = False
+      self.endSelector.noneEnabled = False
+      self.endSelector.selectNodeUponCreation = True
+      self.endSelector.showHidden = True
+      self.endSelector.showChildNodeTypes = True
+      self.endSelector.setMRMLScene( slicer.mrmlScene )
+      self.endSelector.setToolTip( "Pick the end transform" )
+      self.endSelector.currentNodeID = action['endTransformID']
+      layout.addRow("End transform", self.endSelector)
+
+    self.animatedSelector = slicer.qMRMLNodeComboBox()
+    self.animatedSelector.nodeTypes = ["vtkMRMLLinearTransformNode"]
+    self.animatedSelector.addEnabled = True
+    self.animatedSelector.renameEnabled = True
+    self.animatedSelector.removeEnabled = False
+    self.animatedSelector.noneEnabled = False
+    self.animatedSelector.selectNodeUponCreation = True
+    self.animatedSelector.showHidden = True
+    self.animatedSelector.showChildNodeTypes = True
+    self.animatedSelector.setMRMLScene( slicer.mrmlScene )
+    self.animatedSelector.setToolTip( "Pick the animated transform" )
+    self.animatedSelector.currentNodeID = action['animatedTransformID']
+    layout.addRow("Animated transform", self.animatedSelector)
+
+  def updateFromGUI(self, action):
+    super(TranslationAction,self).updateFromGUI(action)
+    if 'keyframes' not in action:
+      action['startTransformID'] = self.startSelector.currentNodeID
+      action['endTransformID'] = self.endSelector.currentNodeID
+    action['animatedTransformID'] = self.animatedSelector.currentNodeID
+
+
+class ThinPlateSplineAction(AnimatorAction):
+  """Defines an animation of a thin plate spline transform"""
+  def __init__(self):
+    super(ThinPlateSplineAction,self).__init__()
+    self.name = "Thin Plate Spline"
+    self.animatedTransform = None
+
+  def defaultAction(self):
+    thinPlateNodes = [node for node in slicer.util.getNodesByClass('vtkMRMLTransformNode')
+                      if isThinPlateSplineNode(node)]
+    if not thinPlateNodes:
+      raise ValueError("There is no thin plate spline transform to animate")
+    animatedTransform = thinPlateNodes[0]
+    referenceTransform = addReferenceCopy(animatedTransform)
+
+    thinPlateAction = {
+      'name': 'Thin Plate Spline',
+      'class': 'ThinPlateSplineAction',
+      'id': 'thinPlateSpline-'+str(self.uuid),
+      'startTime': 0,
+      'endTime': 2,
+      'interpolation': 'easeInOut',
+      'referenceTransformID': referenceTransform.GetID(),
+      'animatedTransformID': animatedTransform.GetID(),
+      'useGrid': False,
+      'gridSpacing': 5.,
+    }
+    return(thinPlateAction)
+
+  def compile(self, action):
+    referenceTransform = self.nodes['referenceTransformID']
+    animatedTransformNode = self.nodes['animatedTransformID']
+    self.compiledMTime = referenceTransform.GetMTime()
+    self.animatedTransform = None
+    reference, toParent = storedTransform(referenceTransform, 'vtkThinPlateSplineTransform')
+    if reference is None:
+      raise ValueError("Reference transform %s is not a thin plate spline" % referenceTransform.GetName())
+    referenceSource = vtk_to_numpy(reference.GetSourceLandmarks().GetData())
+    referenceTarget = vtk_to_numpy(reference.GetTargetLandmarks().GetData())
+    if action.get('useGrid', False):
+      self.animatedTransform = self.gridTransform(reference, referenceSource, action.get('gridSpacing', 5.))
+      self.animatedArray = vtk_to_numpy(self.animatedTransform.GetDisplacementGrid().GetPointData().GetScalars())
+      self.baseArray = numpy.zeros_like(self.animatedArray)
+      self.deltaArray = numpy.array(self.animatedArray)
+    else:
+      # the animated transform gets landmarks of its own, so writing the
+      # targets in place never touches the reference
+      self.animatedTransform = vtk.vtkThinPlateSplineTransform()
+      self.animatedTransform.SetBasis(reference.GetBasis())
+      self.animatedTransform.SetSigma(reference.GetSigma())
+      sourcePoints = vtk.vtkPoints()
+      sourcePoints.DeepCopy(reference.GetSourceLandmarks())
+      targetPoints = vtk.vtkPoints()
+      targetPoints.DeepCopy(reference.GetTargetLandmarks())
+      self.animatedTransform.SetSourceLandmarks(sourcePoints)
+      self.animatedTransform.SetTargetLandmarks(targetPoints)
+      self.animatedArray = vtk_to_numpy(targetPoints.GetData())
+      self.baseArray = numpy.array(referenceSource, dtype=self.animatedArray.dtype)
+      self.deltaArray = (referenceTarget - referenceSource).astype(self.animatedArray.dtype)
+    setStoredTransform(animatedTransformNode, self.animatedTransform, toParent)
+
+  def gridTransform(self, reference, sourceArray, spacing):
+    """A grid transform holding the displacements of the reference over
+       the landmark bounds with a 20% margin"""
+    low = sourceArray.min(axis=0)
+    high = sourceArray.max(axis=0)
+    margin = 0.2 * (high - low) + spacing
+    low = low - margin
+    high = high + margin
+    toGrid = vtk.vtkTransformToGrid()
+    toGrid.SetInput(reference)
+    toGrid.SetGridOrigin(*low)
+    toGrid.SetGridSpacing(spacing, spacing, spacing)
+    toGrid.SetGridExtent(0, int((high[0] - low[0]) / spacing), 0, int((high[1] - low[1]) / spacing),
+                         0, int((high[2] - low[2]) / spacing))
+    toGrid.SetGridScalarTypeToFloat()
+    toGrid.Update()
+    grid = vtk.vtkImageData()
+    grid.DeepCopy(toGrid.GetOutput())
+    gridTransform = vtk.vtkGridTransform()
+    gridTransform.SetDisplacementGridData(grid)
+    gridTransform.SetInterpolationModeToCubic()
+    return gridTransform
+
+  def act(self, action, scriptTime):
+    if self.nodes['referenceTransformID'].GetMTime() != self.compiledMTime:
+      self.compile(action)
+    fraction = self.fraction(action, scriptTime)
+    numpy.multiply(self.deltaArray, fraction, out=self.animatedArray)
+    self.animatedArray += self.baseArray
+    if action.get('useGrid', False):
+      self.animatedTransform.GetDisplacementGrid().Modified()
+    else:
+      self.animatedTransform.GetTargetLandmarks().Modified()
+    # the transform node relays this as its TransformModifiedEvent
+    self.animatedTransform.Modified()
+
+  def gui(self, action, layout):
+    super(ThinPlateSplineAction,self).gui(action, layout)
+
+    self.referenceSelector = slicer.qMRMLNodeComboBox()
+    self.referenceSelector.nodeTypes = ["vtkMRMLTransformNode"]
+    self.referenceSelector.addEnabled = False
+    self.referenceSelector.renameEnabled = True
+    self.referenceSelector.removeEnabled = False
+    self.referenceSelector.noneEnabled = False
+    self.referenceSelector.selectNodeUponCreation = True
+    self.referenceSelector.showHidden = True
+    self.referenceSelector.showChildNodeTypes = True
+    self.referenceSelector.setMRMLScene( slicer.mrmlScene )
+    self.referenceSelector.setToolTip( "Pick the thin plate spline holding the registered landmarks" )
+    self.referenceSelector.currentNodeID = action['referenceTransformID']
+    layout.addRow("Reference transform", self.referenceSelector)
+
+    self.animatedSelector = slicer.qMRMLNodeComboBox()
+    self.animatedSelector.nodeTypes = ["vtkMRMLTransformNode"]
+    self.animatedSelector.addEnabled = True
+    self.animatedSelector.renameEnabled = True
+    self.animatedSelector.removeEnabled = False
+    self.animatedSelector.noneEnabled = False
+    self.animatedSelector.selectNodeUponCreation = True
+    self.animatedSelector.showHidden = True
+    self.animatedSelector.showChildNodeTypes = True
+    self.animatedSelector.setMRMLScene( slicer.mrmlScene )
+    self.animatedSelector.setToolTip( "Pick the animated transform" )
+    self.animatedSelector.currentNodeID = action['animatedTransformID']
+    layout.addRow("Animated transform", self.animatedSelector)
+
+    self.useGridCheckBox = qt.QCheckBox()
+    self.useGridCheckBox.checked = action.get('useGrid', False)
+    self.useGridCheckBox.toolTip = "Sample the spline once on a grid and scale the grid each frame"
+    layout.addRow("Use displacement grid", self.useGridCheckBox)
+
+    self.gridSpacing = qt.QDoubleSpinBox()
+    self.gridSpacing.minimum = 0.1
+    self.gridSpacing.maximum = 100
+    self.gridSpacing.suffix = " mm"
+    self.gridSpacing.value = action.get('gridSpacing', 5.)
+    layout.addRow("Grid spacing", self.gridSpacing)
+
+  def updateFromGUI(self, action):
+    super(ThinPlateSplineAction,self).updateFromGUI(action)
+    action['referenceTransformID'] = self.referenceSelector.currentNodeID
+    action['animatedTransformID'] = self.animatedSelector.currentNodeID
+    action['useGrid'] = self.useGridCheckBox.checked
+    action['gridSpacing'] = self.gridSpacing.value
+
 
-    def __init__(self):
-        self.name = "preduraUS_resampledTointraopUS_reseampled-ThinPlate"
+class DisplacementFieldAction(AnimatorAction):
+  """Defines an animation of a grid transform from identity to its full displacement"""
+  def __init__(self):
+    super(DisplacementFieldAction,self).__init__()
+    self.name = "Displacement Field"
+    self.animatedTransform = None
 
-        self.transformNode = slicer.util.getNode(self.name)
+  def defaultAction(self):
+    gridNodes = [node for node in slicer.util.getNodesByClass('vtkMRMLTransformNode')
+                 if isDisplacementFieldNode(node)]
+    if not gridNodes:
+      raise ValueError("There is no grid transform to animate")
+    animatedTransform = gridNodes[0]
+    referenceTransform = addReferenceCopy(animatedTransform)
 
-        self.transform = self.transformNode.GetTransformToParent()
+    displacementFieldAction = {
+      'name': 'Displacement Field',
+      'class': 'DisplacementFieldAction',
+      'id': 'displacementField-'+str(self.uuid),
+      'startTime': 0,
+      'endTime': 2,
+      'interpolation': 'easeInOut',
+      'referenceTransformID': referenceTransform.GetID(),
+      'animatedTransformID': animatedTransform.GetID(),
+    }
+    return(displacementFieldAction)
 
-        self.sourcePoints = self.transform.GetSourceLandmarks()
-        self.targetPoints = self.transform.GetTargetLandmarks()
+  def compile(self, action):
+    referenceTransform = self.nodes['referenceTransformID']
+    self.compiledMTime = referenceTransform.GetMTime()
+    reference, toParent = storedTransform(referenceTransform, 'vtkGridTransform')
+    if reference is None:
+      raise ValueError("Reference transform %s is not a grid transform" % referenceTransform.GetName())
+    # copying a grid transform shares its grid, so the animated
+    # transform is given a grid of its own to scale in place
+    grid = vtk.vtkImageData()
+    grid.DeepCopy(reference.GetDisplacementGrid())
+    self.animatedTransform = reference.NewInstance()
+    self.animatedTransform.DeepCopy(reference)
+    self.animatedTransform.SetDisplacementGridData(grid)
+    self.animatedArray = vtk_to_numpy(grid.GetPointData().GetScalars())
+    self.referenceArray = numpy.array(self.animatedArray)
+    self.referenceShift = reference.GetDisplacementShift()
+    setStoredTransform(self.nodes['animatedTransformID'], self.animatedTransform, toParent)
 
-        self.sourceArray = vtk.util.numpy_support.vtk_to_numpy(self.sourcePoints.GetData())
-        self.targetArray = vtk.util.numpy_support.vtk_to_numpy(self.targetPoints.GetData())
-        self.originalTargetArray = numpy.array(self.targetArray)
-        self.deltaArray = self.targetArray - self.sourceArray
+  def act(self, action, scriptTime):
+    if self.nodes['referenceTransformID'].GetMTime() != self.compiledMTime:
+      self.compile(action)
+    fraction = self.fraction(action, scriptTime)
+    numpy.multiply(self.referenceArray, fraction, out=self.animatedArray)
+    # the shift is added to every displacement, so it is scaled too
+    self.animatedTransform.SetDisplacementShift(fraction * self.referenceShift)
+    self.animatedTransform.GetDisplacementGrid().Modified()
+    self.animatedTransform.Modified()
 
-    def animationFrame(self):
-      if self.frame <= self.frames:
-        interpolation = self.frame / (self.frames * 1.)
-        multiplier = math.cos(2. * math.pi * interpolation)
-        self.targetArray[:] = self.sourceArray + multiplier * self.deltaArray
-        self.targetPoints.GetData().Modified()
-        self.transformNode.Modified()
-        self.transformNode.InvokeCustomModifiedEvent(slicer.vtkMRMLTransformableNode.TransformModifiedEvent)
-        qt.QTimer.singleShot(20, self.animationFrame)
-      self.frame += 1
+  def gui(self, action, layout):
+    super(DisplacementFieldAction,self).gui(action, layout)
 
-    def animate(self):
-        self.frames = 20
-        self.frame = 0
-        self.animationFrame()
+    self.referenceSelector = slicer.qMRMLNodeComboBox()
+    self.referenceSelector.nodeTypes = ["vtkMRMLTransformNode"]
+    self.referenceSelector.addEnabled = False
+    self.referenceSelector.renameEnabled = True
+    self.referenceSelector.removeEnabled = False
+    self.referenceSelector.noneEnabled = False
+    self.referenceSelector.selectNodeUponCreation = True
+    self.referenceSelector.showHidden = True
+    self.referenceSelector.showChildNodeTypes = True
+    self.referenceSelector.setMRMLScene( slicer.mrmlScene )
+    self.referenceSelector.setToolTip( "Pick the grid transform holding the full displacement" )
+    self.referenceSelector.currentNodeID = action['referenceTransformID']
+    layout.addRow("Reference transform", self.referenceSelector)
 
-try:
-    a = animateThinPlate()
-    a.animate()
-except Exception:
-    pass
+    self.animatedSelector = slicer.qMRMLNodeComboBox()
+    self.animatedSelector.nodeTypes = ["vtkMRMLTransformNode"]
+    self.animatedSelector.addEnabled = True
+    self.animatedSelector.renameEnabled = True
+    self.animatedSelector.removeEnabled = False
+    self.animatedSelector.noneEnabled = False
+    self.animatedSelector.selectNodeUponCreation = True
+    self.animatedSelector.showHidden = True
+    self.animatedSelector.showChildNodeTypes = True
+    self.animatedSelector.setMRMLScene( slicer.mrmlScene )
+    self.animatedSelector.setToolTip( "Pick the animated transform" )
+    self.animatedSelector.currentNodeID = action['animatedTransformID']
+    layout.addRow("Animated transform", self.animatedSelector)
 
+  def updateFromGUI(self, action):
+    super(DisplacementFieldAction,self).updateFromGUI(action)
+    action['referenceTransformID'] = self.referenceSelector.currentNodeID
+    action['animatedTransformID'] = self.animatedSelector.currentNodeID
@@ -0,0 +1,100 @@
+import numpy
+
+"""
+
+Interpolation of 4x4 transform matrices for transform animation.
+
+Matrices are decomposed into translation, rotation and stretch
+(the polar decomposition of the upper 3x3, which holds scale and shear).
+Rotations are interpolated as quaternions with slerp, stretch and
+translation linearly, and the parts are recomposed.  Everything works
+on stacks of matrices so a whole track can be evaluated in one call.
+
+"""
+
+def polarDecomposition(linear):
+  """Split (...,3,3) matrices into rotations and symmetric stretches
+  such that linear = rotation @ stretch.  Reflections are kept in the
+  stretch so the rotation is always proper."""
+  u, s, vt = numpy.linalg.svd(linear)
+  determinant = numpy.sign(numpy.linalg.det(u @ vt))
+  determinant[determinant == 0] = 1
+  u[...,:,-1] *= determinant[...,numpy.newaxis]
+  s[...,-1] *= determinant
+  rotation = u @ vt
+  stretch = numpy.swapaxes(vt, -1, -2) @ (s[...,:,numpy.newaxis] * vt)
+  return rotation, stretch
+
+def quaternionsFromRotations(rotations):
+  """Convert (...,3,3) rotation matrices to (...,4) unit quaternions (w,x,y,z)"""
+  r = rotations
+  trace = r[...,0,0] + r[...,1,1] + r[...,2,2]
+  candidates = numpy.stack([
+    numpy.stack([1 + trace, r[...,2,1] - r[...,1,2], r[...,0,2] - r[...,2,0], r[...,1,0] - r[...,0,1]], axis=-1),
+    numpy.stack([r[...,2,1] - r[...,1,2], 1 + r[...,0,0] - r[...,1,1] - r[...,2,2], r[...,0,1] + r[...,1,0], r[...,0,2] + r[...,2,0]], axis=-1),
+    numpy.stack([r[...,0,2] - r[...,2,0], r[...,0,1] + r[...,1,0], 1 - r[...,0,0] + r[...,1,1] - r[...,2,2], r[...,1,2] + r[...,2,1]], axis=-1),
+    numpy.stack([r[...,1,0] - r[...,0,1], r[...,0,2] + r[...,2,0], r[...,1,2] + r[...,2,1], 1 - r[...,0,0] - r[...,1,1] + r[...,2,2]], axis=-1),
+  ], axis=-2)
+  # use the numerically best conditioned candidate for each rotation
+  diagonal = numpy.stack([trace, r[...,0,0], r[...,1,1], r[...,2,2]], axis=-1)
+  best = numpy.argmax(diagonal, axis=-1)
+  quaternions = numpy.take_along_axis(candidates, best[...,numpy.newaxis,numpy.newaxis], axis=-2)[...,0,:]
+  quaternions /= numpy.linalg.norm(quaternions, axis=-1, keepdims=True)
+  return quaternions
+
+def rotationsFromQuaternions(quaternions):
+  """Convert (...,4) unit quaternions (w,x,y,z) to (...,3,3) rotation matrices"""
+  w, x, y, z = numpy.moveaxis(quaternions, -1, 0)
+  rotations = numpy.stack([
+    numpy.stack([1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)], axis=-1),
+    numpy.stack([2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)], axis=-1),
+    numpy.stack([2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)], axis=-1),
+  ], axis=-2)
+  return rotations
+
+def slerp(startQuaternion, endQuaternion, fractions):
+  """Spherical interpolation between two quaternions at each of the
+  (N,) fractions, returning (N,4) quaternions on the shorter arc."""
+  fractions = numpy.asarray(fractions, dtype=float)[:,numpy.newaxis]
+  cosAngle = numpy.dot(startQuaternion, endQuaternion)
+  if cosAngle < 0:
+    endQuaternion = -endQuaternion
+    cosAngle = -cosAngle
+  if cosAngle > 0.9995:
+    quaternions = startQuaternion + fractions * (endQuaternion - startQuaternion)
+    return quaternions / numpy.linalg.norm(quaternions, axis=-1, keepdims=True)
+  angle = numpy.arccos(cosAngle)
+  sinAngle = numpy.sin(angle)
+  startWeights = numpy.sin((1 - fractions) * angle) / sinAngle
+  endWeights = numpy.sin(fractions * angle) / sinAngle
+  return startWeights * startQuaternion + endWeights * endQuaternion
+
+
+class TransformInterpolator(object):
+  """Interpolates between a start and end 4x4 matrix.
+  The decomposition is done once at construction; evaluate
+  maps an array of fractions in [0,1] to an (N,4,4) matrix stack."""
+
+  def __init__(self, startMatrix, endMatrix):
+    self.startMatrix = numpy.array(startMatrix, dtype=float)
+    self.endMatrix = numpy.array(endMatrix, dtype=float)
+    rotations, stretches = polarDecomposition(numpy.stack([self.startMatrix[:3,:3], self.endMatrix[:3,:3]]))
+    self.startQuaternion, self.endQuaternion = quaternionsFromRotations(rotations)
+    self.startStretch = stretches[0]
+    self.deltaStretch = stretches[1] - stretches[0]
+    # translation and the (normally constant) bottom row are interpolated linearly
+    self.startColumn = self.startMatrix[:,3]
+    self.deltaColumn = self.endMatrix[:,3] - self.startMatrix[:,3]
+    self.startRow = self.startMatrix[3,:3]
+    self.deltaRow = self.endMatrix[3,:3] - self.startMatrix[3,:3]
+
+  def evaluate(self, fractions):
+    fractions = numpy.atleast_1d(numpy.asarray(fractions, dtype=float))
+    weights = fractions[:,numpy.newaxis]
+    matrices = numpy.empty((len(fractions), 4, 4))
+    rotations = rotationsFromQuaternions(slerp(self.startQuaternion, self.endQuaternion, fractions))
+    stretches = self.startStretch + weights[:,:,numpy.newaxis] * self.deltaStretch
+    matrices[:,:3,:3] = rotations @ stretches
+    matrices[:,:,3] = self.startColumn + weights * self.deltaColumn
+    matrices[:,3,:3] = self.startRow + weights * self.deltaRow
+    return matrices
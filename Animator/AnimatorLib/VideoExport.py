@@ -0,0 +1,303 @@
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+
+import numpy
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+"""
+
+Streaming video export.
+
+Rendered frames are read back from the render window as raw RGB and
+written straight into the stdin of an ffmpeg process, so no image files
+are written or compressed on the way to the encoder.
+
+A FrameStream owns a small pool of frame buffers.  Submitting a frame
+copies it into a free buffer and queues that buffer to each encoder
+pipe, whose writer thread feeds it to ffmpeg and returns it to the pool
+once written.  When every buffer is in flight, submit blocks, so memory
+stays bounded and a slow encoder holds back the renderer.  The most
+recent buffer is kept so that a frame identical to the previous one can
+be repeated without being rendered or copied again.
+
+Several outputs, e.g. the same animation in three sizes, are written in
+one pass: frames are rendered at the size of the largest ExportTarget
+and each target gets its own encoder pipe, whose filter chain crops and
+scales the frames to the target size.
+
+GIFs are encoded in two steps by a GifTarget: the frames are first
+written losslessly, then a single palette is computed from a sample of
+them and the GIF is encoded with that palette, storing only the
+rectangle that changed from one frame to the next, at a frame rate that
+viewers display.
+
+"""
+
+class FrameGrabber(object):
+  """Reads the back buffer of a render window as an (height,width,3) uint8 array.
+  The returned array is a view of the filter output and is overwritten
+  by the next grab."""
+
+  def __init__(self, renderWindow):
+    self.windowToImage = vtk.vtkWindowToImageFilter()
+    self.windowToImage.SetInput(renderWindow)
+    self.windowToImage.SetInputBufferTypeToRGB()
+    self.windowToImage.ReadFrontBufferOff()
+    # the caller renders the frame, don't render it twice
+    self.windowToImage.ShouldRerenderOff()
+
+  def grab(self):
+    self.windowToImage.Modified()
+    self.windowToImage.Update()
+    image = self.windowToImage.GetOutput()
+    width, height, depth = image.GetDimensions()
+    scalars = image.GetPointData().GetScalars()
+    return vtk_to_numpy(scalars).reshape(height, width, scalars.GetNumberOfComponents())
+
+
+class ExportTarget(object):
+  """One output of an export: the file, its ffmpeg output options and its
+  size, where None is the size the frames are rendered at"""
+
+  def __init__(self, outputPath, outputOptions=[], width=None, height=None):
+    self.outputPath = outputPath
+    self.outputOptions = list(outputOptions)
+    self.width = width
+    self.height = height
+
+  def encoderOutput(self):
+    """The (path, options) the encoder pipe writes"""
+    return self.outputPath, self.outputOptions
+
+  def finish(self, ffmpegPath, frameCount, framesPerSecond):
+    """Called once the encoder wrote frameCount frames"""
+    pass
+
+  def discard(self):
+    """Called instead of finish when the export fails or is canceled"""
+    pass
+
+
+# browsers show frame delays below 2/100 s as 10/100 s, and
+# 4/100 s is the shortest delay that is exact at a whole frame rate
+GIF_MAX_FRAMES_PER_SECOND = 25
+
+PALETTE_SAMPLES = 32
+
+class GifTarget(ExportTarget):
+  """An animated GIF with one palette computed from PALETTE_SAMPLES
+  evenly spaced frames.  Frames store only the rectangle that changed
+  since the previous frame, and frames are dropped as needed to play
+  at no more than maxFramesPerSecond for the same duration."""
+
+  def __init__(self, outputPath, width=None, height=None,
+               maxFramesPerSecond=GIF_MAX_FRAMES_PER_SECOND, paletteSamples=PALETTE_SAMPLES):
+    ExportTarget.__init__(self, outputPath, [], width, height)
+    self.maxFramesPerSecond = maxFramesPerSecond
+    self.paletteSamples = paletteSamples
+    self.intermediatePath = None
+
+  def encoderOutput(self):
+    handle, self.intermediatePath = tempfile.mkstemp(prefix='AnimatorGif-', suffix='.mkv')
+    os.close(handle)
+    return self.intermediatePath, ['-c:v', 'ffv1']
+
+  def finish(self, ffmpegPath, frameCount, framesPerSecond):
+    palettePath = self.intermediatePath + '-palette.png'
+    try:
+      sampleStep = max(1, frameCount // self.paletteSamples)
+      runFfmpeg([ffmpegPath, '-y', '-loglevel', 'error', '-i', self.intermediatePath,
+                 '-vf', 'select=not(mod(n\\,%d)),palettegen=stats_mode=full' % sampleStep,
+                 palettePath])
+      gifFilters = 'paletteuse=dither=sierra2_4a:diff_mode=rectangle'
+      if framesPerSecond > self.maxFramesPerSecond:
+        gifFilters = 'fps=%g[frames];[frames][1:v]' % self.maxFramesPerSecond + gifFilters
+      runFfmpeg([ffmpegPath, '-y', '-loglevel', 'error', '-i', self.intermediatePath, '-i', palettePath,
+                 '-lavfi', gifFilters, self.outputPath])
+    finally:
+      for path in (palettePath, self.intermediatePath):
+        if os.path.exists(path):
+          os.remove(path)
+      self.intermediatePath = None
+
+  def discard(self):
+    if self.intermediatePath and os.path.exists(self.intermediatePath):
+      os.remove(self.intermediatePath)
+    self.intermediatePath = None
+
+
+def runFfmpeg(command):
+  """Run an ffmpeg command, raising RuntimeError with its messages if it fails"""
+  process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+  if process.returncode != 0:
+    raise RuntimeError("%s failed (%s): %s" % (os.path.basename(command[0]), process.returncode,
+                                               process.stderr.decode(errors='replace')))
+
+
+def renderSize(targets):
+  """The (width, height) of the largest target, or None if no target has a size"""
+  sizes = [(target.width, target.height) for target in targets if target.width and target.height]
+  if not sizes:
+    return None
+  return max(sizes, key=lambda size: size[0] * size[1])
+
+def resizeFilters(sourceWidth, sourceHeight, width, height):
+  """ffmpeg filters that fit frames of the source size to width x height.
+  A different aspect ratio is cropped around the center before scaling."""
+  filters = []
+  if width * sourceHeight != height * sourceWidth:
+    croppedWidth = min(sourceWidth, int(round(sourceHeight * width / float(height))))
+    croppedHeight = min(sourceHeight, int(round(sourceWidth * height / float(width))))
+    filters.append('crop=%d:%d' % (croppedWidth, croppedHeight))
+    sourceWidth, sourceHeight = croppedWidth, croppedHeight
+  if (width, height) != (sourceWidth, sourceHeight):
+    filters.append('scale=%d:%d:flags=area' % (width, height))
+  return filters
+
+
+class EncoderPipe(object):
+  """An ffmpeg process encoding raw rgb24 frames read from its stdin.
+  The frames come bottom row first, as read from OpenGL, and are
+  flipped by the encoder's filter chain."""
+
+  def __init__(self, ffmpegPath, width, height, framesPerSecond, outputPath, outputOptions=[], filters=[]):
+    self.outputPath = outputPath
+    command = [ffmpegPath, '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+               '-s', '%dx%d' % (width, height),
+               '-r', str(framesPerSecond),
+               '-i', '-',
+               '-vf', ','.join(['vflip'] + list(filters))]
+    command += list(outputOptions)
+    command.append(outputPath)
+    self.errorLog = tempfile.TemporaryFile()
+    self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.errorLog)
+    self.frames = queue.Queue()
+    self.error = None
+    self.thread = threading.Thread(target=self.writeFrames)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def write(self, buffer, onWritten):
+    """Queue a buffer for writing; onWritten(buffer) is called once it is written"""
+    self.frames.put((buffer, onWritten))
+
+  def writeFrames(self):
+    while True:
+      buffer, onWritten = self.frames.get()
+      if buffer is None:
+        break
+      if self.error is None:
+        try:
+          self.process.stdin.write(buffer)
+        except (BrokenPipeError, OSError) as error:
+          self.error = error
+      onWritten(buffer)
+    try:
+      self.process.stdin.close()
+    except (BrokenPipeError, OSError):
+      pass
+
+  def close(self):
+    """Finish the stream and wait for the encoder.
+    Raises RuntimeError with ffmpeg's messages if encoding failed."""
+    self.frames.put((None, None))
+    self.thread.join()
+    returnCode = self.process.wait()
+    self.errorLog.seek(0)
+    messages = self.errorLog.read().decode(errors='replace')
+    self.errorLog.close()
+    if returnCode != 0 or self.error is not None:
+      raise RuntimeError("Encoding %s failed (%s): %s" % (self.outputPath, returnCode, messages or self.error))
+
+  def abort(self):
+    self.process.kill()
+    self.frames.put((None, None))
+    self.thread.join()
+    self.process.wait()
+    self.errorLog.close()
+
+
+class FrameStream(object):
+  """Bounded pool of frame buffers fanned out to one or more encoder pipes."""
+
+  @classmethod
+  def forTargets(cls, ffmpegPath, targets, frameShape, framesPerSecond, maxQueuedFrames=8):
+    """A stream of frames of frameShape into an encoder pipe per ExportTarget"""
+    height, width = frameShape[:2]
+    pipes = []
+    try:
+      for target in targets:
+        filters = resizeFilters(width, height, target.width or width, target.height or height)
+        outputPath, outputOptions = target.encoderOutput()
+        pipes.append(EncoderPipe(ffmpegPath, width, height, framesPerSecond,
+                                 outputPath, outputOptions, filters))
+    except Exception:
+      for pipe in pipes:
+        pipe.abort()
+      raise
+    return cls(pipes, frameShape, maxQueuedFrames)
+
+  def __init__(self, pipes, frameShape, maxQueuedFrames=8):
+    self.pipes = pipes
+    self.freeBuffers = queue.Queue()
+    for index in range(maxQueuedFrames):
+      self.freeBuffers.put(numpy.empty(frameShape, dtype=numpy.uint8))
+    self.pendingWrites = {}
+    self.lastBuffer = None
+    self.lock = threading.Lock()
+
+  def submit(self, frame):
+    """Copy a frame into a free buffer and queue it to every pipe.
+    Blocks while all buffers are waiting to be written."""
+    with self.lock:
+      previousBuffer = self.lastBuffer
+      self.lastBuffer = None
+      if previousBuffer is not None and id(previousBuffer) not in self.pendingWrites:
+        self.freeBuffers.put(previousBuffer)
+    buffer = self.freeBuffers.get()
+    numpy.copyto(buffer, frame)
+    with self.lock:
+      self.lastBuffer = buffer
+    self.dispatch(buffer)
+
+  def repeat(self):
+    """Queue the previously submitted frame again"""
+    if self.lastBuffer is None:
+      raise ValueError("No frame to repeat")
+    self.dispatch(self.lastBuffer)
+
+  def dispatch(self, buffer):
+    with self.lock:
+      self.pendingWrites[id(buffer)] = self.pendingWrites.get(id(buffer), 0) + len(self.pipes)
+    for pipe in self.pipes:
+      pipe.write(buffer, self.onWritten)
+
+  def onWritten(self, buffer):
+    with self.lock:
+      self.pendingWrites[id(buffer)] -= 1
+      released = self.pendingWrites[id(buffer)] == 0
+      if released:
+        del self.pendingWrites[id(buffer)]
+        released = buffer is not self.lastBuffer
+    if released:
+      self.freeBuffers.put(buffer)
+
+  def close(self):
+    """Wait for every pipe to finish, raising the first encoder error"""
+    errors = []
+    for pipe in self.pipes:
+      try:
+        pipe.close()
+      except RuntimeError as error:
+        errors.append(error)
+    if errors:
+      raise errors[0]
+
+  def abort(self):
+    for pipe in self.pipes:
+      pipe.abort()
@@ -0,0 +1,346 @@
+import numpy
+import qt, slicer
+
+from AnimatorLib import TransferFunctions
+from AnimatorLib.AnimatorAction import AnimatorAction
+
+"""
+
+Animator plugins for volume rendering.
+
+ROIAction moves and resizes the cropping roi and VolumePropertyAction
+blends the transfer functions of two volume properties.
+
+"""
+
+class ROIAction(AnimatorAction):
+  """Defines an animation of an roi (e.g. for volume cropping).
+  With 'keyframes' each key holds the center and radius of the roi
+  and the start and end ROIs are not used.
+  """
+  def __init__(self):
+    super(ROIAction,self).__init__()
+    self.name = "ROI"
+    self.start = [0.,]*3
+    self.end = [0.,]*3
+    self.animated = [0.,]*3
+
+  def defaultAction(self):
+    startROI = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLAnnotationROINode')
+    startROI.SetName('Start ROI')
+    endROI = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLAnnotationROINode')
+    endROI.SetName('End ROI')
+    for roi in [startROI, endROI]:
+      for index in range(roi.GetNumberOfDisplayNodes()):
+        roi.GetNthDisplayNode(index).SetVisibility(False)
+    #
+    # TODO: what to do if volume rendering not yet set up
+    #
+    volumeRenderingNode = slicer.mrmlScene.GetFirstNodeByName('VolumeRendering')
+    animatedROI = volumeRenderingNode.GetROINode()
+    volumeRenderingNode.SetCroppingEnabled(True)
+
+    start = [0.,]*3
+    animatedROI.GetXYZ(start)
+    startROI.SetXYZ(start)
+    endROI.SetXYZ(start)
+    animatedROI.GetRadiusXYZ(start)
+    startROI.SetRadiusXYZ(start)
+    end = [0.,]*3
+    for i in range(3):
+      end[i] = start[i] / 2.
+    endROI.SetRadiusXYZ(end)
+
+    roiAction = {
+      'name': 'ROI',
+      'class': 'ROIAction',
+      'id': 'roi-'+str(self.uuid),
+      'startTime': 1,
+      'endTime': 4,
+      'interpolation': 'linear',
+      'startROIID': startROI.GetID(),
+      'endROIID': endROI.GetID(),
+      'animatedROIID': animatedROI.GetID(),
+    }
+    return(roiAction)
+
+  def keyValue(self, roi):
+    roi.GetXYZ(self.animated)
+    value = list(self.animated)
+    roi.GetRadiusXYZ(self.animated)
+    return value + list(self.animated)
+
+  def bake(self, action, scriptTimes):
+    """Center and radius of the roi"""
+    if self.track is not None:
+      return self.track.evaluate(scriptTimes, self.easing)
+    start = numpy.array(self.keyValue(self.nodes['startROIID']))
+    end = numpy.array(self.keyValue(self.nodes['endROIID']))
+    fractions = self.fractions(action, scriptTimes)
+    return start + fractions[:,numpy.newaxis] * (end - start)
+
+  def applyBaked(self, action, sample):
+    animatedROI = self.nodes['animatedROIID']
+    animatedROI.SetXYZ(sample[:3])
+    animatedROI.SetRadiusXYZ(sample[3:])
+
+  def act(self, action, scriptTime):
+    if self.track is not None:
+      value = self.track.evaluate([scriptTime], self.easing)[0]
+      animatedROI = self.nodes['animatedROIID']
+      animatedROI.SetXYZ(value[:3])
+      animatedROI.SetRadiusXYZ(value[3:])
+      return
+    startROI = self.nodes['startROIID']
+    endROI = self.nodes['endROIID']
+    animatedROI = self.nodes['animatedROIID']
+    start = self.start
+    end = self.end
+    animated = self.animated
+    if scriptTime <= action['startTime']:
+      startROI.GetXYZ(start)
+      animatedROI.SetXYZ(start)
+      startROI.GetRadiusXYZ(start)
+      animatedROI.SetRadiusXYZ(start)
+    elif scriptTime >= action['endTime']:
+      endROI.GetXYZ(end)
+      animatedROI.SetXYZ(end)
+      endROI.GetRadiusXYZ(end)
+      animatedROI.SetRadiusXYZ(end)
+    else:
+      fraction = self.fraction(action, scriptTime)
+      startROI.GetXYZ(start)
+      endROI.GetXYZ(end)
+      for i in range(3):
+        animated[i] = start[i] + fraction * (end[i]-start[i])
+      animatedROI.SetXYZ(animated)
+      startROI.GetRadiusXYZ(start)
+      endROI.GetRadiusXYZ(end)
+      for i in range(3):
+        animated[i] = start[i] + fraction * (end[i]-start[i])
+      animatedROI.SetRadiusXYZ(animated)
+
+  def gui(self, action, layout):
+    super(ROIAction,self).gui(action, layout)
+
+    if 'keyframes' in action:
+      layout.addRow("Keyframes", qt.QLabel(str(len(action['keyframes']['times']))))
+    else:
+      self.startSelector = slicer.qMRMLNodeComboBox()
+      self.startSelector.nodeTypes = ["vtkMRMLAnnotationROINode"]
+      self.startSelector.addEnabled = True
+      self.startSelector.renameEnabled = True
+      self.startSelector.removeEnabled = False
+      self.startSelector.noneEnabled = False
+      self.startSelector.selectNodeUponCreation = True
+      self.startSelector.showHidden = True
+      self.startSelector.showChildNodeTypes = True
+      self.startSelector.setMRMLScene( slicer.mrmlScene )
+      self.startSelector.setToolTip( "Pick the start ROI" )
+      self.startSelector.currentNodeID = action['startROIID']
+      layout.addRow("Start ROI", self.startSelector)
+
+      self.endSelector = slicer.qMRMLNodeComboBox()
+      self.endSelector.nodeTypes = ["vtkMRMLAnnotationROINode"]
+      self.endSelector.addEnabled = True
+      self.endSelector.renameEnabled = True
+      self.endSelector.removeEnabled = False
+      self.endSelector.noneEnabled = False
+      self.endSelector.selectNodeUponCreation = True
+      self.endSelector.showHidden = True
+      self.endSelector.showChildNodeTypes = True
+      self.endSelector.setMRMLScene( slicer.mrmlScene )
+      self.endSelector.setToolTip( "Pick the end ROI" )
+      self.endSelector.currentNodeID = action['endROIID']
+      layout.addRow("End ROI", self.endSelector)
+
+    self.animatedSelector = slicer.qMRMLNodeComboBox()
+    self.animatedSelector.nodeTypes = ["vtkMRMLAnnotationROINode"]
+    self.animatedSelector.addEnabled = True
+    self.animatedSelector.renameEnabled = True
+    self.animatedSelector.removeEnabled = False
+    self.animatedSelector.noneEnabled = False
+    self.animatedSelector.selectNodeUponCreation = True
+    self.animatedSelector.showHidden = True
+    self.animatedSelector.showChildNodeTypes = True
+    self.animatedSelector.setMRMLScene( slicer.mrmlScene )
+    self.animatedSelector.setToolTip( "Pick the animated ROI" )
+    self.animatedSelector.currentNodeID = action['animatedROIID']
+    layout.addRow("Animated ROI", self.animatedSelector)
+
+  def updateFromGUI(self, action):
+    super(ROIAction,self).updateFromGUI(action)
+    if 'keyframes' not in action:
+      action['startROIID'] = self.startSelector.currentNodeID
+      action['endROIID'] = self.endSelector.currentNodeID
+    action['animatedROIID'] = self.animatedSelector.currentNodeID
+
+
+class VolumePropertyAction(AnimatorAction):
+  """Defines an animation of an roi (e.g. for volume cropping)"""
+  def __init__(self):
+    super(VolumePropertyAction,self).__init__()
+    self.name = "Volume Property"
+
+  def defaultAction(self):
+    startVolumeProperty = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLVolumePropertyNode')
+    startVolumeProperty.SetName('Start VolumeProperty')
+    endVolumeProperty = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLVolumePropertyNode')
+    endVolumeProperty.SetName('End VolumeProperty')
+    #
+    # TODO: what to do if volume rendering not yet set up
+    #
+    volumeRenderingNode = slicer.mrmlScene.GetFirstNodeByName('VolumeRendering')
+    if volumeRenderingNode is None:
+      volumeNode = slicer.mrmlScene.GetFirstNodeByClass('vtkMRMLScalarVolumeNode')
+      if volumeNode is None:
+          print("No volume node in the scene")
+          return
+      logic = slicer.modules.volumerendering.logic()
+      displayNode = logic.CreateVolumeRenderingDisplayNode()
+      slicer.mrmlScene.AddNode(displayNode)
+      displayNode.UnRegister(logic)
+      logic.UpdateDisplayNodeFromVolumeNode(displayNode, volumeNode)
+      volumeNode.AddAndObserveDisplayNodeID(displayNode.GetID())
+    volumeRenderingNode = slicer.mrmlScene.GetFirstNodeByName('VolumeRendering')
+    animatedVolumeProperty = volumeRenderingNode.GetVolumePropertyNode()
+
+    startVolumeProperty.CopyParameterSet(animatedVolumeProperty)
+    endVolumeProperty.CopyParameterSet(animatedVolumeProperty)
+
+    volumePropertyAction = {
+      'name': 'Volume Property',
+      'class': 'VolumePropertyAction',
+      'id': 'volumeProperty1-'+str(self.uuid),
+      'startTime': 0,
+      'endTime': 1,
+      'interpolation': 'linear',
+      'startVolumePropertyID': startVolumeProperty.GetID(),
+      'endVolumePropertyID': endVolumeProperty.GetID(),
+      'animatedVolumePropertyID': animatedVolumeProperty.GetID(),
+    }
+    return(volumePropertyAction)
+
+  def transferFunctions(self, volumePropertyNode):
+    return (volumePropertyNode.GetScalarOpacity(),
+            volumePropertyNode.GetColor(),
+            volumePropertyNode.GetGradientOpacity())
+
+  def sourceMTime(self):
+    """Changes whenever a start or end transfer function is edited or replaced"""
+    mtime = 0
+    for key in ('startVolumePropertyID', 'endVolumePropertyID'):
+      for function in self.transferFunctions(self.nodes[key]):
+        mtime = max(mtime, function.GetMTime())
+    return mtime
+
+  def compile(self, action):
+    startFunctions = self.transferFunctions(self.nodes['startVolumePropertyID'])
+    endFunctions = self.transferFunctions(self.nodes['endVolumePropertyID'])
+    columns = (TransferFunctions.PIECEWISE_COLUMNS,
+               TransferFunctions.COLOR_COLUMNS,
+               TransferFunctions.PIECEWISE_COLUMNS)
+    self.blends = []
+    for startFunction, endFunction, functionColumns in zip(startFunctions, endFunctions, columns):
+      self.blends.append(TransferFunctions.FunctionBlend(startFunction, endFunction, functionColumns))
+    self.compiledMTime = self.sourceMTime()
+    # the non transfer function parameters are copied from the start
+    # property once when interpolation begins rather than every frame
+    self.parametersCopied = False
+
+  def act(self, action, scriptTime):
+    startVolumeProperty = self.nodes['startVolumePropertyID']
+    endVolumeProperty = self.nodes['endVolumePropertyID']
+    animatedVolumeProperty = self.nodes['animatedVolumePropertyID']
+
+    # TODO: set only volume in the scene to use animatedVolumeProperty
+    # TODO: animated to animated
+
+    if scriptTime <= action['startTime']:
+      animatedVolumeProperty.CopyParameterSet(startVolumeProperty)
+      self.parametersCopied = False
+    elif scriptTime >= action['endTime']:
+      animatedVolumeProperty.CopyParameterSet(endVolumeProperty)
+      self.parametersCopied = False
+    else:
+      fraction = self.fraction(action, scriptTime)
+      if self.sourceMTime() != self.compiledMTime:
+        self.compile(action)
+      disabledModify = animatedVolumeProperty.StartModify()
+      if not self.parametersCopied:
+        animatedVolumeProperty.CopyParameterSet(startVolumeProperty)
+        self.parametersCopied = True
+      animatedFunctions = self.transferFunctions(animatedVolumeProperty)
+      for blend, animatedFunction in zip(self.blends, animatedFunctions):
+        blend.blend(fraction, animatedFunction)
+      animatedVolumeProperty.EndModify(disabledModify)
+
+  def bake(self, action, scriptTimes):
+    """The control points of the three transfer functions, flattened
+       and concatenated"""
+    fractions = self.fractions(action, scriptTimes)[:,numpy.newaxis]
+    return numpy.concatenate([(blend.start.ravel() + fractions * blend.delta.ravel()) for blend in self.blends], axis=1)
+
+  def applyBaked(self, action, sample):
+    animatedVolumeProperty = self.nodes['animatedVolumePropertyID']
+    disabledModify = animatedVolumeProperty.StartModify()
+    if not self.parametersCopied:
+      animatedVolumeProperty.CopyParameterSet(self.nodes['startVolumePropertyID'])
+      self.parametersCopied = True
+    offset = 0
+    for blend, animatedFunction in zip(self.blends, self.transferFunctions(animatedVolumeProperty)):
+      size = blend.start.size
+      TransferFunctions.arrayToFunction(sample[offset:offset + size].reshape(blend.start.shape), animatedFunction)
+      offset += size
+    animatedVolumeProperty.EndModify(disabledModify)
+
+  def gui(self, action, layout):
+    super(VolumePropertyAction,self).gui(action, layout)
+
+    self.startSelector = slicer.qMRMLNodeComboBox()
+    self.startSelector.nodeTypes = ["vtkMRMLVolumePropertyNode"]
+    self.startSelector.addEnabled = True
+    self.startSelector.renameEnabled = True
+    self.startSelector.removeEnabled = False
+    self.startSelector.noneEnabled = False
+    self.startSelector.selectNodeUponCreation = True
+    self.startSelector.showHidden = True
+    self.startSelector.showChildNodeTypes = True
+    self.startSelector.setMRMLScene( slicer.mrmlScene )
+    self.startSelector.setToolTip( "Pick the start volume property" )
+    self.startSelector.currentNodeID = action['startVolumePropertyID']
+    layout.addRow("Start VolumeProperty", self.startSelector)
+
+    self.endSelector = slicer.qMRMLNodeComboBox()
+    self.endSelector.nodeTypes = ["vtkMRMLVolumePropertyNode"]
+    self.endSelector.addEnabled = True
+    self.endSelector.renameEnabled = True
+    self.endSelector.removeEnabled = False
+    self.endSelector.noneEnabled = False
+    self.endSelector.selectNodeUponCreation = True
+    self.endSelector.showHidden = True
+    self.endSelector.showChildNodeTypes = True
+    self.endSelector.setMRMLScene( slicer.mrmlScene )
+    self.endSelector.setToolTip( "Pick the end volume property" )
+    self.endSelector.currentNodeID = action['endVolumePropertyID']
+    layout.addRow("End VolumeProperty", self.endSelector)
+
+    self.animatedSelector = slicer.qMRMLNodeComboBox()
+    self.animatedSelector.nodeTypes = ["vtkMRMLVolumePropertyNode"]
+    self.animatedSelector.addEnabled = True
+    self.animatedSelector.renameEnabled = True
+    self.animatedSelector.removeEnabled = False
+    self.animatedSelector.noneEnabled = False
+    self.animatedSelector.selectNodeUponCreation = True
+    self.animatedSelector.showHidden = True
+    self.animatedSelector.showChildNodeTypes = True
+    self.animatedSelector.setMRMLScene( slicer.mrmlScene )
+    self.animatedSelector.setToolTip( "Pick the animated volume property" )
+    self.animatedSelector.currentNodeID = action['animatedVolumePropertyID']
+    layout.addRow("Animated VolumeProperty", self.animatedSelector)
+
+  def updateFromGUI(self, action):
+    super(VolumePropertyAction,self).updateFromGUI(action)
+    action['startVolumePropertyID'] = self.startSelector.currentNodeID
+    action['endVolumePropertyID'] = self.endSelector.currentNodeID
+    action['animatedVolumePropertyID'] = self.animatedSelector.currentNodeID
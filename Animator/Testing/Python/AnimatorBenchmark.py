@@ -0,0 +1,614 @@
+"""
+
+Benchmarks for the Animator engine.
+
+Times script round trips, compileScript, AnimatorLogic.act and the act
+of each action plugin over a scene of N actions played for M frames,
+with K control points in each transfer function, and prints the
+results as JSON so runs can be compared:
+
+  python AnimatorBenchmark.py --actions 20 --frames 300 --points 256 --output results.json
+
+Inside Slicer (e.g. Slicer --no-main-window --python-script ...) the
+real scene is used.  Elsewhere only numpy and vtk are needed: a small
+stand-in for the slicer, qt and ctk modules provides the scene, nodes
+and sequences the engine uses, so the benchmark runs headless and
+without network access.  The stand-ins do no rendering, so the timings
+are those of the animation engine itself.
+
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import types
+
+import numpy
+import vtk
+
+#
+# stand-in scene
+#
+
+modifiedTimes = itertools.count(1)
+
+class StandInNode(object):
+  className = 'vtkMRMLNode'
+
+  def __init__(self):
+    self.id = None
+    self.name = ''
+    self.attributes = {}
+    self.references = {}
+    self.mtime = next(modifiedTimes)
+    self.disableModified = 0
+    self.modifiedWhileDisabled = False
+
+  def GetID(self):
+    return self.id
+
+  def GetName(self):
+    return self.name
+
+  def SetName(self, name):
+    self.name = name
+
+  def GetAttribute(self, name):
+    return self.attributes.get(name)
+
+  def SetAttribute(self, name, value):
+    self.attributes[name] = value
+    self.Modified()
+
+  def SetSaveWithScene(self, save):
+    pass
+
+  def HideFromEditorsOn(self):
+    pass
+
+  def GetNodeReferenceID(self, role):
+    return self.references.get(role)
+
+  def GetNodeReference(self, role):
+    return sys.modules['slicer'].mrmlScene.GetNodeByID(self.references.get(role))
+
+  def SetNodeReferenceID(self, role, nodeID):
+    self.references[role] = nodeID
+    self.Modified()
+
+  def RemoveNodeReferenceIDs(self, role):
+    self.references.pop(role, None)
+    self.Modified()
+
+  def IsA(self, className):
+    return className in [cls.className for cls in type(self).__mro__ if hasattr(cls, 'className')]
+
+  def GetMTime(self):
+    return self.mtime
+
+  def Modified(self):
+    self.mtime = next(modifiedTimes)
+    if self.disableModified:
+      self.modifiedWhileDisabled = True
+
+  def StartModify(self):
+    disabled = self.disableModified
+    self.disableModified = 1
+    return disabled
+
+  def EndModify(self, disabled):
+    self.disableModified = disabled
+    self.modifiedWhileDisabled = False
+
+class StandInScriptedModuleNode(StandInNode):
+  className = 'vtkMRMLScriptedModuleNode'
+
+class StandInLinearTransformNode(StandInNode):
+  className = 'vtkMRMLLinearTransformNode'
+
+  def __init__(self):
+    super(StandInLinearTransformNode, self).__init__()
+    self.matrix = vtk.vtkMatrix4x4()
+
+  def GetMatrixTransformFromParent(self, matrix):
+    matrix.DeepCopy(self.matrix)
+
+  def SetMatrixTransformFromParent(self, matrix):
+    self.matrix.DeepCopy(matrix)
+    self.Modified()
+
+class StandInROINode(StandInNode):
+  className = 'vtkMRMLAnnotationROINode'
+
+  def __init__(self):
+    super(StandInROINode, self).__init__()
+    self.xyz = [0.,]*3
+    self.radius = [1.,]*3
+
+  def GetXYZ(self, xyz):
+    xyz[:] = self.xyz
+
+  def SetXYZ(self, xyz):
+    self.xyz = [float(value) for value in xyz]
+    self.Modified()
+
+  def GetRadiusXYZ(self, radius):
+    radius[:] = self.radius
+
+  def SetRadiusXYZ(self, radius):
+    self.radius = [float(value) for value in radius]
+    self.Modified()
+
+class StandInVolumePropertyNode(StandInNode):
+  className = 'vtkMRMLVolumePropertyNode'
+
+  def __init__(self):
+    super(StandInVolumePropertyNode, self).__init__()
+    self.volumeProperty = vtk.vtkVolumeProperty()
+
+  def GetScalarOpacity(self):
+    return self.volumeProperty.GetScalarOpacity()
+
+  def GetColor(self):
+    return self.volumeProperty.GetRGBTransferFunction()
+
+  def GetGradientOpacity(self):
+    return self.volumeProperty.GetGradientOpacity()
+
+  def CopyParameterSet(self, other):
+    self.volumeProperty.DeepCopy(other.volumeProperty)
+    self.Modified()
+
+class StandInCameraNode(StandInNode):
+  className = 'vtkMRMLCameraNode'
+
+  def __init__(self):
+    super(StandInCameraNode, self).__init__()
+    self.camera = vtk.vtkCamera()
+
+  def GetCamera(self):
+    return self.camera
+
+  def GetPosition(self):
+    return self.camera.GetPosition()
+
+  def GetFocalPoint(self):
+    return self.camera.GetFocalPoint()
+
+  def GetViewUp(self):
+    return self.camera.GetViewUp()
+
+  def SetPosition(self, position):
+    self.camera.SetPosition(*position)
+    self.Modified()
+
+  def SetFocalPoint(self, focalPoint):
+    self.camera.SetFocalPoint(*focalPoint)
+    self.Modified()
+
+  def SetViewUp(self, viewUp):
+    self.camera.SetViewUp(*viewUp)
+    self.Modified()
+
+class StandInSequenceNode(StandInNode):
+  className = 'vtkMRMLSequenceNode'
+  NumericIndex = 0
+
+  def __init__(self):
+    super(StandInSequenceNode, self).__init__()
+    self.indexValues = []
+
+  def SetIndexType(self, indexType):
+    pass
+
+  def GetNumberOfDataNodes(self):
+    return len(self.indexValues)
+
+  def GetNthIndexValue(self, index):
+    return self.indexValues[index]
+
+  def RemoveDataNodeAtValue(self, value):
+    self.indexValues.remove(value)
+    self.Modified()
+
+  def UpdateIndexValue(self, oldValue, newValue):
+    self.indexValues[self.indexValues.index(oldValue)] = newValue
+    self.Modified()
+
+  def SetDataNodeAtValue(self, node, value):
+    if value not in self.indexValues:
+      self.indexValues.append(value)
+      self.indexValues.sort(key=float)
+    self.Modified()
+
+class StandInSequenceBrowserNode(StandInNode):
+  className = 'vtkMRMLSequenceBrowserNode'
+
+  def __init__(self):
+    super(StandInSequenceBrowserNode, self).__init__()
+    self.sequenceNodes = []
+
+  def AddSynchronizedSequenceNode(self, sequenceNode):
+    self.sequenceNodes.append(sequenceNode)
+
+class StandInModelDisplayNode(StandInNode):
+  className = 'vtkMRMLModelDisplayNode'
+
+  def __init__(self):
+    super(StandInModelDisplayNode, self).__init__()
+    self.opacity = 1.
+    self.color = (1., 1., 1.)
+
+  def GetOpacity(self):
+    return self.opacity
+
+  def SetOpacity(self, opacity):
+    if opacity != self.opacity:
+      self.opacity = opacity
+      self.Modified()
+
+  def GetColor(self):
+    return self.color
+
+  def SetColor(self, red, green, blue):
+    if (red, green, blue) != self.color:
+      self.color = (red, green, blue)
+      self.Modified()
+
+class StandInTextNode(StandInNode):
+  className = 'vtkMRMLTextNode'
+  CreateStorageNodeAlways = 2
+
+  def __init__(self):
+    super(StandInTextNode, self).__init__()
+    self.text = ''
+
+  def GetText(self):
+    return self.text
+
+  def SetText(self, text):
+    self.text = text
+    self.Modified()
+
+  def SetForceCreateStorageNode(self, force):
+    pass
+
+class StandInScene(object):
+  NodeAddedEvent = 'NodeAddedEvent'
+  NodeRemovedEvent = 'NodeRemovedEvent'
+  StartSaveEvent = 'StartSaveEvent'
+  EndCloseEvent = 'EndCloseEvent'
+
+  nodeClasses = dict([(cls.className, cls) for cls in (
+    StandInScriptedModuleNode, StandInLinearTransformNode, StandInROINode,
+    StandInVolumePropertyNode, StandInCameraNode, StandInSequenceNode,
+    StandInSequenceBrowserNode, StandInModelDisplayNode, StandInTextNode)])
+
+  def __init__(self):
+    self.nodes = {}
+    self.observers = {}
+    self.nodeCounts = itertools.count(1)
+    self.observerTags = itertools.count(1)
+
+  def AddNewNodeByClass(self, className):
+    node = self.nodeClasses[className]()
+    node.id = '%s%d' % (className, next(self.nodeCounts))
+    self.nodes[node.id] = node
+    return node
+
+  def GetNodeByID(self, nodeID):
+    return self.nodes.get(nodeID)
+
+  def RemoveNode(self, node):
+    self.nodes.pop(node.GetID(), None)
+
+  def AddObserver(self, event, callback):
+    tag = next(self.observerTags)
+    self.observers[tag] = (event, callback)
+    return tag
+
+  def IsClosing(self):
+    return False
+
+  def Clear(self, removeSingletons=0):
+    self.nodes = {}
+
+class StandInTimer(object):
+  """Never fires, the benchmark flushes explicitly"""
+  def __init__(self):
+    self.singleShot = False
+    self.interval = 0
+
+  def connect(self, signal, slot):
+    pass
+
+  def start(self):
+    pass
+
+  def stop(self):
+    pass
+
+def arrayFromVTKMatrix(matrix):
+  array = numpy.zeros((4, 4))
+  matrix.DeepCopy(array.ravel(), matrix)
+  return array
+
+def updateVTKMatrixFromArray(matrix, array):
+  matrix.DeepCopy(numpy.ascontiguousarray(array, dtype=float).ravel())
+
+def installStandIns():
+  """Register stand-in slicer, qt and ctk modules"""
+  slicerModule = types.ModuleType('slicer')
+  slicerModule.mrmlScene = StandInScene()
+  slicerModule.modules = types.SimpleNamespace()
+  slicerModule.app = types.SimpleNamespace(temporaryPath=os.environ.get('TMPDIR', '/tmp'), layoutManager=lambda: None)
+  slicerModule.util = types.SimpleNamespace(arrayFromVTKMatrix=arrayFromVTKMatrix,
+                                            updateVTKMatrixFromArray=updateVTKMatrixFromArray)
+  slicerModule.vtkMRMLScriptedModuleNode = StandInScriptedModuleNode
+  scriptedLoadableModule = types.ModuleType('slicer.ScriptedLoadableModule')
+  class ScriptedLoadableModuleStandIn(object):
+    def __init__(self, parent=None):
+      self.parent = parent
+  for name in ('ScriptedLoadableModule', 'ScriptedLoadableModuleWidget',
+               'ScriptedLoadableModuleLogic', 'ScriptedLoadableModuleTest'):
+    setattr(scriptedLoadableModule, name, type(name, (ScriptedLoadableModuleStandIn,), {}))
+  scriptedLoadableModule.__all__ = ['ScriptedLoadableModule', 'ScriptedLoadableModuleWidget',
+                                    'ScriptedLoadableModuleLogic', 'ScriptedLoadableModuleTest']
+  slicerModule.ScriptedLoadableModule = scriptedLoadableModule
+  sys.modules['slicer'] = slicerModule
+  sys.modules['slicer.ScriptedLoadableModule'] = scriptedLoadableModule
+  qtModule = types.ModuleType('qt')
+  qtModule.QTimer = StandInTimer
+  sys.modules['qt'] = qtModule
+  sys.modules['ctk'] = types.ModuleType('ctk')
+
+#
+# scene setup
+#
+
+def transferFunctionPoints(volumePropertyNode, pointCount, rng):
+  scalars = numpy.sort(rng.uniform(0, 1000, pointCount))
+  scalarOpacity = volumePropertyNode.GetScalarOpacity()
+  color = volumePropertyNode.GetColor()
+  gradientOpacity = volumePropertyNode.GetGradientOpacity()
+  for scalar in scalars:
+    scalarOpacity.AddPoint(scalar, rng.uniform())
+    color.AddRGBPoint(scalar, rng.uniform(), rng.uniform(), rng.uniform())
+  gradientOpacity.AddPoint(0, 0)
+  gradientOpacity.AddPoint(100, 1)
+
+def addAction(scene, className, index, duration, pointCount, rng):
+  """A script entry for one action of the class with fresh nodes"""
+  startTime = rng.uniform(0, duration * 0.5)
+  action = {
+    'name': '%s %d' % (className, index),
+    'class': className,
+    'id': '%s-%d' % (className, index),
+    'startTime': startTime,
+    'endTime': startTime + rng.uniform(0.1, duration * 0.5),
+    'interpolation': ['linear', 'easeInOut', 'easeIn'][index % 3],
+  }
+  def addNode(nodeClassName):
+    return scene.AddNewNodeByClass(nodeClassName)
+  if className == 'TranslationAction':
+    start, end, animated = [addNode('vtkMRMLLinearTransformNode') for node in range(3)]
+    matrix = vtk.vtkMatrix4x4()
+    transform = vtk.vtkTransform()
+    transform.RotateWXYZ(rng.uniform(0, 180), *rng.normal(size=3))
+    transform.Translate(*rng.normal(0, 10, 3))
+    transform.GetMatrix(matrix)
+    end.SetMatrixTransformFromParent(matrix)
+    action.update({'startTransformID': start.GetID(), 'endTransformID': end.GetID(),
+                   'animatedTransformID': animated.GetID()})
+  elif className == 'ROIAction':
+    start, end, animated = [addNode('vtkMRMLAnnotationROINode') for node in range(3)]
+    end.SetXYZ(rng.normal(0, 10, 3))
+    end.SetRadiusXYZ(rng.uniform(1, 10, 3))
+    action.update({'startROIID': start.GetID(), 'endROIID': end.GetID(), 'animatedROIID': animated.GetID()})
+  elif className == 'VolumePropertyAction':
+    start, end, animated = [addNode('vtkMRMLVolumePropertyNode') for node in range(3)]
+    transferFunctionPoints(start, pointCount, rng)
+    transferFunctionPoints(end, pointCount, rng)
+    action.update({'startVolumePropertyID': start.GetID(), 'endVolumePropertyID': end.GetID(),
+                   'animatedVolumePropertyID': animated.GetID()})
+  elif className == 'CameraRotationAction':
+    reference, animated = [addNode('vtkMRMLCameraNode') for node in range(2)]
+    action.update({'referenceCameraID': reference.GetID(), 'animatedCameraID': animated.GetID(),
+                   'degreesPerSecond': 90, 'animationMethod': 'azimuth'})
+  elif className == 'CameraPathAction':
+    animated = addNode('vtkMRMLCameraNode')
+    keyCameras = []
+    for key in range(8):
+      position = rng.normal(0, 100, 3)
+      keyCameras.append(list(position) + list(position + rng.normal(0, 10, 3)) + [0., 0., 1.])
+    action.update({'animatedCameraID': animated.GetID(), 'keyCameras': keyCameras})
+  elif className == 'PropertyTrackAction':
+    animated = addNode('vtkMRMLModelDisplayNode')
+    if index % 2:
+      action.update({'animatedNodeID': animated.GetID(), 'property': 'Opacity',
+                     'startValue': [1.], 'endValue': [rng.uniform(0, 1)]})
+    else:
+      times = numpy.sort(rng.uniform(0, duration, 8))
+      action.update({'animatedNodeID': animated.GetID(), 'property': 'Color',
+                     'startTime': times[0], 'endTime': times[-1],
+                     'keyframes': {'times': times.tolist(), 'values': rng.uniform(0, 1, (8, 3)).tolist()}})
+  else:
+    raise ValueError("No benchmark setup for %s" % className)
+  return action
+
+#
+# measurements
+#
+
+BENCHMARK_CLASSES = ['TranslationAction', 'ROIAction', 'VolumePropertyAction',
+                     'CameraRotationAction', 'CameraPathAction', 'PropertyTrackAction']
+
+def summarize(name, durations, **details):
+  durations = numpy.array(durations)
+  result = {'name': name, 'count': len(durations), 'total': float(durations.sum()),
+            'mean': float(durations.mean()), 'p50': float(numpy.percentile(durations, 50)),
+            'p95': float(numpy.percentile(durations, 95)), 'max': float(durations.max())}
+  result.update(details)
+  return result
+
+def timeFrames(logic, animationNode, frameTimes):
+  durations = []
+  for scriptTime in frameTimes:
+    start = time.perf_counter()
+    logic.act(animationNode, scriptTime)
+    durations.append(time.perf_counter() - start)
+  return durations
+
+def newAnimation(scene, logic, actions, duration, framesPerSecond):
+  animationNode = scene.AddNewNodeByClass('vtkMRMLScriptedModuleNode')
+  animationNode.SetName('Benchmark')
+  animationNode.SetAttribute('ModuleName', 'Animation')
+  script = {'title': 'Benchmark', 'duration': duration, 'framesPerSecond': framesPerSecond,
+            'actions': dict([(action['id'], action) for action in actions])}
+  logic.setScript(animationNode, script)
+  return animationNode
+
+def run(arguments):
+  import slicer
+  start = time.perf_counter()
+  from Animator import AnimatorLogic
+  moduleImport = time.perf_counter() - start
+
+  rng = numpy.random.default_rng(arguments.seed)
+  scene = slicer.mrmlScene
+  logic = AnimatorLogic()
+  duration = arguments.frames / float(arguments.framesPerSecond)
+  frameTimes = numpy.arange(arguments.frames) / float(arguments.framesPerSecond)
+  results = [summarize('moduleImport', [moduleImport],
+                       loadedPlugins=sorted(className for className in slicer.modules.animatorActionPlugins.keys()
+                                            if slicer.modules.animatorActionPlugins.isLoaded(className)))]
+
+  mixedActions = [addAction(scene, BENCHMARK_CLASSES[index % len(BENCHMARK_CLASSES)], index,
+                            duration, arguments.points, rng) for index in range(arguments.actions)]
+  animationNode = newAnimation(scene, logic, mixedActions, duration, arguments.framesPerSecond)
+
+  durations = []
+  for repeat in range(arguments.repeat):
+    start = time.perf_counter()
+    logic.setScript(animationNode, logic.getScript(animationNode))
+    durations.append(time.perf_counter() - start)
+  results.append(summarize('scriptRoundTrip', durations, actions=arguments.actions))
+
+  durations = []
+  for repeat in range(arguments.repeat):
+    logic.setAction(animationNode, next(iter(logic.getActions(animationNode).values())))
+    start = time.perf_counter()
+    logic.flushScript(animationNode)
+    durations.append(time.perf_counter() - start)
+  results.append(summarize('scriptFlush', durations, actions=arguments.actions,
+                           inlineCharacters=len(animationNode.GetAttribute('Animation.script'))))
+
+  durations = []
+  for repeat in range(arguments.repeat):
+    AnimatorLogic.scriptModels.models.pop(animationNode)
+    start = time.perf_counter()
+    logic.getScript(animationNode)
+    durations.append(time.perf_counter() - start)
+  results.append(summarize('scriptLoad', durations, actions=arguments.actions))
+
+  durations = []
+  for repeat in range(arguments.repeat):
+    start = time.perf_counter()
+    logic.compileScript(animationNode)
+    durations.append(time.perf_counter() - start)
+  results.append(summarize('compileScript', durations, frames=arguments.frames))
+
+  start = time.perf_counter()
+  logic.getPlan(animationNode).bind()
+  results.append(summarize('bind', [time.perf_counter() - start], actions=arguments.actions))
+
+  durations = []
+  for repeat in range(arguments.repeat):
+    logic.getPlan(animationNode).resetAppliedState()
+    durations += timeFrames(logic, animationNode, frameTimes)
+  results.append(summarize('logicAct.sequential', durations, actions=arguments.actions, frames=arguments.frames))
+
+  scrubTimes = rng.permutation(frameTimes)
+  logic.getPlan(animationNode).resetAppliedState()
+  results.append(summarize('logicAct.scrub', timeFrames(logic, animationNode, scrubTimes),
+                           actions=arguments.actions, frames=arguments.frames))
+
+  start = time.perf_counter()
+  baked = logic.getPlan(animationNode).bake(arguments.bakeBudget, slicer.app.temporaryPath)
+  results.append(summarize('bake', [time.perf_counter() - start], bytesInMemory=baked.memoryUsed,
+                           spilled=baked.spillPath is not None))
+  logic.getPlan(animationNode).resetAppliedState()
+  results.append(summarize('logicAct.baked', timeFrames(logic, animationNode, frameTimes),
+                           actions=arguments.actions, frames=arguments.frames))
+  logic.getPlan(animationNode).releaseBake()
+
+  for className in BENCHMARK_CLASSES:
+    actions = [addAction(scene, className, index, duration, arguments.points, rng)
+               for index in range(arguments.actions)]
+    classNode = newAnimation(scene, logic, actions, duration, arguments.framesPerSecond)
+    plan = logic.getPlan(classNode)
+    plan.bind()
+    durations = []
+    for act, action in plan.steps:
+      start = time.perf_counter()
+      for scriptTime in frameTimes:
+        act(action, scriptTime)
+      durations.append((time.perf_counter() - start) / len(frameTimes))
+    results.append(summarize('pluginAct.' + className, durations, actions=arguments.actions,
+                             frames=arguments.frames, points=arguments.points))
+    # the plan plays batched plugins together
+    plan.resetAppliedState()
+    results.append(summarize('planAct.' + className, timeFrames(logic, classNode, frameTimes),
+                             actions=arguments.actions, frames=arguments.frames))
+
+  return results
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Time the Animator engine and print JSON results")
+  parser.add_argument('--actions', type=int, default=20, help="actions in the animated scene (N)")
+  parser.add_argument('--frames', type=int, default=300, help="frames to play (M)")
+  parser.add_argument('--points', type=int, default=256, help="control points per transfer function (K)")
+  parser.add_argument('--frames-per-second', dest='framesPerSecond', type=float, default=30)
+  parser.add_argument('--repeat', type=int, default=3, help="repetitions of the whole-script measurements")
+  parser.add_argument('--bake-budget', dest='bakeBudget', type=int, default=256 * 1024 * 1024,
+                      help="bytes of baked samples kept in memory")
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--output', help="file for the JSON results, printed if omitted")
+  arguments = parser.parse_args(argv)
+
+  try:
+    import slicer
+    standIns = not hasattr(slicer, 'mrmlScene')
+  except ImportError:
+    standIns = True
+  if standIns:
+    installStandIns()
+  modulePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+  if modulePath not in sys.path:
+    sys.path.insert(0, modulePath)
+
+  report = {
+    'benchmark': 'Animator',
+    'parameters': vars(arguments),
+    'environment': {
+      'python': platform.python_version(),
+      'platform': platform.platform(),
+      'numpy': numpy.__version__,
+      'vtk': vtk.vtkVersion.GetVTKVersion(),
+      'slicer': 'stand-in' if standIns else getattr(sys.modules['slicer'].app, 'applicationVersion', 'unknown'),
+    },
+    'results': run(arguments),
+  }
+  reportJSON = json.dumps(report, indent=2)
+  if arguments.output:
+    with open(arguments.output, 'w') as outputFile:
+      outputFile.write(reportJSON)
+  else:
+    print(reportJSON)
+
+if __name__ == '__main__':
+  main()